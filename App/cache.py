@@ -0,0 +1,318 @@
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+from App.database import db
+from App.metrics import CACHE_REQUESTS
+
+
+class TTLCache:
+  """
+  A bounded, thread-safe mapping whose entries expire after `ttl` seconds. Once full,
+  the least recently used entry is evicted. A maxsize or ttl of 0 disables the cache.
+  Lookups of a named cache are counted in the cache_requests_total metric.
+  """
+
+  def __init__(self, maxsize=1024, ttl=60, name=None):
+    self.name = name
+    self._lock = threading.Lock()
+    self._entries = OrderedDict()  # key -> (expires, value), least recently used first
+    self.configure(maxsize, ttl)
+
+  def configure(self, maxsize, ttl):
+    with self._lock:
+      self.maxsize = maxsize
+      self.ttl = ttl
+      self.hits = self.misses = 0
+      self._clear()
+
+  @property
+  def enabled(self):
+    return self.maxsize > 0 and self.ttl > 0
+
+  def __len__(self):
+    return len(self._entries)
+
+  def get(self, key, default=None):
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None or entry[0] < time.monotonic():
+        if entry is not None:
+          self._discard(key)
+        self.misses += 1
+        self._count('miss')
+        return default
+      self._entries.move_to_end(key)
+      self.hits += 1
+      self._count('hit')
+      return entry[1]
+
+  def _count(self, result):
+    if self.name:
+      CACHE_REQUESTS.inc(cache=self.name, result=result)
+
+  def set(self, key, value):
+    if not self.enabled:
+      return
+    with self._lock:
+      self._entries[key] = (time.monotonic() + self.ttl, value)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.maxsize:
+        self._discard(next(iter(self._entries)))
+
+  def pop(self, key):
+    with self._lock:
+      self._discard(key)
+
+  def clear(self):
+    with self._lock:
+      self._clear()
+
+  # the only places entries leave, so subclasses can keep their own bookkeeping in step
+  def _discard(self, key):
+    self._entries.pop(key, None)
+
+  def _clear(self):
+    self._entries.clear()
+
+  def stats(self):
+    """
+    Returns:
+        dict: The entry count, capacity, ttl, hits and misses.
+    """
+    return {"size": len(self._entries), "maxsize": self.maxsize, "ttl": self.ttl, "hits": self.hits, "misses": self.misses}
+
+
+_MISSING = object()
+
+
+class DependencyCache(TTLCache):
+  """
+  A TTLCache whose entries also name what they were built from, e.g. the reviewers whose
+  names a student document shows, so that a change to any of those drops every entry
+  built from it. A value built while anything was being invalidated is not stored,
+  since it may have been read before the change committed.
+  """
+
+  def __init__(self, maxsize=1024, ttl=60, name=None):
+    self._dependents = {}  # dependency -> keys of the entries built from it
+    self._dependencies = {}  # key -> its dependencies
+    self.invalidations = 0
+    super().__init__(maxsize, ttl, name)
+    self.invalidations = 0  # not the clear configure() made
+
+  def fetch(self, key, build):
+    """
+    Get an entry, building and storing it on a miss.
+
+    Args:
+        key: The cache key.
+        build: Called without arguments on a miss; returns (value, dependencies). A value
+            of None is returned but not stored.
+
+    Returns:
+        The cached or newly built value.
+    """
+    value = self.get(key, _MISSING)
+    if value is not _MISSING:
+      return value
+    started = self.invalidations
+    value, dependencies = build()
+    if value is not None:
+      self.set(key, value, dependencies, started)
+    return value
+
+  def set(self, key, value, dependencies=(), since=None):
+    if not self.enabled:
+      return
+    with self._lock:
+      if since is not None and since != self.invalidations:
+        return
+      self._discard(key)
+      self._dependencies[key] = frozenset(dependencies)
+      for dependency in self._dependencies[key]:
+        self._dependents.setdefault(dependency, set()).add(key)
+      self._entries[key] = (time.monotonic() + self.ttl, value)
+      while len(self._entries) > self.maxsize:
+        self._discard(next(iter(self._entries)))
+
+  def invalidate(self, keys=(), dependencies=()):
+    """
+    Drop the entries with the given keys and those built from any of the given dependencies.
+    """
+    with self._lock:
+      self.invalidations += 1
+      for dependency in dependencies:
+        for key in list(self._dependents.get(dependency, ())):
+          self._discard(key)
+      for key in keys:
+        self._discard(key)
+
+  def _discard(self, key):
+    self._entries.pop(key, None)
+    for dependency in self._dependencies.pop(key, ()):
+      dependents = self._dependents.get(dependency)
+      dependents.discard(key)
+      if not dependents:
+        del self._dependents[dependency]
+
+  def _clear(self):
+    self._entries.clear()
+    self._dependents.clear()
+    self._dependencies.clear()
+    self.invalidations += 1
+
+  def stats(self):
+    """
+    Returns:
+        dict: The entry count, capacity, ttl, hits, misses and invalidations.
+    """
+    return {**super().stats(), "invalidations": self.invalidations}
+
+
+def invalidate_on_commit(session, cache, keys=(), dependencies=()):
+  """
+  Invalidate cache entries once the session's transaction commits, so that a concurrent
+  reader cannot cache the old data again in between; nothing is invalidated if it rolls
+  back. Outside a transaction the entries are invalidated at once.
+  """
+  if not session.in_transaction():
+    cache.invalidate(keys, dependencies)
+    return
+  session.info.setdefault('cache_invalidations', []).append((cache, tuple(keys), tuple(dependencies)))
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed(session):
+  for cache, keys, dependencies in session.info.pop('cache_invalidations', ()):
+    cache.invalidate(keys, dependencies)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_invalidations(session):
+  session.info.pop('cache_invalidations', None)
+
+
+class VersionedCache:
+  """
+  Keeps the value built for the newest version of each key, e.g. a serialized response
+  per ranking version. A lookup for a version that is not cached yet builds it in one
+  caller while concurrent lookups of the same key and version wait for that result
+  instead of building it again. Once full, the least recently used key is evicted.
+  """
+
+  def __init__(self, maxsize=32, name=None):
+    self.maxsize = maxsize
+    self.name = name
+    self.hits = self.misses = 0
+    self._lock = threading.Lock()
+    self._entries = OrderedDict()  # key -> (version, value), least recently used first
+    self._building = {}            # (key, version) -> _Build
+
+  def __len__(self):
+    return len(self._entries)
+
+  def get(self, key, version, build):
+    """
+    Args:
+        key: The cache key.
+        version: The version the value must have been built for.
+        build: Called without arguments to build the value on a miss.
+
+    Returns:
+        The cached or newly built value.
+    """
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None and entry[0] == version:
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self._count('hit')
+        return entry[1]
+      self.misses += 1
+      self._count('miss')
+      pending = self._building.get((key, version))
+      leader = pending is None
+      if leader:
+        pending = self._building[(key, version)] = _Build()
+
+    if not leader:
+      pending.done.wait()
+      if pending.failed:
+        return build()
+      return pending.value
+
+    try:
+      pending.value = build()
+    except BaseException:
+      pending.failed = True
+      raise
+    finally:
+      with self._lock:
+        del self._building[(key, version)]
+        current = self._entries.get(key)
+        if not pending.failed and self.maxsize > 0 and (current is None or current[0] <= version):
+          self._entries[key] = (version, pending.value)
+          self._entries.move_to_end(key)
+          while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+      pending.done.set()
+    return pending.value
+
+  def _count(self, result):
+    if self.name:
+      CACHE_REQUESTS.inc(cache=self.name, result=result)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+
+  def stats(self):
+    """
+    Returns:
+        dict: The entry count, capacity, hits and misses.
+    """
+    return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class _Build:
+  __slots__ = ('done', 'value', 'failed')
+
+  def __init__(self):
+    self.done = threading.Event()
+    self.value = None
+    self.failed = False
+
+
+def detached_copy(instance):
+  """
+  Copy the loaded column values of a persistent instance into a new detached instance
+  with the same identity, which can be shared between sessions and brought into one with
+  Session.merge(copy, load=False) without a query. Relationships are left unloaded.
+
+  Args:
+      instance: A persistent model instance.
+
+  Returns:
+      A detached instance of the same class.
+  """
+  mapper = db.inspect(instance).mapper
+  copy = mapper.class_manager.new_instance()
+  for attribute in mapper.column_attrs:
+    set_committed_value(copy, attribute.key, getattr(instance, attribute.key))
+  make_transient_to_detached(copy)
+  return copy
+
+
+# (role, ID) -> detached user, for resolving the user of a JWT without a query
+identity_cache = DependencyCache(name='identity')
+
+# limit -> serialized /rankings body, per ranking version
+rankings_cache = VersionedCache(name='rankings')
+
+# student ID -> Student.to_json() without karmaRank, which is read from the leaderboard
+student_documents = DependencyCache(name='student_documents')
@@ -24,6 +24,36 @@ def load_config():
     config['PREFERRED_URL_SCHEME'] = 'https'
     config['UPLOADED_PHOTOS_DEST'] = "App/uploads"
     config["JWT_TOKEN_LOCATION"] = ["headers"]
+    config['PAGE_SIZE'] = int(os.environ.get('PAGE_SIZE', 100))
+    config['MAX_PAGE_SIZE'] = int(os.environ.get('MAX_PAGE_SIZE', 1000))
+    config['STREAM_CHUNK_SIZE'] = int(os.environ.get('STREAM_CHUNK_SIZE', 500))
+    config['COUNTER_SHARDS'] = int(os.environ.get('COUNTER_SHARDS', 0))
+    config['SEARCH_BACKEND'] = os.environ.get('SEARCH_BACKEND', 'auto')
+    config['SEARCH_LIMIT'] = int(os.environ.get('SEARCH_LIMIT', 20))
+    config['SEARCH_MIN_SIMILARITY'] = float(os.environ.get('SEARCH_MIN_SIMILARITY', 0.3))
+    config['SEARCH_INDEX_TTL'] = float(os.environ.get('SEARCH_INDEX_TTL', 60))
+    config['TYPEAHEAD_LIMIT'] = int(os.environ.get('TYPEAHEAD_LIMIT', 10))
+    config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:260000')
+    config['IMPORT_CHUNK_SIZE'] = int(os.environ.get('IMPORT_CHUNK_SIZE', 1000))
+    config['IMPORT_HASH_WORKERS'] = int(os.environ.get('IMPORT_HASH_WORKERS', 0))  # for 'flask import'; 0: one per CPU
+    config['IDENTITY_CACHE_SIZE'] = int(os.environ.get('IDENTITY_CACHE_SIZE', 1024))
+    config['IDENTITY_CACHE_TTL'] = float(os.environ.get('IDENTITY_CACHE_TTL', 60))
+    config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 100))  # 0: no slow-query log
+    config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING', '').lower() in ('1', 'true', 'yes')  # always on in debug
+    config['METRICS_DIR'] = os.environ.get('METRICS_DIR', '')  # shared by gunicorn workers; see gunicorn.conf.py
+    config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN', '')  # if set, /metrics requires it as a bearer token
+    config['PROFILE_EVERY'] = int(os.environ.get('PROFILE_EVERY', 0))  # profile 1 in N requests; 0: only those with an X-Profile token
+    config['PROFILE_SLOW_MS'] = float(os.environ.get('PROFILE_SLOW_MS', 0))  # keep only profiles of requests at least this slow
+    config['PROFILER'] = os.environ.get('PROFILER', 'sampler')  # or 'cprofile'
+    config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', '')  # default: instance/profiles
+    config['PROFILE_KEEP'] = int(os.environ.get('PROFILE_KEEP', 50))  # files kept per route
+    config['PROFILE_TOKEN_MAX_AGE'] = int(os.environ.get('PROFILE_TOKEN_MAX_AGE', 3600))
+    config['STUDENT_CACHE_SIZE'] = int(os.environ.get('STUDENT_CACHE_SIZE', 2048))
+    config['STUDENT_CACHE_TTL'] = float(os.environ.get('STUDENT_CACHE_TTL', 30))  # bounds how long other workers may serve a changed profile
+    config['RANK_WORKER'] = os.environ.get('RANK_WORKER', 'thread')
+    config['RANK_RECOMPUTE_INTERVAL'] = float(os.environ.get('RANK_RECOMPUTE_INTERVAL', 5))
+    config['RANKING_SYNC_INTERVAL'] = float(os.environ.get('RANKING_SYNC_INTERVAL', 1))
+    config['VOTE_BATCH_LIMIT'] = int(os.environ.get('VOTE_BATCH_LIMIT', 200))
     return config
 
 config = load_config()
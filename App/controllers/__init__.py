@@ -1,6 +1,8 @@
+from .pagination import *
 from .user import *
 from .auth import *
 from .review import *
 from .student import *
 from .karma import *
 from .staff import * 
+from .importer import *
@@ -3,43 +3,108 @@ from flask_login import current_user, LoginManager, login_user
 from App.database import db
 from flask_jwt_extended import create_access_token, jwt_required, JWTManager
 from flask import jsonify
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
 
-from App.models import Staff, Student, Admin, User
+from App.models import Staff, Student, Admin, User, UserDirectory, USER_ROLES, role_of
+from App.cache import identity_cache, detached_copy, invalidate_on_commit
 
 
-def jwt_authenticate(id, password):
-  staff = Staff.query.filter_by(ID=id).first()
-  if staff and staff.check_password(password):
-    return create_access_token(identity=id)
+def authenticate(id, password, roles=None):
+  """
+  Check a user's credentials with one directory lookup, one user lookup and one password
+  hash. A password stored with outdated hash parameters is hashed again with the current
+  ones while it is known.
+
+  Args:
+      id (str): The user's ID.
+      password (str): The plaintext password.
+      roles (tuple, optional): The models the user must be one of, e.g. (Staff, Student).
+
+  Returns:
+      Admin, Staff or Student: The user, or None if the credentials are wrong.
+  """
+  user = UserDirectory.lookup(id)
+  if user is None or (roles and not isinstance(user, roles)):
+    return None
+  if not user.check_password(password):
+    return None
+
+  if user.needsRehash():
+    user.set_password(password)
+    db.session.commit()
+  return user
+
+def issue_token(user):
+  """
+  Create an access token for an authenticated user, carrying their role.
 
-  student = Student.query.filter_by(ID=id).first()
-  if student and student.check_password(password):
-    return create_access_token(identity=id)	
+  Args:
+      user: The user returned by authenticate.
+
+  Returns:
+      str: The JWT.
+  """
+  return create_access_token(identity=user)
+
+def jwt_authenticate(id, password):
+  user = authenticate(id, password, (Staff, Student))
+  if user:
+    return issue_token(user)
 
   return None
 
 def jwt_authenticate_admin(id, password):
-  admin = Admin.query.filter_by(ID=id).first()
-  if admin and admin.check_password(password):
-    return create_access_token(identity=id)
+  user = authenticate(id, password, (Admin,))
+  if user:
+    return issue_token(user)
 
   return None
 
 
-def login(id, password):    
+def resolve_identity(role, ID):
+  """
+  Get the user a token was issued to with one primary key lookup, or none when the
+  identity cache holds them.
 
-    staff = Staff.query.filter_by(ID=id).first()
-    if staff and staff.check_password(password):
-        return staff
+  Args:
+      role (str): The token's role claim.
+      ID (str): The token's subject.
 
-    student = Student.query.filter_by(ID=id).first()
-    if student and student.check_password(password):
-        return student
+  Returns:
+      The user in the current session, or None if they no longer exist.
+  """
+  model = USER_ROLES[role]
+  cached = identity_cache.get((role, ID))
+  if cached is not None:
+    return db.session.merge(cached, load=False)
 
-    admin = Admin.query.filter_by(ID=id).first()
-    if admin and admin.check_password(password):
-        return admin
-    return None
+  # a copy read while the user was being changed is not kept (see DependencyCache)
+  started = identity_cache.invalidations
+  user = db.session.get(model, ID)
+  if user is not None:
+    identity_cache.set((role, ID), detached_copy(user), since=started)
+  return user
+
+
+def invalidate_identity(user):
+  """
+  Drop a user from this process's identity cache once the change to them commits, so a
+  concurrent request cannot cache the old row again in between. Other processes hold on
+  to theirs for at most IDENTITY_CACHE_TTL seconds.
+  """
+  invalidate_on_commit(object_session(user) or db.session, identity_cache, keys=[(role_of(user), user.ID)])
+
+
+# covers update_student, Admin.updateStudent and any other change to a user
+@event.listens_for(User, 'after_update', propagate=True)
+@event.listens_for(User, 'after_delete', propagate=True)
+def _invalidate_changed_user(mapper, connection, user):
+  invalidate_identity(user)
+
+
+def login(id, password):    
+    return authenticate(id, password)
 
 
 def setup_flask_login(app):
@@ -48,55 +113,35 @@ def setup_flask_login(app):
 
   @login_manager.user_loader
   def load_user(user_id):
-    staff = Staff.query.get(user_id)
-    if staff:
-      return staff
-
-    student = Student.query.get(user_id)
-    if student:
-      return student
-
-    admin = Admin.query.get(user_id)
-    if admin:
-      return admin
-    return login_manager
+    return UserDirectory.lookup(user_id)
+  return login_manager
 
 
 def setup_jwt(app):
   jwt = JWTManager(app)
+  identity_cache.configure(app.config['IDENTITY_CACHE_SIZE'], app.config['IDENTITY_CACHE_TTL'])
 
+  # tokens are minted with the user as the identity, so neither loader needs a query
   @jwt.user_identity_loader
   def user_identity_lookup(identity):
-    admin = Admin.query.filter_by(ID=identity).one_or_none()
-    if admin:
-      return admin.ID
-
-    staff = Staff.query.filter_by(ID=identity).one_or_none()
-    if staff:
-      return staff.ID
-
-    student= Student.query.filter_by(ID=identity).one_or_none() 
-    if student:
-      return student.ID
-
-    return None
+    if isinstance(identity, User):
+      return identity.ID
+    return identity
 
+  @jwt.additional_claims_loader
+  def add_role_claim(identity):
+    if isinstance(identity, User):
+      return {"role": role_of(identity)}
+    return {}
 
   @jwt.user_lookup_loader
   def user_lookup_callback(_jwt_header, jwt_data):
       identity = jwt_data["sub"]
+      if jwt_data.get("role") in USER_ROLES:
+          return resolve_identity(jwt_data["role"], identity)
 
-      admin = Admin.query.filter_by(ID=identity).one_or_none()
-      if admin:
-          return admin
-
-      staff = Staff.query.filter_by(ID=identity).one_or_none()
-      if staff:
-          return staff
-
-      student = Student.query.filter_by(ID=identity).one_or_none()
-      if student:
-          return student
+      # tokens minted from a bare ID carry no role
+      return UserDirectory.lookup(identity)
   return jwt
 
 
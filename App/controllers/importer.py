@@ -0,0 +1,218 @@
+import csv
+import io
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from flask import current_app
+from sqlalchemy.exc import DataError, IntegrityError
+from werkzeug.security import generate_password_hash
+
+from App.database import db
+from App.models import Staff, Student, UserDirectory
+from App.models.user import password_hash_method
+from App.search import ngram_index
+
+STUDENT_TYPES = ('Full-Time', 'Part-Time', 'Evening')
+
+# role -> (model, the field holding the ID, the other required fields); the ID may also be given as 'ID'
+IMPORT_ROLES = {
+    'student': (Student, 'studentID', ['firstname', 'lastname', 'password', 'contact', 'studentType', 'yearOfStudy']),
+    'staff': (Staff, 'staffID', ['firstname', 'lastname', 'password', 'email', 'teachingExperience']),
+}
+
+
+def _row_ID(role, row):
+    _, IDField, _ = IMPORT_ROLES[role]
+    ID = (row or {}).get(IDField) or (row or {}).get('ID')
+    return str(ID).strip() if ID not in (None, '') else None
+
+
+def read_rows(stream, format='csv'):
+    """
+    Read user rows from a CSV file with a header line, or from newline-delimited JSON,
+    one row at a time.
+
+    Args:
+        stream: A text or binary file object.
+        format (str, optional): 'csv' (default) or 'ndjson'.
+
+    Yields:
+        tuple: (line number, dict of the row's fields). A malformed JSON line yields None as its fields.
+    """
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield number, row if isinstance(row, dict) else None
+
+
+def validate_row(role, row):
+    """
+    Check an imported row and convert it to the column values of a user.
+
+    Args:
+        role (str): 'student' or 'staff'.
+        row (dict): The row's fields.
+
+    Returns:
+        tuple: (values, None) for a valid row, or (None, error message).
+    """
+    if row is None:
+        return None, 'malformed row'
+    model, IDField, fields = IMPORT_ROLES[role]
+    row = {key.strip(): value.strip() if isinstance(value, str) else value for key, value in row.items() if key}
+
+    values = {'ID': _row_ID(role, row)}
+    if values['ID'] is None:
+        return None, f'missing {IDField}'
+    for field in fields:
+        if row.get(field) in (None, ''):
+            return None, f'missing {field}'
+        values[field] = row[field]
+
+    # the password column holds the hash, whose length depends only on the hash method
+    for field, value in values.items():
+        length = getattr(model.__table__.c[field].type, 'length', None)
+        if field != 'password' and length and len(str(value)) > length:
+            return None, f"{field} longer than {length} characters"
+    try:
+        if role == 'student':
+            values['studentType'] = str(values['studentType']).title()
+            if values['studentType'] not in STUDENT_TYPES:
+                return None, f"invalid studentType {row['studentType']!r}"
+            values['yearOfStudy'] = int(values['yearOfStudy'])
+        else:
+            values['teachingExperience'] = int(values['teachingExperience'])
+    except ValueError as e:
+        return None, f'not a number: {e}'
+    return values, None
+
+
+def _hash_passwords(passwords, method, pool):
+    if pool is None:
+        return [generate_password_hash(password, method=method) for password in passwords]
+    return list(pool.map(generate_password_hash, passwords, [method] * len(passwords), chunksize=64))
+
+
+def _import_chunk(role, chunk, seen, method, pool, report):
+    model = IMPORT_ROLES[role][0]
+    valid = []
+    for line, row in chunk:
+        values, error = validate_row(role, row)
+        if error is None and values['ID'] in seen:
+            error = f"duplicate ID {values['ID']} in the file"
+        if error:
+            report['errors'].append({"line": line, "ID": _row_ID(role, row), "error": error})
+            continue
+        seen.add(values['ID'])
+        valid.append((line, values))
+    if not valid:
+        return
+
+    # one IN query per chunk checks the IDs against every role
+    taken = {ID for ID, in db.session.query(UserDirectory.ID).filter(UserDirectory.ID.in_([values['ID'] for _, values in valid]))}
+    pending = []
+    for line, values in valid:
+        if values['ID'] in taken:
+            report['errors'].append({"line": line, "ID": values['ID'], "error": f"a user already uses the ID {values['ID']}"})
+        else:
+            pending.append((line, values))
+    if not pending:
+        return
+
+    hashed = _hash_passwords([values['password'] for _, values in pending], method, pool)
+    for (_, values), password in zip(pending, hashed):
+        values['password'] = password
+    try:
+        inserted = _insert_users(model, role, [values for _, values in pending])
+    except (IntegrityError, DataError):
+        # e.g. an ID a concurrent create claimed after the check above, or a value the
+        # database rejects; each row then goes in on its own so only the bad ones are skipped
+        db.session.rollback()
+        inserted = []
+        for line, values in pending:
+            try:
+                inserted += _insert_users(model, role, [values])
+            except (IntegrityError, DataError) as e:
+                db.session.rollback()
+                report['errors'].append({"line": line, "ID": values['ID'], "error": f'rejected by the database: {e.orig}'})
+    report['imported'] += len(inserted)
+
+    # bulk inserts skip the mapper events that keep the in-process search index current
+    if role == 'student' and ngram_index.loadedAt is not None:
+        for values in inserted:
+            ngram_index.set(values['ID'], f"{values['firstname']} {values['lastname']}")
+
+
+def _insert_users(model, role, rows):
+    # one transaction inserting the users and their directory entries with executemany
+    db.session.execute(model.__table__.insert(), rows)
+    db.session.execute(UserDirectory.__table__.insert(), [{'ID': values['ID'], 'role': role} for values in rows])
+    db.session.commit()
+    return rows
+
+
+def hash_workers(workers=None):
+    """
+    Get the number of password hashing processes for a command-line import.
+
+    Returns:
+        int: `workers`, else IMPORT_HASH_WORKERS, else one per CPU.
+    """
+    return workers or current_app.config['IMPORT_HASH_WORKERS'] or os.cpu_count()
+
+
+def import_users(role, rows, chunk_size=None, workers=1):
+    """
+    Create students or staff in bulk from rows read by read_rows. Rows are validated and
+    inserted a chunk at a time with executemany, each chunk in its own transaction, and
+    passwords are hashed in this process or, given several workers, in a process pool
+    started for the import. Invalid rows and rows whose ID is taken are skipped and
+    reported; the rest are imported.
+
+    Args:
+        role (str): 'student' or 'staff'.
+        rows (iterable): (line number, fields) pairs.
+        chunk_size (int, optional): Rows per chunk. Defaults to IMPORT_CHUNK_SIZE.
+        workers (int, optional): Hashing processes. Defaults to 1, hashing in this process, as
+            web requests must: a pool per request would fork processes in every worker.
+            The CLI uses hash_workers().
+
+    Returns:
+        dict: The role, the number of users imported and an error for each skipped row.
+
+    Raises:
+        ValueError: If the role is unknown.
+    """
+    if role not in IMPORT_ROLES:
+        raise ValueError(f'cannot import {role!r} users')
+    chunk_size = chunk_size or current_app.config['IMPORT_CHUNK_SIZE']
+    method = password_hash_method()
+    report = {"role": role, "imported": 0, "errors": []}
+    seen = set()
+
+    rows = iter(rows)
+    pool = ProcessPoolExecutor(workers) if workers > 1 else None
+    try:
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            _import_chunk(role, chunk, seen, method, pool, report)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return report
@@ -1,5 +1,8 @@
-from App.models import Karma, Student
+from App.models import Karma, Student, RankingState, fold_counter_shards
 from App.database import db
+from App.leaderboard import rebuild_leaderboard
+from App.metrics import timed
+from App.cache import student_documents
 
 def get_karma_by_id(karma_id):
     """
@@ -13,9 +16,11 @@ def get_karma_by_id(karma_id):
     """
     return db.session.query(Karma).get(karma_id)
 
+@timed('karma_recalculate')
 def calculate_student_karma(student):
     """
-    Calculate the karma for a given student.
+    Recalculate the karma for a given student from all of their reviews.
+    Karma is normally maintained incrementally, so this is a repair path.
 
     Args:
         student (Student): The Student instance for which to calculate karma.
@@ -35,33 +40,58 @@ def calculate_student_karma(student):
         print('error calculating student karma')
         db.session.rollback()
 
+def repair_student_karma():
+    """
+    Recalculate the karma of every student from their reviews and re-rank them.
+
+    Returns:
+        int: The number of students whose karma was recalculated.
+    """
+    fold_counter_shards()
+    students = db.session.query(Student).all()
+    for student in students:
+        calculate_student_karma(student)
+    update_student_karma_rankings()
+    rebuild_leaderboard()
+    student_documents.clear()
+    return len(students)
+
+@timed('rank_update')
 def update_student_karma_rankings():
     """
     Update the karma rankings for all students based on their karma scores.
+
+    Returns:
+        int: The number of karma records whose rank changed, or None on error.
     """
-    students_with_karma = db.session.query(Student, Karma)\
-        .join(Karma, Student.karmaID == Karma.karmaID)\
-        .order_by(db.desc(Karma.score))\
-        .all()
-
-    rank = 1
-    prev_score = None
-
-    for student, karma in students_with_karma:
-        if prev_score is None:
-            prev_score = karma.score
-            karma.rank = rank
-        elif prev_score == karma.score:
-            karma.rank = rank
-        else:
-            rank += 1
-            karma.rank = rank
-            prev_score = karma.score
+    fold_counter_shards()
+    return Karma.updateRank()
+
+def request_rank_update():
+    """
+    Ask the rank worker to recompute the karma rankings on its next run.
+
+    Returns:
+        RankingState: The ranking state.
+    """
+    return RankingState.requestUpdate()
+
+def get_ranking_state():
+    """
+    Get the version of the stored karma rankings and when they were last computed.
+
+    Returns:
+        RankingState: The ranking state.
+    """
+    return RankingState.get()
+
+@timed('counter_fold')
+def fold_counters():
+    """
+    Move the votes and karma held in counter shards into the review and karma records.
+
+    Returns:
+        int: The number of shard rows folded.
+    """
+    return fold_counter_shards()
 
-        student.karmaID = karma.karmaID
-    
-    try:
-        db.session.commit()
-    except Exception as e:
-        print('error calculating karma')
-        db.session.rollback()
\ No newline at end of file
@@ -0,0 +1,122 @@
+import base64
+import json
+from datetime import datetime
+
+from App.database import db
+
+
+class Page:
+    """
+    One page of a keyset-paginated listing.
+
+    Attributes:
+        items (list): The rows on this page.
+        next (str or None): Opaque cursor for the following page, None on the last page.
+        estimate (int or None): Estimated total number of rows, if one was asked for and is available.
+    """
+
+    def __init__(self, items, next=None, estimate=None):
+        self.items = items
+        self.next = next
+        self.estimate = estimate
+
+
+def encode_cursor(values):
+    """
+    Encode the sort key of the last row on a page as an opaque cursor.
+
+    Args:
+        values (list): The sort key values (str, int, float or datetime).
+
+    Returns:
+        str: A URL-safe cursor.
+    """
+    values = [{'dt': value.isoformat()} if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and value.keys() == {'dt'} and isinstance(value['dt'], str):
+        return datetime.fromisoformat(value['dt'])
+    if isinstance(value, (str, int, float)) and not isinstance(value, bool):
+        return value
+    raise ValueError
+
+
+def decode_cursor(cursor, length):
+    """
+    Decode a cursor produced by encode_cursor.
+
+    Args:
+        cursor (str): The cursor.
+        length (int): The number of sort keys the cursor must hold.
+
+    Returns:
+        list: The sort key values.
+
+    Raises:
+        ValueError: If the cursor is malformed or does not match the sort keys.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != length:
+            raise ValueError
+        return [_decode_value(value) for value in values]
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError(f'invalid cursor {cursor!r}')
+
+
+def estimate_rows(model):
+    """
+    Estimate the number of rows in a model's table from planner statistics, without COUNT(*).
+
+    Args:
+        model: The model class.
+
+    Returns:
+        int or None: The estimate, or None if the database keeps no statistics for the table.
+    """
+    table = model.__tablename__
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        estimate = db.session.execute(
+            db.text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)"), {'table': table}).scalar()
+        return max(int(estimate), 0) if estimate is not None else None
+    if dialect == 'sqlite':
+        # sqlite_stat1 only exists once ANALYZE has run
+        analyzed = db.session.execute(
+            db.text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")).scalar()
+        if analyzed:
+            stat = db.session.execute(
+                db.text("SELECT stat FROM sqlite_stat1 WHERE tbl = :table ORDER BY idx IS NOT NULL LIMIT 1"), {'table': table}).scalar()
+            return int(stat.split()[0]) if stat else None
+    return None
+
+
+def paginate(query, keys, limit, cursor=None):
+    """
+    Fetch one page of a query ordered by a unique sort key, starting after a cursor.
+
+    Args:
+        query: The query to paginate.
+        keys (list): Columns that together uniquely order the rows, e.g. [Review.created, Review.ID].
+        limit (int): The page size.
+        cursor (str, optional): The cursor returned with the previous page.
+
+    Returns:
+        Page: The rows on the page and the cursor for the next one.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    query = query.order_by(*keys)
+    if cursor:
+        values = decode_cursor(cursor, len(keys))
+        after = [db.literal(value, type_=key.type) for key, value in zip(keys, values)]
+        query = query.filter(db.tuple_(*keys) > db.tuple_(*after))
+
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return Page(rows)
+    rows = rows[:limit]
+    return Page(rows, encode_cursor([getattr(rows[-1], key.key) for key in keys]))
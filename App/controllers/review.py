@@ -1,7 +1,10 @@
-from App.models import Review, Karma, Student
-from App.database import db
-from .student import search_student
-from .karma import get_karma_by_id
+from datetime import datetime
+from App.models import Review, ReviewVote, ReviewCounterShard, Karma, Student, load
+from App.database import db, run_with_retry
+from App.metrics import timed
+from App.cache import student_documents
+from .pagination import paginate, estimate_rows
+from .karma import repair_student_karma
 
 def get_reviews():
     """
@@ -10,7 +13,37 @@ def get_reviews():
     Returns:
         List[Review]: A list of Review objects.
     """
-    return db.session.query(Review).all()
+    return load(Review, 'detail').all()
+
+def get_reviews_page(limit, cursor=None, estimate=False):
+    """
+    Retrieve one page of reviews, oldest first.
+
+    Args:
+        limit (int): The page size.
+        cursor (str, optional): The cursor returned with the previous page.
+        estimate (bool, optional): Include an estimated total number of reviews.
+
+    Returns:
+        Page: The reviews on the page and the cursor for the next one.
+    """
+    page = paginate(load(Review, 'detail'), [Review.created, Review.ID], limit, cursor)
+    if estimate:
+        page.estimate = estimate_rows(Review)
+    return page
+
+def iter_reviews(chunk_size=500):
+    """
+    Iterate over all reviews, oldest first, through a server-side cursor.
+
+    Args:
+        chunk_size (int, optional): Rows fetched per round trip. Defaults to 500.
+
+    Yields:
+        Review: Each review in turn.
+    """
+    query = load(Review, 'detail').order_by(Review.created, Review.ID)
+    yield from query.execution_options(stream_results=True).yield_per(chunk_size)
 
 def get_reviews_for_student(studentID):
     """
@@ -22,19 +55,35 @@ def get_reviews_for_student(studentID):
     Returns:
         List[Review]: A list of Review objects associated with the specified student.
     """
-    return db.session.query(Review).filter_by(studentID=studentID).all()
+    return load(Review, 'detail').filter_by(studentID=studentID).all()
 
-def get_review(reviewID):
+def get_reviews_for_student_page(studentID, limit, cursor=None):
+    """
+    Retrieve one page of the reviews associated with a specific student, oldest first.
+
+    Args:
+        studentID (str): The ID of the student.
+        limit (int): The page size.
+        cursor (str, optional): The cursor returned with the previous page.
+
+    Returns:
+        Page: The reviews on the page and the cursor for the next one.
+    """
+    query = load(Review, 'detail').filter_by(studentID=studentID)
+    return paginate(query, [Review.created, Review.ID], limit, cursor)
+
+def get_review(reviewID, profile='detail'):
     """
     Retrieve a review by its ID.
 
     Args:
         reviewID (int): The ID of the review.
+        profile (str, optional): The loading profile, 'detail' (default) or 'vote-check'.
 
     Returns:
         Review or None: The Review object if found, or None if not found.
     """
-    return Review.query.filter_by(ID=reviewID).first()
+    return load(Review, profile).filter_by(ID=reviewID).first()
 
 def get_reviews_by_staff(staffID):
     """
@@ -46,7 +95,22 @@ def get_reviews_by_staff(staffID):
     Returns:
         List[Review]: A list of Review objects created by the specified staff member.
     """
-    return db.session.query(Review).filter_by(reviewerID=staffID).all()
+    return load(Review, 'detail').filter_by(reviewerID=staffID).all()
+
+def get_reviews_by_staff_page(staffID, limit, cursor=None):
+    """
+    Retrieve one page of the reviews created by a staff member, oldest first.
+
+    Args:
+        staffID (str): The ID of the staff member.
+        limit (int): The page size.
+        cursor (str, optional): The cursor returned with the previous page.
+
+    Returns:
+        Page: The reviews on the page and the cursor for the next one.
+    """
+    query = load(Review, 'detail').filter_by(reviewerID=staffID)
+    return paginate(query, [Review.created, Review.ID], limit, cursor)
 
 def edit_review(review, staff, isPositive, comment):
     """
@@ -62,7 +126,7 @@ def edit_review(review, staff, isPositive, comment):
         Review or None: The edited review if successful, else None.
     """
     if review.reviewer == staff:
-        edited = review.editReview(staff, isPositive, comment)
+        edited = run_with_retry(lambda: review.editReview(staff, isPositive, comment))
 
         if edited:
             return review
@@ -83,10 +147,11 @@ def delete_review(review, staff):
         bool or None: True if the review is deleted successfully, else None.
     """
     if review.reviewer == staff:
-        deleted = review.deleteReview(staff)
+        deleted = run_with_retry(lambda: review.deleteReview(staff))
         return deleted
     return None
 
+@timed('vote')
 def handle_vote(review, staff, upvote):
     """
     Handle the upvote or downvote for a review.
@@ -99,25 +164,17 @@ def handle_vote(review, staff, upvote):
     Returns:
         int or None: Number of upvotes if upvoted, number of downvotes if downvoted, or None on error.
     """
+    studentID = review.studentID
     try:
-        if staff not in (review.staffUpvoters if upvote else review.staffDownvoters):
-            if upvote:
-                review.upvoteReview(staff)
-            else:
-                review.downvoteReview(staff)
-            
-            student = search_student(review.studentID)
-            if student.karmaID is None:
-                karma = Karma(score=0.0, rank=-99)
-                db.session.add(karma)
-                db.session.flush()
-                student.karmaID = karma.karmaID
-
-            student_karma = get_karma_by_id(student.karmaID)
-            student_karma.calculateScore(student)
-            student_karma.updateRank()
-
-        return review.upvotes if upvote else review.downvotes
+        # the vote adjusts the student's karma by a fixed delta in the same commit, retrying
+        # if it conflicts with a concurrent one; ranks are recomputed by the rank worker
+        if upvote:
+            count = run_with_retry(lambda: review.upvoteReview(staff))
+        else:
+            count = run_with_retry(lambda: review.downvoteReview(staff))
+        # votes are written with plain UPDATEs, which the cache's mapper events do not see
+        student_documents.invalidate(keys=[studentID])
+        return count
     
     except Exception as e:
         print (f'error handling vote {e}')
@@ -135,11 +192,7 @@ def downvoteReview(reviewID, staff):
     Returns:
         int or None: Number of downvotes if downvoted, or None on error.
     """
-    review = get_review(reviewID)
-
-    if staff in review.staffDownvoters:  # If they downvoted the review already, return current votes
-        return review.downvotes
-
+    review = get_review(reviewID, 'vote-check')
     return handle_vote(review, staff, upvote=False)
 
 def upvoteReview(reviewID, staff):
@@ -153,9 +206,114 @@ def upvoteReview(reviewID, staff):
     Returns:
         int or None: Number of upvotes if upvoted, or None on error.
     """
-    review = get_review(reviewID)
+    review = get_review(reviewID, 'vote-check')
+    return handle_vote(review, staff, upvote=True)
+
+@timed('vote_batch')
+def handle_votes(staff, votes):
+    """
+    Apply a batch of votes by one staff member in a single transaction.
+
+    Every review is loaded with one query, counters and voter lists are updated
+    together and karma is adjusted once per affected student. Ranks follow with
+    the next run of the rank worker.
+
+    Args:
+        staff (Staff): The staff member casting the votes.
+        votes (list): Items of the form {"reviewID": int, "upvote": bool}.
+
+    Returns:
+        list or None: One result dictionary per item, in request order, or None if the batch could not be saved.
+    """
+    results = []
+    valid = []
+    for index, item in enumerate(votes):
+        reviewID = item.get('reviewID') if isinstance(item, dict) else None
+        upvote = item.get('upvote') if isinstance(item, dict) else None
+        if isinstance(reviewID, bool) or not isinstance(reviewID, int) or not isinstance(upvote, bool):
+            results.append({"reviewID": reviewID, "error": "Invalid vote. 'reviewID' must be an integer and 'upvote' a boolean"})
+        else:
+            results.append({"reviewID": reviewID, "upvote": upvote})
+            valid.append(index)
+
+    reviewIDs = {results[index]['reviewID'] for index in valid}
+    voted = set()
+
+    def apply():
+        reviews = {review.ID: review for review in load(Review, 'vote-check').filter(Review.ID.in_(reviewIDs))} if reviewIDs else {}
+        deltas = {}
+        for index in valid:
+            # rebuilt on every attempt, so nothing from one that was rolled back survives
+            result = results[index] = {"reviewID": votes[index]['reviewID'], "upvote": votes[index]['upvote']}
+            review = reviews.get(result['reviewID'])
+            if review is None:
+                result['error'] = "Review does not exist"
+                continue
+
+            delta = review.castVote(staff, result['upvote'])
+            if delta:
+                deltas[review.studentID] = deltas.get(review.studentID, 0) + delta
+            direction = 'Upvoted' if result['upvote'] else 'Downvoted'
+            result['message'] = f'Review {direction} Successfully' if delta else f'Review Already {direction}'
+            # the counters as this transaction left them
+            result['upvotes'], result['downvotes'] = review.voteCounts()
+
+        students = load(Student).filter(Student.ID.in_(deltas)).all() if deltas else []
+        for student in students:
+            Karma.adjustStudentScore(student, deltas[student.ID])
+        db.session.commit()
+        voted.update(review.studentID for review in reviews.values())
+
+    try:
+        run_with_retry(apply)
+    except Exception as e:
+        print(f'error handling votes {e}')
+        return None
+    student_documents.invalidate(keys=voted)
+    return results
+
+# the association tables votes were kept in before review_vote, and the direction of their votes
+LEGACY_VOTE_TABLES = [('review_staff_upvoters', ReviewVote.UP), ('review_staff_downvoters', ReviewVote.DOWN)]
 
-    if staff in review.staffUpvoters:  # If they upvoted the review already, return current votes
-        return review.upvotes
+def migrate_legacy_votes(drop=False):
+    """
+    Copy votes from the old review_staff_upvoters/review_staff_downvoters tables into
+    review_vote, dropping duplicate rows, and recount every review's vote counters from it.
+    A staff member listed as both upvoter and downvoter keeps the upvote. The recount
+    covers votes still held in counter shards, so those are deleted with it, and every
+    student's karma is then recalculated from the recounted votes.
+
+    Args:
+        drop (bool, optional): Drop the old tables afterwards. Defaults to False.
+
+    Returns:
+        int: The number of votes copied.
+    """
+    inspector = db.inspect(db.engine)
+    copied = 0
+    for name, direction in LEGACY_VOTE_TABLES:
+        if not inspector.has_table(name):
+            continue
+        legacy = db.Table(name, db.MetaData(), autoload_with=db.engine)
+        exists = db.select(ReviewVote.reviewID).where(
+            ReviewVote.reviewID == legacy.c.reviewID, ReviewVote.staffID == legacy.c.staffID).exists()
+        votes = db.select(legacy.c.reviewID, legacy.c.staffID, db.literal(direction), db.literal(datetime.utcnow()))\
+            .where(legacy.c.reviewID.isnot(None), legacy.c.staffID.isnot(None), ~exists)\
+            .distinct()
+        copied += db.session.execute(
+            db.insert(ReviewVote).from_select(['reviewID', 'staffID', 'direction', 'created'], votes)).rowcount
+
+    def count(direction):
+        return db.select(db.func.count()).where(
+            ReviewVote.reviewID == Review.ID, ReviewVote.direction == direction).scalar_subquery()
+    db.session.execute(db.update(Review).values(upvotes=count(ReviewVote.UP), downvotes=count(ReviewVote.DOWN)))
+    db.session.execute(db.delete(ReviewCounterShard))
+    db.session.commit()
+    repair_student_karma()
+
+    if drop:
+        for name, _ in LEGACY_VOTE_TABLES:
+            if inspector.has_table(name):
+                db.Table(name, db.MetaData(), autoload_with=db.engine).drop(db.engine)
+    return copied
 
-    return handle_vote(review, staff, upvote=True)
\ No newline at end of file
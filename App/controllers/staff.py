@@ -1,6 +1,11 @@
+from flask import current_app
+
 from App.controllers.user import get_staff
 from App.models import Staff, Student, Review, Karma
 from App.database import db
+from App.search import typeahead_students, rebuild_search_index
+from App.cache import rankings_cache
+from App.leaderboard import get_leaderboard
 
 def create_review(staffID, studentID, is_positive, comment):
     """
@@ -37,30 +42,76 @@ def get_staff_reviews(staff_id):
     if staff:
         return staff.getReviewsByStaff(staff)
 
-def search_students_searchTerm(staff, searchTerm):
+def search_students_searchTerm(staff, searchTerm, limit=20):
     """
     Search for students based on a given search term.
 
     Args:
         staff: The staff member initiating the search.
         searchTerm (str): The term to search for (student ID, first name, or last name).
+        limit (int, optional): The most students to return. Defaults to 20.
 
     Returns:
-        list: List of students matching the search term.
+        list: List of students matching the search term, best match first.
     """
-    students = staff.searchStudent(searchTerm)
+    students = staff.searchStudent(searchTerm, limit)
     if students:
       return students
     return None
   
-def get_student_rankings(staff):
+def get_student_rankings(staff, limit=None):
     """
     Get the rankings of students based on their karma scores.
 
     Args:
         staff: The staff member retrieving the rankings.
+        limit (int, optional): Only return the top `limit` students.
 
     Returns:
         list: List of dictionaries containing student rankings.
     """
-    return staff.getStudentRankings()
\ No newline at end of file
+    return staff.getStudentRankings(limit)
+
+def get_student_rankings_json(staff, limit=None):
+    """
+    Get the student rankings serialized as JSON, together with the ranking version they
+    belong to. The serialized rankings are cached per version and limit, so they are only
+    queried and serialized again once the rank worker publishes new ranks.
+
+    Args:
+        staff: The staff member retrieving the rankings.
+        limit (int, optional): Only include the top `limit` students.
+
+    Returns:
+        tuple: (ranking version, JSON bytes or None if no student is ranked).
+    """
+    version = get_leaderboard().version
+
+    def serialize():
+        rankings = staff.getStudentRankings(limit)
+        return current_app.json.dumps(rankings).encode() + b'\n' if rankings else None
+
+    return version, rankings_cache.get(limit, version, serialize)
+
+def typeahead_search(prefix, limit=10):
+    """
+    Suggest students whose ID, first name or last name starts with what has been typed.
+
+    Args:
+        prefix (str): What has been typed so far.
+        limit (int, optional): The most suggestions to return. Defaults to 10.
+
+    Returns:
+        list: {"ID", "name"} dictionaries.
+    """
+    return typeahead_students(prefix, limit)
+
+
+def rebuild_student_search():
+    """
+    Create or refill the student search index, e.g. for a database created before search was indexed.
+
+    Returns:
+        str: The search backend now in use.
+    """
+    return rebuild_search_index()
@@ -1,5 +1,8 @@
 from App.models import Student
 from App.database import db
+from App.cache import student_documents
+from App.leaderboard import get_leaderboard
+from .user import get_student
 
 
 def search_student(studentID):
@@ -16,3 +19,29 @@ def search_student(studentID):
     if student:
         return student
     return None
+
+def get_student_document(studentID):
+    """
+    Get a student's profile document, as Student.to_json gives it. Documents are kept in
+    the student document cache, which drops them when the student, their reviews or the
+    votes on those reviews change, or when one of their reviewers is renamed. The rank is
+    read from the leaderboard on every call, so new rankings show without a rebuild.
+
+    Args:
+        studentID: The ID of the student.
+
+    Returns:
+        dict or None: The document, or None if there is no such student.
+    """
+    def build():
+        student = get_student(studentID, 'detail')
+        if student is None:
+            return None, ()
+        document = student.to_json()
+        return document, {('staff', review.reviewerID) for review in student.reviews}
+
+    document = student_documents.fetch(str(studentID), build)
+    if document is None:
+        return None
+    rank = get_leaderboard().rank_of(document["studentID"]) if document["karmaScore"] is not None else None
+    return {**document, "karmaRank": rank}
@@ -1,5 +1,9 @@
-from App.models import Staff, Student, Admin
+from App.models import Staff, Student, Admin, UserDirectory, USER_ROLES, load
 from App.database import db
+from .pagination import paginate, estimate_rows
+
+# the order users of different roles are listed in
+USER_MODELS = [Admin, Staff, Student]
 
 
 def create_student(admin, studentID, firstname, lastname, password, contact, studentType, yearofStudy):
@@ -62,39 +66,107 @@ def create_user(firstname, lastname, password):
     db.session.commit()
     return new_admin
 
-def get_staff(staffID):
+def get_staff(staffID, profile='summary'):
     """
     Retrieve a staff member by their ID.
 
     Args:
         staffID: The ID of the staff member to retrieve.
+        profile (str, optional): The loading profile, 'summary' (default) or 'detail'.
 
     Returns:
         Staff: The staff member object if found, otherwise None.
     """
-    return Staff.query.filter_by(ID=staffID).first()
+    return load(Staff, profile).filter_by(ID=staffID).first()
 
-def get_student(studentID):
+def get_student(studentID, profile='summary'):
     """Retrieve a student by their ID.
 
     Args:
         studentID: The ID of the student to retrieve.
+        profile (str, optional): The loading profile, 'summary' (default) or 'detail'.
 
     Returns:
         Student: The student object if found, otherwise None.
     """
-    return Student.query.filter_by(ID=studentID).first()
+    return load(Student, profile).filter_by(ID=studentID).first()
 
-def get_admin(adminID):
+def get_admin(adminID, profile='summary'):
     """Retrieve an admin by their ID.
 
     Args:
         adminID: The ID of the admin to retrieve.
+        profile (str, optional): The loading profile, 'summary' (default) or 'detail'.
 
     Returns:
         Admin: The admin object if found, otherwise None.
     """
-    return Admin.query.filter_by(ID=adminID).first()
+    return load(Admin, profile).filter_by(ID=adminID).first()
+
+def get_user(userID, profile='summary'):
+    """
+    Retrieve a user of any role by their ID, looking the role up in the user directory.
+
+    Args:
+        userID: The ID of the user to retrieve.
+        profile (str, optional): The loading profile, 'summary' (default) or 'detail'.
+
+    Returns:
+        Admin, Staff or Student: The user if found, otherwise None.
+    """
+    role = UserDirectory.roleOf(userID)
+    if role is None:
+        return None
+    model = USER_ROLES[role]
+    return load(model, profile).filter_by(ID=str(userID)).first()
+
+def get_user_role(userID):
+    """
+    Get the role of the user with an ID, with one indexed lookup.
+
+    Args:
+        userID: The ID to look up.
+
+    Returns:
+        str or None: 'admin', 'staff' or 'student', or None if no user has the ID.
+    """
+    return UserDirectory.roleOf(userID)
+
+def sync_user_directory():
+    """
+    Add every admin, staff member and student missing from the user directory and remove
+    directory entries whose user no longer exists, e.g. for a database created before the
+    directory was kept.
+
+    An ID held in more than one of the role tables can have only one directory entry, so
+    such IDs get no new entry and are returned instead; the users behind them cannot log
+    in until all but one are given another ID.
+
+    Returns:
+        tuple: The number of entries added, the number removed, and a dict of the IDs held
+        in more than one role to those roles.
+    """
+    users = db.union_all(*(db.select(model.ID.label('ID'), db.literal(role).label('role'))
+                           for role, model in USER_ROLES.items())).subquery()
+    duplicated = db.select(users.c.ID).group_by(users.c.ID).having(db.func.count() > 1)
+    conflicts = {}
+    for ID, role in db.session.execute(
+            db.select(users.c.ID, users.c.role).where(users.c.ID.in_(duplicated)).order_by(users.c.ID, users.c.role)):
+        conflicts.setdefault(ID, []).append(role)
+
+    # stale entries go first, so a user whose ID moved to another role can take it over
+    removed = 0
+    for role, model in USER_ROLES.items():
+        orphaned = db.delete(UserDirectory).where(
+            UserDirectory.role == role, ~db.select(model.ID).where(model.ID == UserDirectory.ID).exists())
+        removed += db.session.execute(orphaned).rowcount
+    added = 0
+    for role, model in USER_ROLES.items():
+        missing = db.select(model.ID, db.literal(role))\
+            .where(~db.select(UserDirectory.ID).where(UserDirectory.ID == model.ID).exists(), model.ID.not_in(duplicated))
+        added += db.session.execute(db.insert(UserDirectory).from_select(['ID', 'role'], missing)).rowcount
+    db.session.commit()
+    return added, removed, conflicts
 
 def is_staff(staffID):
     """Check if a staff member with the given ID exists.
@@ -138,11 +210,7 @@ def get_all_users_json():
     Returns:
         list: A list of JSON representations of users.
     """
-    users = get_all_users()
-    if not users:
-        return []
-    users = [user.to_json() for user in users]
-    return users
+    return [user.to_json() for user in iter_all_users()]
 
 def get_all_students_json():
     """
@@ -177,7 +245,62 @@ def get_all_users():
     Returns:
         list: A list containing all users (Admins, Staff, and Students).
     """
-    return db.session.query(Admin).all() +  db.session.query(Staff).all() + db.session.query(Student).all()
+    return list(iter_all_users())
+
+def get_users_page(limit, cursor=None, estimate=False):
+    """
+    Get one page of all users, admins first, then staff, then students, each ordered by ID.
+
+    Args:
+        limit (int): The page size.
+        cursor (str, optional): The cursor returned with the previous page.
+        estimate (bool, optional): Include an estimated total number of users.
+
+    Returns:
+        Page: The users on the page and the cursor for the next one.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    # one keyset query over the directory picks the page, then each role's users on it are loaded by ID
+    page = paginate(db.session.query(UserDirectory), [UserDirectory.role, UserDirectory.ID], limit, cursor)
+    users = {}
+    for role, model in USER_ROLES.items():
+        IDs = [entry.ID for entry in page.items if entry.role == role]
+        if IDs:
+            users.update({(role, user.ID): user for user in load(model, 'detail').filter(model.ID.in_(IDs))})
+    page.items = [users[(entry.role, entry.ID)] for entry in page.items if (entry.role, entry.ID) in users]
+    if estimate:
+        page.estimate = estimate_rows(UserDirectory)
+    return page
+
+def iter_all_users(chunk_size=500):
+    """
+    Iterate over all users, admins first, then staff, then students, each ordered by ID,
+    reading them through a server-side cursor `chunk_size` rows at a time.
+
+    Args:
+        chunk_size (int, optional): Rows fetched per round trip. Defaults to 500.
+
+    Yields:
+        Admin, Staff or Student: Each user in turn.
+    """
+    for model in USER_MODELS:
+        yield from iter_all(model, chunk_size)
+
+def iter_all(model, chunk_size=500):
+    """
+    Iterate over every record of a user model ordered by ID without loading them all at once.
+
+    Args:
+        model: Admin, Staff or Student.
+        chunk_size (int, optional): Rows fetched per round trip. Defaults to 500.
+
+    Yields:
+        The records of the model.
+    """
+    query = load(model, 'detail').order_by(model.ID)
+    yield from query.execution_options(stream_results=True).yield_per(chunk_size)
 
 def get_all_students():
     """
@@ -186,7 +309,24 @@ def get_all_students():
     Returns:
         list: A list containing all student users.
     """
-    return db.session.query(Student).all()
+    return load(Student, 'detail').all()
+
+def get_students_page(limit, cursor=None, estimate=False):
+    """
+    Get one page of student records ordered by ID.
+
+    Args:
+        limit (int): The page size.
+        cursor (str, optional): The cursor returned with the previous page.
+        estimate (bool, optional): Include an estimated total number of students.
+
+    Returns:
+        Page: The students on the page and the cursor for the next one.
+    """
+    page = paginate(load(Student, 'detail'), [Student.ID], limit, cursor)
+    if estimate:
+        page.estimate = estimate_rows(Student)
+    return page
 
 def get_all_staff():
     """
@@ -195,7 +335,24 @@ def get_all_staff():
     Returns:
         list: A list containing all staff records.
     """
-    return db.session.query(Staff).all()
+    return load(Staff, 'detail').all()
+
+def get_staff_page(limit, cursor=None, estimate=False):
+    """
+    Get one page of staff records ordered by ID.
+
+    Args:
+        limit (int): The page size.
+        cursor (str, optional): The cursor returned with the previous page.
+        estimate (bool, optional): Include an estimated total number of staff.
+
+    Returns:
+        Page: The staff members on the page and the cursor for the next one.
+    """
+    page = paginate(load(Staff, 'detail'), [Staff.ID], limit, cursor)
+    if estimate:
+        page.estimate = estimate_rows(Staff)
+    return page
 
 def update_student(student, firstname, lastname, password, contact, studentType, yearofStudy):
     """
@@ -1,5 +1,16 @@
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+from flask import g, request, has_request_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm.exc import StaleDataError
 
 db = SQLAlchemy()
 
@@ -10,4 +21,154 @@ def create_db():
     db.create_all()
     
 def init_db(app):
-    db.init_app(app)
\ No newline at end of file
+    db.init_app(app)
+    setup_query_instrumentation(app)
+
+slow_query_log = logging.getLogger('App.sql.slow')
+THIS_FILE = os.path.abspath(__file__)
+APP_DIR = os.path.dirname(THIS_FILE)
+CONTROLLERS_DIR = os.path.join(APP_DIR, 'controllers')
+
+class RequestQueries:
+    """
+    The SQL statements one request ran: how many, their total time and the slowest.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.count = 0
+        self.seconds = 0.0
+        self.slowest = None  # (seconds, statement, call site)
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        if self.slowest is None or seconds > self.slowest[0]:
+            self.slowest = (seconds, statement, call_site())
+
+    def server_timing(self):
+        """
+        Returns:
+            str: A Server-Timing header value, e.g.
+            'db;dur=4.2;desc="3 statements", db-slowest;dur=2.1;desc="App/models/student.py:to_json:88", app;dur=9.7'.
+        """
+        metrics = [f'db;dur={self.seconds * 1000:.2f};desc="{self.count} statements"']
+        if self.slowest:
+            metrics.append(f'db-slowest;dur={self.slowest[0] * 1000:.2f};desc="{self.slowest[2]}"')
+        metrics.append(f'app;dur={(time.perf_counter() - self.started) * 1000:.2f}')
+        return ', '.join(metrics)
+
+def request_queries():
+    """
+    Get the statements recorded for the current request, or None outside one.
+    """
+    return g.get('_queries') if has_request_context() else None
+
+def call_site():
+    """
+    Find where in the app a statement was run from: the innermost controller function on
+    the stack, followed by the innermost app frame when that is elsewhere (e.g. a lazy load
+    in a model), as in 'App/controllers/student.py:get_student_action:41 > App/models/student.py:to_json:88'.
+    """
+    innermost = controller = None
+    frame = sys._getframe(1)
+    while frame is not None and controller is None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(APP_DIR) and filename != THIS_FILE:
+            site = f'{os.path.relpath(filename, os.path.dirname(APP_DIR))}:{frame.f_code.co_name}:{frame.f_lineno}'
+            innermost = innermost or site
+            if filename.startswith(CONTROLLERS_DIR):
+                controller = site
+        frame = frame.f_back
+    if controller is None or controller == innermost:
+        return innermost or 'unknown'
+    return f'{controller} > {innermost}'
+
+# the start time lives on the statement's execution context, which is discarded with it
+# whether or not the statement succeeds
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_started', None)
+    if started is None:
+        return
+    seconds = time.perf_counter() - started
+    queries = request_queries()
+    if queries is None:
+        return
+    queries.record(statement, seconds)
+    threshold = g.get('_slow_query_ms')
+    if threshold and seconds * 1000 >= threshold:
+        slow_query_log.warning(json.dumps({
+            "event": "slow_query",
+            "ms": round(seconds * 1000, 2),
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "call_site": call_site(),
+            "statement": ' '.join(statement.split())[:1000],
+            "executemany": executemany,
+        }))
+
+def setup_query_instrumentation(app):
+    """
+    Record the SQL statements each request runs. Statements slower than SLOW_QUERY_MS are
+    logged as JSON to the 'App.sql.slow' logger, and responses carry a Server-Timing header
+    with the statement count, total database time and slowest statement's call site when
+    the app runs in debug mode or SERVER_TIMING is set.
+    """
+    # only this app's engine, not every engine in the process (e.g. the benchmarks' own)
+    with app.app_context():
+        engine = db.engine
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_recording_queries():
+        g._queries = RequestQueries()
+        g._slow_query_ms = app.config.get('SLOW_QUERY_MS', 0)
+
+    @app.after_request
+    def add_server_timing(response):
+        queries = request_queries()
+        if queries is not None and (app.debug or app.config.get('SERVER_TIMING')):
+            response.headers['Server-Timing'] = queries.server_timing()
+        return response
+
+def is_conflict(error):
+    """
+    Check whether an error means the transaction lost a race with a concurrent one
+    and can simply be run again.
+    """
+    if isinstance(error, StaleDataError):  # a version_id_col check failed
+        return True
+    if isinstance(error, DBAPIError):
+        # postgres serialization failure / deadlock, sqlite busy
+        return getattr(error.orig, 'pgcode', None) in ('40001', '40P01') or 'database is locked' in str(error.orig)
+    return False
+
+def run_with_retry(operation, attempts=5, delay=0.005):
+    """
+    Run a unit of work that commits, rolling back and running it again if it conflicts with
+    a concurrent transaction. Waits a short, randomised and growing delay between attempts.
+
+    Args:
+        operation: Function doing the work; it must reload anything it reads after a rollback.
+        attempts (int, optional): The number of attempts. Defaults to 5.
+        delay (float, optional): The base delay in seconds. Defaults to 0.005.
+
+    Returns:
+        The operation's result.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return operation()
+        except Exception as e:
+            db.session.rollback()
+            if attempt == attempts or not is_conflict(e):
+                raise
+            time.sleep(random.uniform(0, delay * 2 ** attempt))
+
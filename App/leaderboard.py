@@ -0,0 +1,308 @@
+import random
+import threading
+import time
+
+from flask import current_app
+
+from App.database import db
+
+
+class _Node:
+  __slots__ = ('key', 'next', 'width')
+
+  def __init__(self, key, level):
+    self.key = key
+    self.next = [None] * level
+    self.width = [1] * level  # number of bottom-level steps to next[i] (or past the end)
+
+
+class IndexableSkipList:
+  """
+  A sorted collection of unique keys with O(log n) expected insert, remove,
+  position lookup and access by position.
+  """
+  MAX_LEVEL = 32
+
+  def __init__(self):
+    self._head = _Node(None, self.MAX_LEVEL)
+    self._level = 1
+    self._size = 0
+    self._random = random.Random()
+
+  def __len__(self):
+    return self._size
+
+  def __iter__(self):
+    node = self._head.next[0]
+    while node is not None:
+      yield node.key
+      node = node.next[0]
+
+  def _randomLevel(self):
+    level = 1
+    while level < self.MAX_LEVEL and self._random.random() < 0.5:
+      level += 1
+    return level
+
+  def _predecessors(self, key):
+    # the last node before key on every level, with its position (head is position 0)
+    update = [None] * self.MAX_LEVEL
+    steps = [0] * self.MAX_LEVEL
+    node, pos = self._head, 0
+    for i in reversed(range(self._level)):
+      while node.next[i] is not None and node.next[i].key < key:
+        pos += node.width[i]
+        node = node.next[i]
+      update[i], steps[i] = node, pos
+    return update, steps
+
+  def insert(self, key):
+    update, steps = self._predecessors(key)
+    level = self._randomLevel()
+    if level > self._level:
+      for i in range(self._level, level):
+        update[i], steps[i] = self._head, 0
+        self._head.width[i] = self._size + 1
+      self._level = level
+
+    node = _Node(key, level)
+    position = steps[0] + 1
+    for i in range(level):
+      prev = update[i]
+      node.next[i] = prev.next[i]
+      node.width[i] = prev.width[i] - (position - steps[i]) + 1
+      prev.next[i] = node
+      prev.width[i] = position - steps[i]
+    for i in range(level, self._level):
+      update[i].width[i] += 1
+    self._size += 1
+
+  def remove(self, key):
+    update, _ = self._predecessors(key)
+    target = update[0].next[0]
+    if target is None or target.key != key:
+      raise KeyError(key)
+
+    for i in range(self._level):
+      if update[i].next[i] is target:
+        update[i].width[i] += target.width[i] - 1
+        update[i].next[i] = target.next[i]
+      else:
+        update[i].width[i] -= 1
+    self._size -= 1
+    while self._level > 1 and self._head.next[self._level - 1] is None:
+      self._level -= 1
+
+  def bisect_left(self, key):
+    """Return the number of keys smaller than key."""
+    return self._predecessors(key)[1][0]
+
+  def _nodeAt(self, index):
+    node, pos = self._head, 0
+    for i in reversed(range(self._level)):
+      while node.next[i] is not None and pos + node.width[i] <= index + 1:
+        pos += node.width[i]
+        node = node.next[i]
+    return node
+
+  def __getitem__(self, index):
+    if index < 0:
+      index += self._size
+    if not 0 <= index < self._size:
+      raise IndexError('skip list index out of range')
+    return self._nodeAt(index).key
+
+  def slice(self, start, stop):
+    """Yield the keys at positions start (inclusive) to stop (exclusive)."""
+    start, stop = max(start, 0), min(stop, self._size)
+    if start >= stop:
+      return
+    node = self._nodeAt(start)
+    for _ in range(stop - start):
+      yield node.key
+      node = node.next[0]
+
+
+class Leaderboard:
+  """
+  In-process index of student karma scores answering rank queries in O(log n).
+
+  Ranks are dense like the stored Karma.rank: students with equal scores share a
+  rank and the next score down gets the next rank. Ties are listed by student ID.
+  The index mirrors the stored rankings as of `version`.
+  """
+
+  def __init__(self):
+    self._lock = threading.RLock()
+    self.clear()
+
+  def clear(self):
+    with self._lock:
+      self._entries = IndexableSkipList()  # (-score, studentID) in ranking order
+      self._scores = IndexableSkipList()   # -score, once per distinct score
+      self._counts = {}                    # score -> number of students with it
+      self._students = {}                  # studentID -> score
+      self.version = None                  # ranking version the index reflects
+      self.checkedAt = None
+
+  def __len__(self):
+    return len(self._students)
+
+  def __contains__(self, studentID):
+    return studentID in self._students
+
+  def _add(self, studentID, score):
+    self._entries.insert((-score, studentID))
+    if not self._counts.get(score):
+      self._scores.insert(-score)
+      self._counts[score] = 0
+    self._counts[score] += 1
+    self._students[studentID] = score
+
+  def _discard(self, studentID):
+    score = self._students.pop(studentID, None)
+    if score is None:
+      return
+    self._entries.remove((-score, studentID))
+    self._counts[score] -= 1
+    if not self._counts[score]:
+      del self._counts[score]
+      self._scores.remove(-score)
+
+  def load(self, scores, version=None):
+    """
+    Replace the index contents.
+
+    Args:
+        scores (iterable): (studentID, score) pairs.
+        version (int, optional): The ranking version the scores belong to.
+    """
+    with self._lock:
+      self.clear()
+      for studentID, score in scores:
+        self._add(studentID, score)
+      self.version = version
+
+  def set(self, studentID, score):
+    with self._lock:
+      self._discard(studentID)
+      self._add(studentID, score)
+
+  def adjust(self, studentID, delta):
+    """
+    Apply a score delta; a student not yet in the index starts from 0, like a new Karma record.
+    """
+    with self._lock:
+      self.set(studentID, self._students.get(studentID, 0.0) + delta)
+
+  def remove(self, studentID):
+    with self._lock:
+      self._discard(studentID)
+
+  def score_of(self, studentID):
+    return self._students.get(studentID)
+
+  def rank_of(self, studentID):
+    """
+    Returns:
+        int or None: The dense rank of the student, or None if they have no karma.
+    """
+    with self._lock:
+      score = self._students.get(studentID)
+      if score is None:
+        return None
+      return self._scores.bisect_left(-score) + 1
+
+  def _ranked(self, start, stop):
+    # (studentID, score, rank) for ranking positions start..stop-1
+    rank, previous = None, None
+    for negScore, studentID in self._entries.slice(start, stop):
+      if rank is None:
+        rank = self._scores.bisect_left(negScore) + 1
+      elif negScore != previous:
+        rank += 1
+      previous = negScore
+      yield studentID, -negScore, rank
+
+  def top(self, k=None):
+    """
+    Returns:
+        list: (studentID, score, rank) tuples for the first k students in ranking order (all if k is None).
+    """
+    with self._lock:
+      return list(self._ranked(0, len(self._entries) if k is None else k))
+
+  def ranked(self, first, last):
+    """
+    Returns:
+        list: (studentID, score, rank) tuples for every student whose rank is between first and last inclusive.
+    """
+    with self._lock:
+      first = max(first, 1)
+      if first > last or first > len(self._scores):
+        return []
+      start = self._entries.bisect_left((self._scores[first - 1],))
+      if last < len(self._scores):
+        stop = self._entries.bisect_left((self._scores[last],))
+      else:
+        stop = len(self._entries)
+      return list(self._ranked(start, stop))
+
+
+leaderboard = Leaderboard()
+_sync_lock = threading.Lock()
+
+
+def rebuild_leaderboard():
+  """
+  Reload the leaderboard from the stored rankings.
+  """
+  from App.models import Student, Karma, RankingState
+
+  with _sync_lock:
+    version = RankingState.currentVersion()
+    rows = db.session.query(Student.ID, Karma.rankedScore)\
+      .join(Karma, Student.karmaID == Karma.karmaID)\
+      .filter(Karma.rankedScore.isnot(None))\
+      .all()
+    leaderboard.load(rows, version)
+    leaderboard.checkedAt = time.monotonic()
+  return leaderboard
+
+
+def expire_leaderboard():
+  """
+  Make the next get_leaderboard() check the ranking version regardless of RANKING_SYNC_INTERVAL.
+  """
+  leaderboard.checkedAt = None
+
+
+def get_leaderboard():
+  """
+  Get the leaderboard, bringing it up to the current ranking version.
+
+  The version is checked at most once every RANKING_SYNC_INTERVAL seconds. When the rank
+  worker has published a newer version only the karma rows changed since are read.
+  """
+  from App.models import Student, Karma, RankingState
+
+  interval = current_app.config.get('RANKING_SYNC_INTERVAL', 1)
+  checked = leaderboard.checkedAt
+  if leaderboard.version is not None and checked is not None and time.monotonic() - checked < interval:
+    return leaderboard
+
+  version = RankingState.currentVersion()
+  if leaderboard.version is None or version < leaderboard.version:
+    return rebuild_leaderboard()
+
+  with _sync_lock:
+    if version > leaderboard.version:
+      changed = db.session.query(Student.ID, Karma.rankedScore)\
+        .join(Karma, Student.karmaID == Karma.karmaID)\
+        .filter(Karma.rankedVersion > leaderboard.version)\
+        .all()
+      for studentID, score in changed:
+        leaderboard.set(studentID, score)
+      leaderboard.version = version
+    leaderboard.checkedAt = time.monotonic()
+  return leaderboard
@@ -16,6 +16,10 @@ from App.controllers import (
 )
 
 from App.views import views
+from App.scheduler import setup_rank_scheduler
+from App.metrics import setup_metrics
+from App.profiling import setup_profiling
+from App.cache import student_documents
 
 def add_views(app):
     for view in views:
@@ -41,7 +45,11 @@ def create_app(config_overrides={}):
     configure_uploads(app, photos)
     add_views(app)
     init_db(app)
+    setup_metrics(app)
+    setup_profiling(app)
     setup_jwt(app)
+    student_documents.configure(app.config['STUDENT_CACHE_SIZE'], app.config['STUDENT_CACHE_TTL'])
     setup_flask_login(app)
+    setup_rank_scheduler(app)
     app.app_context().push()
     return app
\ No newline at end of file
@@ -0,0 +1,392 @@
+import bisect
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, request
+
+
+class _FileValues:
+  """
+  The metric values of one process, kept in a memory-mapped file so that whichever
+  worker serves /metrics can read every worker's values without asking them.
+
+  The file holds a used-bytes count followed by entries of (key length, key padded to
+  8 bytes, double value). New keys are appended and the count is updated after the
+  entry, so a reader never sees a partial entry.
+  """
+  INITIAL_SIZE = 64 * 1024
+
+  def __init__(self, path):
+    self.path = path
+    self._file = open(path, 'a+b')
+    if os.fstat(self._file.fileno()).st_size == 0:
+      self._file.truncate(self.INITIAL_SIZE)
+    self._map = mmap.mmap(self._file.fileno(), 0)
+    self._used = struct.unpack_from('i', self._map, 0)[0] or 8
+    self._offsets = {key: offset for key, _, offset in _entries(self._map, self._used)}
+
+  def add(self, key, amount):
+    offset = self._offsets.get(key)
+    if offset is None:
+      offset = self._append(key)
+    struct.pack_into('d', self._map, offset, struct.unpack_from('d', self._map, offset)[0] + amount)
+
+  def set(self, key, value):
+    offset = self._offsets.get(key)
+    if offset is None:
+      offset = self._append(key)
+    struct.pack_into('d', self._map, offset, value)
+
+  def _append(self, key):
+    encoded = key.encode()
+    padded = len(encoded) + (8 - (4 + len(encoded)) % 8) % 8
+    entry = struct.pack(f'i{padded}sd', len(encoded), encoded, 0.0)
+    while self._used + len(entry) > len(self._map):
+      size = len(self._map) * 2
+      self._map.close()
+      self._file.truncate(size)
+      self._map = mmap.mmap(self._file.fileno(), size)
+    self._map[self._used:self._used + len(entry)] = entry
+    offset = self._used + 4 + padded
+    self._used += len(entry)
+    struct.pack_into('i', self._map, 0, self._used)
+    self._offsets[key] = offset
+    return offset
+
+  def close(self):
+    self._map.close()
+    self._file.close()
+
+
+def _entries(data, used):
+  position = 8
+  while position < used:
+    length = struct.unpack_from('i', data, position)[0]
+    padded = length + (8 - (4 + length) % 8) % 8
+    key = bytes(data[position + 4:position + 4 + length]).decode()
+    offset = position + 4 + padded
+    yield key, struct.unpack_from('d', data, offset)[0], offset
+    position = offset + 8
+
+
+def _read_file(path):
+  with open(path, 'rb') as file:
+    data = file.read()
+  if len(data) < 8:
+    return []
+  return [(key, value) for key, value, _ in _entries(data, struct.unpack_from('i', data, 0)[0])]
+
+
+class Registry:
+  """
+  Holds the app's metrics and their values, and renders them in the Prometheus text format.
+
+  With a directory configured (METRICS_DIR), each process writes its values to its own
+  files there and rendering sums them over every file, so the numbers cover all gunicorn
+  workers. Counters and histograms of workers that have exited are kept; gauges only
+  count live workers (see mark_process_dead). Without one, values stay in this process.
+  """
+
+  def __init__(self):
+    self.metrics = []
+    self.directory = None
+    self._lock = threading.Lock()
+    self._pid = None
+    self._stores = {}
+
+  def configure(self, directory):
+    with self._lock:
+      if directory == self.directory:
+        return
+      self._close()
+      self.directory = directory or None
+      if self.directory:
+        os.makedirs(self.directory, exist_ok=True)
+
+  def _close(self):
+    for store in self._stores.values():
+      if isinstance(store, _FileValues):
+        store.close()
+    self._stores = {}
+
+  def _store(self, kind):
+    # a forked worker starts its own files rather than writing to its parent's
+    if self._pid != os.getpid():
+      self._close()
+      self._pid = os.getpid()
+    store = self._stores.get(kind)
+    if store is None:
+      store = _FileValues(os.path.join(self.directory, f'{kind}_{self._pid}.db')) if self.directory else {}
+      self._stores[kind] = store
+    return store
+
+  def add(self, kind, key, amount):
+    with self._lock:
+      store = self._store(kind)
+      if isinstance(store, dict):
+        store[key] = store.get(key, 0.0) + amount
+      else:
+        store.add(key, amount)
+
+  def set(self, kind, key, value):
+    with self._lock:
+      store = self._store(kind)
+      if isinstance(store, dict):
+        store[key] = value
+      else:
+        store.set(key, value)
+
+  def collect(self):
+    """
+    Returns:
+        dict: key -> value summed over every process.
+    """
+    values = {}
+    with self._lock:
+      if self.directory:
+        samples = (sample for path in sorted(glob.glob(os.path.join(self.directory, '*.db'))) for sample in _read_file(path))
+      else:
+        samples = (sample for store in self._stores.values() for sample in store.items())
+      for key, value in samples:
+        values[key] = values.get(key, 0.0) + value
+    return values
+
+  def clear(self):
+    with self._lock:
+      self._close()
+      if self.directory:
+        for path in glob.glob(os.path.join(self.directory, '*.db')):
+          os.remove(path)
+
+  def render(self):
+    """
+    Returns:
+        str: Every metric in the Prometheus text exposition format.
+    """
+    values = {}
+    for key, value in self.collect().items():
+      name, suffix, labels = json.loads(key)
+      values.setdefault(name, []).append((suffix, labels, value))
+    lines = []
+    for metric in self.metrics:
+      lines.append(f'# HELP {metric.name} {metric.documentation}')
+      lines.append(f'# TYPE {metric.name} {metric.type}')
+      lines.extend(metric.samples(values.get(metric.name, []), values))
+    return '\n'.join(lines) + '\n'
+
+
+def _format_labels(labels):
+  if not labels:
+    return ''
+  escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+  return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def _format_value(value):
+  return repr(int(value)) if value == int(value) else repr(value)
+
+
+class Metric:
+  type = 'untyped'
+  kind = 'counter'  # the files its values are kept in
+
+  def __init__(self, name, documentation, labelnames=(), registry=None):
+    self.name = name
+    self.documentation = documentation
+    self.labelnames = tuple(labelnames)
+    self.registry = registry or metrics
+    self.registry.metrics.append(self)
+
+  def _key(self, suffix, labels, extra=()):
+    pairs = [[name, str(labels.get(name, ''))] for name in self.labelnames] + [list(pair) for pair in extra]
+    return json.dumps([self.name, suffix, pairs])
+
+  def samples(self, values, everything):
+    return [f'{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}' for suffix, labels, value in sorted(values)]
+
+
+class Counter(Metric):
+  type = 'counter'
+
+  def inc(self, amount=1, **labels):
+    self.registry.add(self.kind, self._key('', labels), amount)
+
+
+class Gauge(Metric):
+  """
+  A gauge summed over the live processes, e.g. requests in flight.
+  """
+  type = 'gauge'
+  kind = 'gauge'
+
+  def inc(self, amount=1, **labels):
+    self.registry.add(self.kind, self._key('', labels), amount)
+
+  def dec(self, amount=1, **labels):
+    self.registry.add(self.kind, self._key('', labels), -amount)
+
+  def set(self, value, **labels):
+    self.registry.set(self.kind, self._key('', labels), value)
+
+
+class Histogram(Metric):
+  type = 'histogram'
+  BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0)
+
+  def __init__(self, name, documentation, labelnames=(), buckets=BUCKETS, registry=None):
+    super().__init__(name, documentation, labelnames, registry)
+    self.buckets = tuple(sorted(buckets))
+
+  def observe(self, value, **labels):
+    index = bisect.bisect_left(self.buckets, value)
+    if index < len(self.buckets):
+      self.registry.add(self.kind, self._key('_bucket', labels, [('le', repr(self.buckets[index]))]), 1)
+    self.registry.add(self.kind, self._key('_sum', labels), value)
+    self.registry.add(self.kind, self._key('_count', labels), 1)
+
+  @contextmanager
+  def time(self, **labels):
+    started = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.observe(time.perf_counter() - started, **labels)
+
+  def samples(self, values, everything):
+    # buckets are stored per bucket and reported cumulatively
+    series = {}
+    for suffix, labels, value in values:
+      own = tuple(tuple(pair) for pair in labels if pair[0] != 'le')
+      entry = series.setdefault(own, {'buckets': {}, '_sum': 0.0, '_count': 0.0})
+      if suffix == '_bucket':
+        entry['buckets'][float(labels[-1][1])] = value
+      else:
+        entry[suffix] = value
+    lines = []
+    for labels, entry in sorted(series.items()):
+      total = 0.0
+      for bound in self.buckets:
+        total += entry['buckets'].get(bound, 0.0)
+        lines.append(f'{self.name}_bucket{_format_labels(labels + (("le", repr(bound)),))} {_format_value(total)}')
+      lines.append(f'{self.name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {_format_value(entry["_count"])}')
+      lines.append(f'{self.name}_sum{_format_labels(labels)} {_format_value(entry["_sum"])}')
+      lines.append(f'{self.name}_count{_format_labels(labels)} {_format_value(entry["_count"])}')
+    return lines
+
+
+class HitRatio(Metric):
+  """
+  A gauge computed at render time: the share of a cache's lookups that were hits.
+  """
+  type = 'gauge'
+
+  def __init__(self, name, documentation, requests, registry=None):
+    super().__init__(name, documentation, ('cache',), registry)
+    self.requests = requests
+
+  def samples(self, values, everything):
+    counts = {}
+    for _, labels, value in everything.get(self.requests.name, []):
+      labels = dict(labels)
+      counts.setdefault(labels['cache'], {})[labels['result']] = value
+    return [f'{self.name}{_format_labels((("cache", cache),))} {_format_value(round(count.get("hit", 0) / sum(count.values()), 6))}'
+            for cache, count in sorted(counts.items()) if sum(count.values())]
+
+
+metrics = Registry()
+
+HTTP_REQUESTS = Counter('http_requests_total', 'HTTP requests by route and status code.', ('blueprint', 'route', 'method', 'status'))
+HTTP_LATENCY = Histogram('http_request_duration_seconds', 'HTTP request latency by route.', ('blueprint', 'route', 'method'))
+HTTP_IN_FLIGHT = Gauge('http_requests_in_flight', 'HTTP requests being handled.')
+DB_CHECKOUT = Histogram('db_pool_checkout_seconds', 'Time spent waiting for a database connection from the pool.')
+OPERATION_LATENCY = Histogram('app_operation_duration_seconds', 'Vote, karma and rank operations; _count is the number run.', ('operation',))
+OPERATION_ERRORS = Counter('app_operation_errors_total', 'Vote, karma and rank operations that raised.', ('operation',))
+CACHE_REQUESTS = Counter('cache_requests_total', 'Cache lookups by result.', ('cache', 'result'))
+CACHE_HIT_RATIO = HitRatio('cache_hit_ratio', 'Share of cache lookups that were hits, over all workers.', CACHE_REQUESTS)
+
+
+def timed(operation):
+  """
+  Decorator counting and timing calls of a function as an app operation.
+  """
+  def decorator(function):
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+      started = time.perf_counter()
+      try:
+        return function(*args, **kwargs)
+      except Exception:
+        OPERATION_ERRORS.inc(operation=operation)
+        raise
+      finally:
+        OPERATION_LATENCY.observe(time.perf_counter() - started, operation=operation)
+    return wrapper
+  return decorator
+
+
+def mark_process_dead(pid, directory=None):
+  """
+  Drop the gauges of a worker that has exited; call from gunicorn's child_exit hook.
+  """
+  path = os.path.join(directory or metrics.directory or os.environ.get('METRICS_DIR', ''), f'gauge_{pid}.db')
+  if os.path.exists(path):
+    os.remove(path)
+
+
+def _time_pool_checkouts(pool):
+  connect = pool.connect
+  if getattr(connect, 'timed', False):
+    return
+
+  def timed_connect():
+    started = time.perf_counter()
+    try:
+      return connect()
+    finally:
+      DB_CHECKOUT.observe(time.perf_counter() - started)
+
+  timed_connect.timed = True
+  pool.connect = timed_connect
+
+
+def setup_metrics(app):
+  """
+  Count and time every request by blueprint and route, time database connection
+  checkouts, and keep the values in METRICS_DIR when it is set (see Registry).
+  """
+  metrics.configure(app.config.get('METRICS_DIR'))
+  with app.app_context():
+    from App.database import db
+    _time_pool_checkouts(db.engine.pool)
+
+  @app.before_request
+  def start_request_metrics():
+    g._metrics_started = time.perf_counter()
+    HTTP_IN_FLIGHT.inc()
+
+  def record(status):
+    started = g.pop('_metrics_started', None)
+    if started is None:
+      return
+    HTTP_IN_FLIGHT.dec()
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    labels = {'blueprint': request.blueprint or '', 'route': route, 'method': request.method}
+    HTTP_LATENCY.observe(time.perf_counter() - started, **labels)
+    HTTP_REQUESTS.inc(status=status, **labels)
+
+  @app.after_request
+  def record_request_metrics(response):
+    record(response.status_code)
+    return response
+
+  @app.teardown_request
+  def record_failed_request_metrics(error):
+    # after_request is skipped when a view raises
+    record(500)
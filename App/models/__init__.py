@@ -1,8 +1,13 @@
 from .user import *
 from .admin import *
+from .ranking import *
+from .shard import *
 from .karma import *
+from .vote import *
 from .review import *
 from .staff import *
 from .student import *
+from .directory import *
 from .publisher import *
 from .subscriber import*
+from .loading import *
@@ -0,0 +1,88 @@
+from sqlalchemy import event
+
+from App.database import db
+from .user import User
+from .admin import Admin
+from .staff import Staff
+from .student import Student
+
+# role names sort in the order users are listed: admins, staff, then students
+USER_ROLES = {'admin': Admin, 'staff': Staff, 'student': Student}
+
+
+def role_of(user):
+  """
+  Get the role of a user.
+
+  Args:
+      user: An Admin, Staff or Student.
+
+  Returns:
+      str: 'admin', 'staff' or 'student'.
+  """
+  for role, model in USER_ROLES.items():
+    if isinstance(user, model):
+      return role
+  raise ValueError(f'{type(user).__name__} has no role')
+
+
+class UserDirectory(db.Model):
+  """
+  One row per user of any role, so the role behind an ID is a single primary key lookup
+  and the primary key keeps IDs unique across the admin, staff and student tables.
+  Mapper events keep it in step with those tables.
+  """
+  __tablename__ = 'user_directory'
+  ID = db.Column(db.String(120), primary_key=True)
+  role = db.Column(db.String(10), nullable=False)
+
+  # serves listing every user in (role, ID) order
+  __table_args__ = (db.Index('ix_user_directory_role_ID', 'role', 'ID'),)
+
+  @classmethod
+  def roleOf(cls, ID):
+    """
+    Look up the role of the user with an ID.
+
+    Args:
+        ID (str): The user's ID.
+
+    Returns:
+        str or None: The role, or None if no user has the ID.
+    """
+    return db.session.query(cls.role).filter_by(ID=str(ID)).scalar()
+
+  @classmethod
+  def lookup(cls, ID):
+    """
+    Get the user with an ID, whatever their role, with two primary key lookups.
+
+    Args:
+        ID (str): The user's ID.
+
+    Returns:
+        Admin, Staff, Student or None.
+    """
+    role = cls.roleOf(ID)
+    return db.session.get(USER_ROLES[role], str(ID)) if role else None
+
+
+# the directory row is written in the same flush as the user row, so a duplicate ID
+# in another role fails the whole insert
+@event.listens_for(User, 'after_insert', propagate=True)
+def _add_to_directory(mapper, connection, user):
+  connection.execute(UserDirectory.__table__.insert().values(ID=user.ID, role=role_of(user)))
+
+
+@event.listens_for(User, 'after_update', propagate=True)
+def _rename_in_directory(mapper, connection, user):
+  history = db.inspect(user).attrs.ID.history
+  if history.deleted and history.added:
+    directory = UserDirectory.__table__
+    connection.execute(directory.update().where(directory.c.ID == history.deleted[0]).values(ID=user.ID))
+
+
+@event.listens_for(User, 'after_delete', propagate=True)
+def _remove_from_directory(mapper, connection, user):
+  directory = UserDirectory.__table__
+  connection.execute(directory.delete().where(directory.c.ID == user.ID))
@@ -1,5 +1,10 @@
+from datetime import datetime
 from App.database import db
+from sqlalchemy.orm.attributes import set_committed_value
 from .student import Student
+from .ranking import RankingState
+from .shard import KarmaShard, counter_shards, increment_shard
+from App.leaderboard import expire_leaderboard
 
 class Karma(db.Model):
   __tablename__ = "karma"
@@ -7,6 +12,18 @@ class Karma(db.Model):
   score = db.Column(db.Float, nullable=False, default=0.0)
   rank = db.Column(db.Integer, nullable=False, default=-99)
   review_id = db.Column(db.Integer, db.ForeignKey('review.ID'), nullable=True, unique=True)
+  rankDirty = db.Column(db.Boolean, nullable=False, default=False)  # score changed since the last rank recompute
+  rankedScore = db.Column(db.Float, nullable=True)  # the score the stored rank was computed from
+  rankedVersion = db.Column(db.Integer, nullable=False, default=0, index=True)  # ranking version that last changed this row
+  # score changes not yet folded in from counter shards (see COUNTER_SHARDS)
+  shardScore = db.column_property(
+      db.select(db.func.coalesce(db.func.sum(KarmaShard.score), 0.0))
+      .where(KarmaShard.karmaID == karmaID).correlate_except(KarmaShard).scalar_subquery(),
+      deferred=True)
+
+  __table_args__ = (
+      db.Index('ix_karma_rankDirty', rankDirty, postgresql_where=rankDirty, sqlite_where=rankDirty),
+  )
 
   def __init__(self, score=0.0, rank=-99):
     """
@@ -26,11 +43,36 @@ class Karma(db.Model):
     Returns:
         dict: A dictionary representing the Karma object with keys for 'karmaID', 'score', and 'rank'.
     """
-    return {"karmaID": self.karmaID, "score": self.score, "rank": self.rank}
+    return {"karmaID": self.karmaID, "score": self.currentScore(), "rank": self.rank}
+
+  def currentScore(self):
+    """
+    Get the score, including changes still held in counter shards.
+
+    Returns:
+        float: The Karma score.
+    """
+    if not counter_shards():
+      return self.score
+    return self.score + self.shardScore
+
+  @classmethod
+  def counterLoaders(cls):
+    """
+    Get the loader options that read the counter shards along with the karma records.
+
+    Returns:
+        tuple: Loader options for Query.options(), empty unless COUNTER_SHARDS is set.
+    """
+    if not counter_shards():
+      return ()
+    return (db.undefer(cls.shardScore),)
 
   def calculateScore(self, student):
     """
-    Calculate the Karma score based on the student's reviews.
+    Recalculate the Karma score from scratch based on all of the student's reviews.
+    Votes, edits and deletes keep the score up to date incrementally (see adjustScore),
+    so this is only needed to repair a score that has drifted.
 
     Args:
         student (Student): The Student object for which the Karma score is calculated.
@@ -43,18 +85,24 @@ class Karma(db.Model):
 
     # Iterate through reviews associated with the student
     for review in student.reviews:
+      upvotes, downvotes = review.voteCounts()
       if review.isPositive == True:  #if review is positive then upvotes on the review contributes to good karma
-        goodKarma += review.upvotes
-        badKarma += review.downvotes
+        goodKarma += upvotes
+        badKarma += downvotes
       else:  #if review is not positive then upvotes on the review contributes to bad karma
-        badKarma += review.upvotes
-        goodKarma += review.downvotes
+        badKarma += upvotes
+        goodKarma += downvotes
 
     # Calculate the karma score
     self.score = goodKarma - badKarma
+    self.rankDirty = True
+    # the reviews already count every vote, so pending shard changes are superseded
+    if self.karmaID is not None:
+      db.session.execute(db.delete(KarmaShard).where(KarmaShard.karmaID == self.karmaID))
 
     # connect the karma record to the student
     student.karmaID = self.karmaID
+    student.karma = self
 
     # Commit the changes to the database
     try:
@@ -70,38 +118,161 @@ class Karma(db.Model):
   def updateRank(cls):
     """
     Update the rank of students based on their Karma scores.
-    """
-    # Calculate the rank of students based on their karma score
 
-    # Query all students with karma scores in descending order
-    studentsOrdered = db.session.query(Student, Karma)\
-               .join(Karma, Student.karmaID == Karma.karmaID)\
-               .order_by(db.desc(Karma.score))\
-               .all()
+    Ranks are dense (equal scores share a rank) and computed in the database with
+    DENSE_RANK() OVER (ORDER BY score DESC); only rows whose rank changed are written
+    by the ranking pass. Score drift on rows that kept their rank is recorded with the
+    rankDirty cleanup, which writes those rows anyway. Each run that changes anything
+    bumps the ranking version and tags the changed rows with it, so readers can pick up
+    just the difference.
 
-    rank = 1
-    prev_score = None
+    Returns:
+        int: The number of Karma records whose rank changed, or None on error.
+    """
+    # rank every karma record that belongs to a student, highest score first
+    ranked = db.select(
+        cls.karmaID.label('karmaID'),
+        cls.score.label('score'),
+        db.func.dense_rank().over(order_by=db.desc(cls.score)).label('newRank'))\
+      .join(Student, Student.karmaID == cls.karmaID)\
+      .subquery()
+    moved = cls.rank != ranked.c.newRank
 
-    #assign ranks to student with the highest karma at the top
-    for student, karma in studentsOrdered:
-      if prev_score is None:
-        prev_score = karma.score
-        karma.rank = rank
-      elif prev_score == karma.score:
-        karma.rank = rank
+    try:
+      # one recompute at a time across processes
+      state = RankingState.get(lock=True)
+      version = state.version + 1
+
+      # a row is clean once ranked at its current score; anything voted on meanwhile stays dirty
+      if db.session.get_bind().dialect.name == 'postgresql':
+        # a single UPDATE ... FROM touching only the rows that moved
+        result = db.session.execute(
+            db.update(cls)
+            .where(cls.karmaID == ranked.c.karmaID)
+            .where(moved)
+            .values(rank=ranked.c.newRank, rankedScore=ranked.c.score, rankedVersion=version,
+                    rankDirty=cls.score != ranked.c.score)
+            .execution_options(synchronize_session=False))
+        changed = result.rowcount
       else:
-        rank += 1
-        karma.rank = rank
-        prev_score = karma.score
+        # portable fallback: rank with the same window query, then write the changed rows by primary key
+        rows = db.session.execute(
+            db.select(ranked.c.karmaID, ranked.c.newRank, ranked.c.score, cls.score)
+            .join(cls, cls.karmaID == ranked.c.karmaID)
+            .where(moved)).all()
+        if rows:
+          db.session.bulk_update_mappings(cls, [
+              {'karmaID': karmaID, 'rank': newRank, 'rankedScore': score, 'rankedVersion': version,
+               'rankDirty': current != score}
+              for karmaID, newRank, score, current in rows])
+        changed = len(rows)
 
-      student.karmaID = karma.karmaID
+      # the remaining dirty rows kept their rank; record the score they were ranked at
+      # (a row that has moved since the pass above stays dirty for the next run)
+      dirty = db.session.execute(
+          db.select(cls.karmaID, cls.score, cls.rankedScore, ranked.c.score)
+          .outerjoin(ranked, ranked.c.karmaID == cls.karmaID)
+          .where(cls.rankDirty)
+          .where(db.or_(ranked.c.karmaID.is_(None), ~moved))).all()
+      drifted = [{'karmaID': karmaID, 'rankedScore': score, 'rankedVersion': version, 'rankDirty': current != score}
+                 for karmaID, current, rankedScore, score in dirty if score is not None and score != rankedScore]
+      settled = [{'karmaID': karmaID, 'rankDirty': False}
+                 for karmaID, current, rankedScore, score in dirty
+                 if score is None or (score == rankedScore and current == score)]
+      if drifted or settled:
+        db.session.bulk_update_mappings(cls, drifted + settled)
 
-  # Commit the changes to the database
-    try:
+      if changed or drifted:
+        state.version = version
+      state.rankedAt = datetime.utcnow()
       db.session.commit()
+      if changed or drifted:
+        expire_leaderboard()
+      return changed
     except Exception as e:
       print(f'error updating karma rank {e}')
       db.session.rollback()
+      return None
+
+  @classmethod
+  def rankingsDirty(cls):
+    """
+    Check whether stored ranks are out of date, either because karma changed since the
+    last recompute or because a recompute was requested.
+
+    Returns:
+        bool: True if ranks should be recomputed.
+    """
+    if db.session.query(db.exists().where(cls.rankDirty)).scalar():
+      return True
+    state = RankingState.get()
+    return state.requestedAt is not None and (state.rankedAt is None or state.requestedAt > state.rankedAt)
+
+  @classmethod
+  def forStudent(cls, student):
+    """
+    Retrieve the Karma record of a student, creating and linking one if the student has none yet.
+
+    Args:
+        student (Student): The Student object whose Karma record is needed.
+
+    Returns:
+        Karma: The Karma record of the student (flushed but not committed).
+    """
+    if student.karmaID is not None:
+      karma = cls.query.get(student.karmaID)
+      if karma:
+        return karma
+
+    karma = cls(score=0.0, rank=-99)
+    db.session.add(karma)
+    db.session.flush()
+
+    # link it only if a concurrent vote has not linked one of its own first
+    linked = db.session.execute(
+        db.update(Student).where(Student.ID == student.ID, Student.karmaID.is_(None))
+        .values(karmaID=karma.karmaID).execution_options(synchronize_session=False)).rowcount
+    if not linked:
+      db.session.delete(karma)
+      db.session.refresh(student, ['karmaID'])
+      return cls.query.get(student.karmaID)
+
+    set_committed_value(student, 'karmaID', karma.karmaID)
+    set_committed_value(student, 'karma', karma)
+    return karma
+
+  @classmethod
+  def adjustScore(cls, karmaID, delta):
+    """
+    Add a delta to a Karma score with a single atomic UPDATE, without reading the reviews.
+    With COUNTER_SHARDS set the delta goes to a random counter shard instead and is
+    flagged for ranking when the shards are folded. The caller is responsible for committing.
+
+    Args:
+        karmaID (int): The ID of the Karma record.
+        delta (float): The amount to add to the score (may be negative).
+    """
+    if not delta:
+      return
+    if counter_shards():
+      increment_shard(KarmaShard, {'karmaID': karmaID}, {'score': delta})
+      return
+    db.session.execute(
+        db.update(cls).where(cls.karmaID == karmaID).values(score=cls.score + delta, rankDirty=True))
+
+  @classmethod
+  def adjustStudentScore(cls, student, delta):
+    """
+    Add a delta to a student's Karma score, creating their Karma record if needed.
+
+    Args:
+        student (Student): The Student object whose karma changes.
+        delta (float): The amount to add to the score (may be negative).
+    """
+    if not delta:
+      return
+    karma = cls.forStudent(student)
+    cls.adjustScore(karma.karmaID, delta)
 
   @classmethod
   def getScore(cls, karmaID):
@@ -117,7 +288,7 @@ class Karma(db.Model):
     # Retrieve the karma score by karma id
     karma = cls.query.filter_by(karmaID=karmaID).first()
     if karma:
-      return karma.score
+      return karma.currentScore()
     return None
 
   def update(self):
@@ -0,0 +1,98 @@
+from App.database import db
+
+# Relationships are lazy by default; a query states what it will read by loading
+# through one of these profiles:
+#   summary     the record's own columns, no relationships
+#   detail      everything to_json reads (see the models' jsonLoaders)
+#   vote-check  a review with its student and their karma
+LOADING_PROFILES = ('summary', 'detail', 'vote-check')
+
+
+def profile_options(model, profile):
+  """
+  Get the loader options of a loading profile for a model.
+
+  Args:
+      model: The model class being queried.
+      profile (str): One of LOADING_PROFILES.
+
+  Returns:
+      tuple: Loader options for Query.options().
+
+  Raises:
+      ValueError: If the profile does not exist for the model.
+  """
+  from .review import Review
+  from .student import Student
+
+  if profile == 'summary':
+    return (db.lazyload('*'),)
+  if profile == 'detail':
+    return model.jsonLoaders()
+  if profile == 'vote-check' and model is Review:
+    return (
+        db.lazyload('*'),
+        db.joinedload(Review.student).options(db.lazyload('*'), db.joinedload(Student.karma).lazyload('*')),
+    )
+  raise ValueError(f'no {profile!r} loading profile for {model.__name__}')
+
+
+def load(model, profile='summary'):
+  """
+  Start a query for a model that loads relationships according to a loading profile.
+
+  Args:
+      model: The model class to query.
+      profile (str, optional): One of LOADING_PROFILES. Defaults to 'summary'.
+
+  Returns:
+      Query: The query.
+  """
+  return db.session.query(model).options(*profile_options(model, profile))
+
+
+def profile_fanout(model, profile, limit=100):
+  """
+  Measure how many rows the database returns for a loading profile, by loading up to
+  `limit` records of the model in a fresh session and counting the rows each emitted
+  statement produces.
+
+  Args:
+      model: The model class to load.
+      profile (str): One of LOADING_PROFILES.
+      limit (int, optional): The number of records to load. Defaults to 100.
+
+  Returns:
+      dict: The profile, the records loaded, the statements run, the total rows they
+      returned and the fan-out (rows per record).
+  """
+  from sqlalchemy import event
+  from sqlalchemy.orm import Session
+
+  statements = []
+
+  def record(conn, cursor, statement, parameters, context, executemany):
+    statements.append((statement, parameters))
+
+  with Session(db.engine) as session:
+    query = session.query(model).options(*profile_options(model, profile))\
+      .order_by(*model.__mapper__.primary_key).limit(limit)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+      roots = len(query.all())
+    finally:
+      event.remove(db.engine, 'before_cursor_execute', record)
+
+    rows = 0
+    connection = session.connection()
+    for statement, parameters in statements:
+      rows += connection.exec_driver_sql(f'SELECT COUNT(*) FROM ({statement}) AS fanout', parameters).scalar()
+
+  return {
+      "model": model.__name__,
+      "profile": profile,
+      "records": roots,
+      "statements": len(statements),
+      "rows": rows,
+      "fanout": round(rows / roots, 2) if roots else None
+  }
@@ -0,0 +1,85 @@
+from datetime import datetime
+from App.database import db
+
+
+class RankingState(db.Model):
+  __tablename__ = 'ranking_state'
+  ID = db.Column(db.Integer, primary_key=True)
+  version = db.Column(db.Integer, nullable=False, default=0)  # bumped every time stored ranks change
+  rankedAt = db.Column(db.DateTime, nullable=True)
+  requestedAt = db.Column(db.DateTime, nullable=True)  # an explicit recompute was asked for
+
+  SINGLETON_ID = 1
+
+  def to_json(self):
+    """
+    Convert the RankingState to a JSON-compatible dictionary.
+
+    Returns:
+        dict: The current ranking version and when it was computed.
+    """
+    return {
+        "version": self.version,
+        "rankedAt": self.rankedAt.strftime("%d-%m-%Y %H:%M:%S") if self.rankedAt else None,
+        "requestedAt": self.requestedAt.strftime("%d-%m-%Y %H:%M:%S") if self.requestedAt else None
+    }
+
+  @classmethod
+  def get(cls, lock=False):
+    """
+    Retrieve the ranking state, creating it if the database predates it.
+
+    Args:
+        lock (bool, optional): Lock the row until the end of the transaction so only one
+            process recomputes ranks at a time. Defaults to False.
+
+    Returns:
+        RankingState: The single ranking state record.
+    """
+    query = cls.query.filter_by(ID=cls.SINGLETON_ID)
+    if lock:
+      query = query.with_for_update()
+    state = query.first()
+    if state is None:
+      state = cls(ID=cls.SINGLETON_ID, version=0)
+      db.session.add(state)
+      db.session.flush()
+    return state
+
+  @classmethod
+  def currentVersion(cls):
+    """
+    Get the version of the stored rankings without loading the record.
+
+    Returns:
+        int: The ranking version, 0 if ranks were never computed.
+    """
+    version = db.session.query(cls.version).filter_by(ID=cls.SINGLETON_ID).scalar()
+    return version or 0
+
+  @classmethod
+  def bumpVersion(cls, connection):
+    """
+    Bump the ranking version without touching any rank, for changes that alter what the
+    rankings show but not the ranks themselves (a ranked student renamed or deleted), so
+    that responses cached for the old version stop being served. Runs in the caller's
+    transaction on the given connection.
+
+    Args:
+        connection: The connection of the flush in progress.
+    """
+    table = cls.__table__
+    connection.execute(table.update().where(table.c.ID == cls.SINGLETON_ID).values(version=table.c.version + 1))
+
+  @classmethod
+  def requestUpdate(cls):
+    """
+    Ask the rank worker to recompute ranks on its next run even if no karma changed.
+
+    Returns:
+        RankingState: The ranking state.
+    """
+    state = cls.get()
+    state.requestedAt = datetime.utcnow()
+    db.session.commit()
+    return state
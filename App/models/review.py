@@ -1,38 +1,58 @@
 from App.database import db
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.orm.attributes import set_committed_value
+from App.cache import student_documents, invalidate_on_commit
 from .student import Student
 from datetime import datetime
 from .karma import Karma
-
-# Define the association table for staff upvotes on reviews
-review_staff_upvoters = db.Table(
-    'review_staff_upvoters',
-    db.Column('reviewID', db.Integer, db.ForeignKey('review.ID')),
-    db.Column('staffID', db.String(10), db.ForeignKey('staff.ID')),
-)
-
-review_staff_downvoters = db.Table(
-    'review_staff_downvoters',
-    db.Column('reviewID', db.Integer, db.ForeignKey('review.ID')),
-    db.Column('staffID', db.String(10), db.ForeignKey('staff.ID')),
-)
+from .vote import ReviewVote
+from .shard import ReviewCounterShard, counter_shards, increment_shard, _takeShards
 
 
 class Review(db.Model):
   __tablename__ = 'review'
   ID = db.Column(db.Integer, primary_key=True)
   reviewerID = db.Column(db.String(10), db.ForeignKey('staff.ID'))  #each review has 1 creator
-  reviewer = db.relationship('Staff', backref=db.backref('reviews_created', lazy='joined'), foreign_keys=[reviewerID]) #create reverse relationship from Staff back to Review to access reviews created by a specific staff member
+  reviewer = db.relationship('Staff', backref=db.backref('reviews_created', lazy=True), foreign_keys=[reviewerID]) #create reverse relationship from Staff back to Review to access reviews created by a specific staff member
   studentID = db.Column(db.String(10), db.ForeignKey('student.ID'))
-  staffUpvoters = db.relationship('Staff', secondary=review_staff_upvoters, backref=db.backref('reviews_upvoted', lazy='joined'))  #for staff who have voted on the review
-  staffDownvoters = db.relationship('Staff', secondary=review_staff_downvoters, backref=db.backref('reviews_downvoted', lazy='joined'))  #for staff who have voted on the review
+  # read-only views of review_vote; votes are written with ReviewVote.cast
+  staffUpvoters = db.relationship('Staff', secondary='review_vote', viewonly=True,
+                                  primaryjoin='and_(Review.ID == ReviewVote.reviewID, ReviewVote.direction == 1)',
+                                  backref=db.backref('reviews_upvoted', lazy=True, viewonly=True))
+  staffDownvoters = db.relationship('Staff', secondary='review_vote', viewonly=True,
+                                    primaryjoin='and_(Review.ID == ReviewVote.reviewID, ReviewVote.direction == -1)',
+                                    backref=db.backref('reviews_downvoted', lazy=True, viewonly=True))
   upvotes = db.Column(db.Integer, nullable=False)
   downvotes = db.Column(db.Integer, nullable=False)
   isPositive = db.Column(db.Boolean, nullable=False)
   created = db.Column(db.DateTime, default=datetime.utcnow)
   comment = db.Column(db.String(400), nullable=False)
+  version = db.Column(db.Integer, nullable=False, default=1)  # bumped by every change, checked by ORM flushes
+  # votes not yet folded in from counter shards (see COUNTER_SHARDS)
+  shardUpvotes = db.column_property(
+      db.select(db.func.coalesce(db.func.sum(ReviewCounterShard.upvotes), 0))
+      .where(ReviewCounterShard.reviewID == ID).correlate_except(ReviewCounterShard).scalar_subquery(),
+      deferred=True)
+  shardDownvotes = db.column_property(
+      db.select(db.func.coalesce(db.func.sum(ReviewCounterShard.downvotes), 0))
+      .where(ReviewCounterShard.reviewID == ID).correlate_except(ReviewCounterShard).scalar_subquery(),
+      deferred=True)
 
   subscribers = db.relationship('Karma', backref='review', lazy=True)
 
+  # an edit or delete computed from counters a concurrent vote has since changed fails with
+  # StaleDataError instead of applying a stale karma delta (see run_with_retry)
+  __mapper_args__ = {'version_id_col': version}
+
+  # keyset pagination orders reviews by (created, ID), overall and per student/reviewer
+  __table_args__ = (
+      db.Index('ix_review_created_ID', 'created', 'ID'),
+      db.Index('ix_review_studentID_created_ID', 'studentID', 'created', 'ID'),
+      db.Index('ix_review_reviewerID_created_ID', 'reviewerID', 'created', 'ID'),
+  )
+
   def __init__(self, reviewer, student, isPositive, comment):
     """
     Initialize a new Review object.
@@ -74,6 +94,10 @@ class Review(db.Model):
         bool: True if the review is successfully edited, None otherwise.
     """
     if self.reviewer == staff:
+      self.foldShards()
+      if bool(isPositive) != bool(self.isPositive):
+        # flipping positivity turns every vote's contribution around
+        self.updateKarma(-2 * self.karmaContribution())
       self.isPositive = isPositive
       self.comment = comment
       db.session.add(self)
@@ -92,6 +116,10 @@ class Review(db.Model):
         bool: True if the review is successfully deleted, None otherwise.
     """
     if self.reviewer == staff:
+      self.foldShards()
+      self.updateKarma(-self.karmaContribution())
+      ReviewVote.deleteForReview(self.ID)
+      db.session.execute(db.delete(ReviewCounterShard).where(ReviewCounterShard.reviewID == self.ID))
       db.session.delete(self)
       self.removeSubscriber()
       self.notifySubscriber()
@@ -99,32 +127,115 @@ class Review(db.Model):
       return True
     return None
 
+  def castVote(self, staff, upvote):
+    """
+    Record a staff member's vote on the review without committing.
+
+    Args:
+        staff (Staff): The staff member voting on the review.
+        upvote (bool): True for an upvote, False for a downvote.
+
+    Returns:
+        int: The karma delta the vote causes for the student, 0 if the staff member already voted this way.
+    """
+    direction = ReviewVote.UP if upvote else ReviewVote.DOWN
+    previous = ReviewVote.cast(self.ID, staff.ID, direction)
+    if previous == direction:
+      return 0
+
+    up, down = (1, 0) if upvote else (0, 1)
+    # switching sides takes back the earlier vote as well
+    if previous is not None:
+      up, down = (1, -1) if upvote else (-1, 1)
+    self.incrementVotes(up, down)
+    return (up - down) * self.voteWeight()
+
+  def incrementVotes(self, up, down):
+    """
+    Add to the vote counters with one SQL-side increment, so concurrent votes in other
+    processes are never overwritten, and refresh this object from the updated row.
+    With COUNTER_SHARDS set the increment goes to a random counter shard instead and
+    the review row is left alone until the shards are folded.
+
+    Args:
+        up (int): The change in upvotes.
+        down (int): The change in downvotes.
+    """
+    cls = type(self)
+    if counter_shards():
+      # the shared row lock keeps an edit or delete from folding the shards or flipping
+      # the review until this vote commits, and the vote is weighed by the current positivity
+      isPositive = db.session.execute(
+        db.select(cls.isPositive).where(cls.ID == self.ID).with_for_update(read=True)).scalar_one()
+      set_committed_value(self, 'isPositive', isPositive)
+      increment_shard(ReviewCounterShard, {'reviewID': self.ID}, {'upvotes': up, 'downvotes': down})
+      db.session.expire(self, ['shardUpvotes', 'shardDownvotes'])
+      return
+
+    columns = (cls.upvotes, cls.downvotes, cls.isPositive, cls.version)
+    stmt = db.update(cls).where(cls.ID == self.ID)\
+      .values(upvotes=cls.upvotes + up, downvotes=cls.downvotes + down, version=cls.version + 1)\
+      .execution_options(synchronize_session=False)
+    if db.session.get_bind().dialect.update_returning:
+      row = db.session.execute(stmt.returning(*columns)).one()
+    else:
+      db.session.execute(stmt)
+      row = db.session.query(*columns).filter(cls.ID == self.ID).one()
+
+    # the row as updated (positivity included) is what this transaction now holds
+    for column, value in zip(columns, row):
+      set_committed_value(self, column.key, value)
+
+  def foldShards(self):
+    """
+    Move the votes held in this review's counter shards into its row without committing,
+    so that a karma delta computed from voteCounts() afterwards covers every vote. The row
+    is taken first, at the version this object was loaded with: votes still in flight hold
+    a shared lock on it (see incrementVotes), and a change since loading raises
+    StaleDataError for run_with_retry. Does nothing unless COUNTER_SHARDS is set.
+    """
+    if not counter_shards():
+      return
+    cls = type(self)
+    taken = db.session.execute(
+      db.update(cls).where(cls.ID == self.ID, cls.version == self.version)
+      .values(version=cls.version + 1).execution_options(synchronize_session=False)).rowcount
+    if not taken:
+      raise StaleDataError(f'review {self.ID} changed since it was loaded')
+
+    rows = _takeShards(ReviewCounterShard, 'reviewID', ['upvotes', 'downvotes'], ReviewCounterShard.reviewID == self.ID)
+    up, down = sum(row[1] for row in rows), sum(row[2] for row in rows)
+    if up or down:
+      db.session.execute(
+        db.update(cls).where(cls.ID == self.ID)
+        .values(upvotes=cls.upvotes + up, downvotes=cls.downvotes + down)
+        .execution_options(synchronize_session=False))
+    set_committed_value(self, 'version', self.version + 1)
+    set_committed_value(self, 'upvotes', self.upvotes + up)
+    set_committed_value(self, 'downvotes', self.downvotes + down)
+    set_committed_value(self, 'shardUpvotes', 0)
+    set_committed_value(self, 'shardDownvotes', 0)
+
   def upvoteReview(self, staff):
     """
-    Delete the review if the staff member is the reviewer.
+    Upvote the review by a staff member.
 
     Args:
-        staff (Staff): The staff member attempting to delete the review.
+        staff (Staff): The staff member upvoting the review.
 
     Returns:
-        bool: True if the review is successfully deleted, None otherwise.
+        int: The updated number of upvotes.
     """
-    if staff in self.staffUpvoters:
-      return self.upvotes
+    delta = self.castVote(staff, True)
+    if not delta:
+      return self.voteCounts()[0]
     
-    self.upvotes += 1
-    self.staffUpvoters.append(staff)
-    
-    if staff in self.staffDownvoters:
-      self.downvotes -= 1
-      self.staffDownvoters.remove(staff)
-    
-    db.session.add(self)
+    self.updateKarma(delta)
     db.session.commit()
     
     self.notifySubscriber()
     
-    return self.upvotes
+    return self.voteCounts()[0]
 
   def downvoteReview(self, staff):
     """
@@ -136,48 +247,106 @@ class Review(db.Model):
     Returns:
         int: The updated number of downvotes.
     """
-    if staff in self.staffDownvoters:
-      return self.downvotes
-
-    self.downvotes += 1
-    self.staffDownvoters.append(staff)
-
-    if staff in self.staffUpvoters:
-      self.upvotes -= 1
-      self.staffUpvoters.remove(staff)
+    delta = self.castVote(staff, False)
+    if not delta:
+      return self.voteCounts()[1]
 
-    db.session.add(self)
+    self.updateKarma(delta)
     db.session.commit()
 
     self.notifySubscriber()
 
-    return self.downvotes
+    return self.voteCounts()[1]
   
-  def updateKarma(self):
+  def voteCounts(self):
     """
-    Update the karma for the associated student.
+    Get the vote counters, including votes still held in counter shards.
+
+    Returns:
+        tuple: The number of upvotes and downvotes.
     """
-    student = Student.query.get(self.studentID)
-    
-    if student.karmaID is None:
-      karma = Karma(score=0.0, rank=-99)
-      db.session.add(karma)
-      db.session.flush()
-      student.karmaID = karma.karmaID
-
-      student_karma = Karma.query.get(student.karmaID)
-      student_karma.calculateScore(student)
-      student_karma.updateRank()
-      try:
-        db.session.commit()
-      except Exception as e:
-        print (f'error updating karma {e}')
-        db.session.rollback()
+    if not counter_shards():
+      return self.upvotes, self.downvotes
+    return self.upvotes + self.shardUpvotes, self.downvotes + self.shardDownvotes
+
+  def voteOf(self, staff):
+    """
+    Get how a staff member voted on the review.
+
+    Args:
+        staff (Staff): The staff member.
+
+    Returns:
+        bool or None: True for an upvote, False for a downvote, None if they have not voted.
+    """
+    direction = ReviewVote.directionOf(self.ID, staff.ID)
+    return None if direction is None else direction == ReviewVote.UP
+
+  def voteWeight(self):
+    """
+    Get the karma a single upvote on this review is worth to the student.
+
+    Returns:
+        int: 1 for a positive review, -1 for a negative one (downvotes count the other way).
+    """
+    return 1 if self.isPositive else -1
+
+  def karmaContribution(self):
+    """
+    Get the net karma this review currently contributes to the student.
+
+    Returns:
+        int: The net votes on the review, signed by the review's positivity.
+    """
+    upvotes, downvotes = self.voteCounts()
+    return (upvotes - downvotes) * self.voteWeight()
+
+  def updateKarma(self, delta):
+    """
+    Apply a karma delta to the associated student without recalculating from all reviews.
+    The change joins the current transaction; the caller commits.
+
+    Args:
+        delta (int): The change in the student's karma score.
+    """
+    if not delta:
+      return
+    student = self.student or Student.query.get(self.studentID)
+    Karma.adjustStudentScore(student, delta)
   
+  @classmethod
+  def counterLoaders(cls):
+    """
+    Get the loader options that read the counter shards along with the reviews.
+
+    Returns:
+        tuple: Loader options for Query.options(), empty unless COUNTER_SHARDS is set.
+    """
+    if not counter_shards():
+      return ()
+    return (db.undefer(cls.shardUpvotes), db.undefer(cls.shardDownvotes))
+
+  @classmethod
+  def jsonLoaders(cls):
+    """
+    Get the loader options for the relationships to_json reads, so listing queries join
+    the reviewer and student in instead of loading them once per review.
+
+    Returns:
+        tuple: Loader options for Query.options().
+    """
+    return (
+        db.lazyload('*'),
+        db.joinedload(cls.reviewer).lazyload('*'),
+        db.joinedload(cls.student).lazyload('*'),
+        *cls.counterLoaders(),
+    )
+
   def to_json(self):
     """
     Convert the review instance to a JSON-formatted dictionary.
     """
+    upvotes, downvotes = self.voteCounts()
     return {
         "reviewID": self.ID,
         "reviewer": self.reviewer.firstname + " " + self.reviewer.lastname,
@@ -186,8 +355,8 @@ class Review(db.Model):
         "created":
         self.created.strftime("%d-%m-%Y %H:%M"),  #format the date/time
         "isPositive": self.isPositive,
-        "upvotes": self.upvotes,
-        "downvotes": self.downvotes,
+        "upvotes": upvotes,
+        "downvotes": downvotes,
         "comment": self.comment
     }
 
@@ -202,4 +371,12 @@ class Review(db.Model):
 
   def notifySubscriber(self):
     for subscriber in self.subscribers:
-      subscriber.update()
\ No newline at end of file
+      subscriber.update()
+
+
+# the reviews are part of their student's cached profile document
+@event.listens_for(Review, 'after_insert')
+@event.listens_for(Review, 'after_update')
+@event.listens_for(Review, 'after_delete')
+def _invalidate_student_document(mapper, connection, review):
+  invalidate_on_commit(object_session(review), student_documents, keys=[review.studentID])
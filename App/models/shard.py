@@ -0,0 +1,128 @@
+import random
+
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+
+from App.database import db
+
+
+class ReviewCounterShard(db.Model):
+  __tablename__ = 'review_counter_shard'
+  reviewID = db.Column(db.Integer, db.ForeignKey('review.ID', ondelete='CASCADE'), primary_key=True)
+  shard = db.Column(db.Integer, primary_key=True)
+  upvotes = db.Column(db.Integer, nullable=False, default=0)
+  downvotes = db.Column(db.Integer, nullable=False, default=0)
+
+
+class KarmaShard(db.Model):
+  __tablename__ = 'karma_shard'
+  karmaID = db.Column(db.Integer, db.ForeignKey('karma.karmaID', ondelete='CASCADE'), primary_key=True)
+  shard = db.Column(db.Integer, primary_key=True)
+  score = db.Column(db.Float, nullable=False, default=0.0)
+
+
+def counter_shards():
+  """
+  Get the number of counter shards per review and karma record.
+
+  Returns:
+      int: COUNTER_SHARDS, or 0 when votes write straight to the review and karma rows.
+  """
+  return current_app.config.get('COUNTER_SHARDS', 0)
+
+
+def increment_shard(model, key, values):
+  """
+  Add to the counters of a random shard, creating the shard row on first use. Concurrent
+  writers to the same record mostly land on different rows instead of queueing on one.
+  The caller is responsible for committing.
+
+  Args:
+      model: ReviewCounterShard or KarmaShard.
+      key (dict): The record the shard belongs to, e.g. {'reviewID': 1}.
+      values (dict): The amount to add to each counter column.
+  """
+  key = {**key, 'shard': random.randrange(counter_shards())}
+  dialect = db.session.get_bind().dialect.name
+  if dialect in ('postgresql', 'sqlite'):
+    if dialect == 'postgresql':
+      from sqlalchemy.dialects.postgresql import insert
+    else:
+      from sqlalchemy.dialects.sqlite import insert
+    stmt = insert(model).values(**key, **values)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(key),
+        set_={column: getattr(model, column) + stmt.excluded[column] for column in values})
+    db.session.execute(stmt)
+    return
+
+  where = [getattr(model, column) == value for column, value in key.items()]
+  increment = db.update(model).where(*where)\
+    .values({column: getattr(model, column) + value for column, value in values.items()})
+  if db.session.execute(increment).rowcount:
+    return
+  try:
+    with db.session.begin_nested():
+      db.session.execute(db.insert(model).values(**key, **values))
+  except IntegrityError:
+    # another writer created the shard first
+    db.session.execute(increment)
+
+
+def _takeShards(model, key, columns, *where):
+  # remove the shard rows (all of them, or those matching `where`) and return what they
+  # held, without losing concurrent increments
+  table = model.__table__
+  selected = [table.c[key]] + [table.c[column] for column in columns]
+  if db.session.get_bind().dialect.delete_returning:
+    return db.session.execute(table.delete().where(*where).returning(*selected)).all()
+  rows = db.session.execute(db.select(*selected, table.c.shard).where(*where).with_for_update()).all()
+  for row in rows:
+    db.session.execute(table.delete().where(table.c[key] == row[0], table.c.shard == row[-1]))
+  return [row[:-1] for row in rows]
+
+
+def fold_counter_shards():
+  """
+  Move the counts held in shards into the review and karma rows and delete the shards.
+  Folded karma is flagged for the rank worker. Commits.
+
+  Returns:
+      int: The number of shard rows folded.
+  """
+  from .review import Review
+  from .karma import Karma
+
+  # checking first keeps an idle fold from taking a write lock
+  pending = db.session.query(ReviewCounterShard.shard).first() or db.session.query(KarmaShard.shard).first()
+  if not pending:
+    db.session.rollback()
+    return 0
+
+  reviewRows = _takeShards(ReviewCounterShard, 'reviewID', ['upvotes', 'downvotes'])
+  votes = {}
+  for reviewID, upvotes, downvotes in reviewRows:
+    up, down = votes.get(reviewID, (0, 0))
+    votes[reviewID] = (up + upvotes, down + downvotes)
+  if votes:
+    review = Review.__table__
+    db.session.execute(
+        review.update().where(review.c.ID == db.bindparam('foldedReview'))
+        .values(upvotes=review.c.upvotes + db.bindparam('up'),
+                downvotes=review.c.downvotes + db.bindparam('down'),
+                version=review.c.version + 1),
+        [{'foldedReview': reviewID, 'up': up, 'down': down} for reviewID, (up, down) in votes.items()])
+
+  karmaRows = _takeShards(KarmaShard, 'karmaID', ['score'])
+  scores = {}
+  for karmaID, score in karmaRows:
+    scores[karmaID] = scores.get(karmaID, 0.0) + score
+  if scores:
+    karma = Karma.__table__
+    db.session.execute(
+        karma.update().where(karma.c.karmaID == db.bindparam('foldedKarma'))
+        .values(score=karma.c.score + db.bindparam('delta'), rankDirty=True),
+        [{'foldedKarma': karmaID, 'delta': delta} for karmaID, delta in scores.items()])
+
+  db.session.commit()
+  return len(reviewRows) + len(karmaRows)
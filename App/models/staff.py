@@ -1,8 +1,14 @@
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
 from App.database import db
+from App.cache import student_documents, invalidate_on_commit
 from .user import User
 from .student import Student
 from .karma import Karma
 from .review import Review
+from .loading import load
+from App.leaderboard import get_leaderboard
 
 
 class Staff(User):
@@ -63,7 +69,7 @@ class Staff(User):
     Returns:
         list: List of dictionaries representing reviews created by the staff.
     """
-    staff_reviews = staff.reviews_created
+    staff_reviews = load(Review, 'detail').filter_by(reviewerID=staff.ID)
     return [review.to_json() for review in staff_reviews]
 
   def createReview(self, student, isPositive, comment):
@@ -78,62 +84,68 @@ class Staff(User):
     Returns:
         dict: Dictionary representing the created review.
     """
-    review = Review(self, student, isPositive, comment)
-    student.reviews.append(review)  #add review to the student
+    with db.session.no_autoflush:
+      review = Review(self, student, isPositive, comment)
+      student.reviews.append(review)  #add review to the student
     
     return self.dataCommit(review)
 
-  def searchStudent(self, searchTerm):
+  def searchStudent(self, searchTerm, limit=20):
     """
-    Search for students by ID, first name, or last name.
+    Search for students by exact ID, or by first and last name ranked by similarity.
 
     Args:
         searchTerm (str): The search term (ID, first name, or last name).
+        limit (int, optional): The most students to return. Defaults to 20.
 
     Returns:
-        list: List of dictionaries representing matching students.
-    """
-    # Query the Student model for a student by ID or first name, or last name
-    students = db.session.query(Student).filter(
-        (Student.ID == searchTerm)
-        |  #studentID must be exact match (string)
-        (Student.firstname.ilike(f"%{searchTerm}%"))
-        |  # Search by firstname or lastname - case-insensitive
-        (Student.lastname.ilike(f"%{searchTerm}%"))).all()
-
-    if students:
-      # If matching students are found, return their json representations in a list
-      return [student.to_json() for student in students]
-    else:
+        list: List of dictionaries representing matching students, best match first,
+        each with its similarity to the search term.
+    """
+    from App.search import search_students
+
+    matches = search_students(searchTerm, limit)
+    if not matches:
       # If no matching students are found, return an empty list
       return []
 
-  def getStudentRankings(self):
+    # load only the students on the result, in bulk, then put them back in ranking order
+    students = load(Student, 'detail').filter(Student.ID.in_([studentID for studentID, _ in matches]))
+    students = {student.ID: student for student in students}
+    return [{**students[studentID].to_json(), "similarity": round(score, 3)}
+            for studentID, score in matches if studentID in students]
+
+  def getStudentRankings(self, limit=None):
     """
     Get the rankings of students based on their karma scores.
 
+    Args:
+        limit (int, optional): Only return the top `limit` students. Defaults to all ranked students.
+
     Returns:
         list: List of dictionaries representing student rankings.
     """
-    students = db.session.query(Student, Karma)\
-                .join(Karma, Student.karmaID == Karma.karmaID)\
-                .order_by(Karma.rank.asc())\
-                .all()
-
-    if students:
-      # If students with rankings are found, return a list of their JSON representations
-      student_rankings = [{
-          "studentID": student.Student.ID,
-          "firstname": student.Student.firstname,
-          "lastname": student.Student.lastname,
-          "karmaScore": student.Karma.score,
-          "karmaRank": student.Karma.rank
-      } for student in students]
-      return student_rankings
-    else:
+    ranked = get_leaderboard().top(limit)
+    if not ranked:
       # If no students with rankings are found, return an empty list
       return []
 
+    names = db.session.query(Student.ID, Student.firstname, Student.lastname)
+    if limit is None:
+      names = names.filter(Student.karmaID.isnot(None))
+    else:
+      names = names.filter(Student.ID.in_([studentID for studentID, _, _ in ranked]))
+    names = {ID: (firstname, lastname) for ID, firstname, lastname in names}
+
+    # return the ranked students in leaderboard order
+    return [{
+        "studentID": studentID,
+        "firstname": names[studentID][0],
+        "lastname": names[studentID][1],
+        "karmaScore": score,
+        "karmaRank": rank
+    } for studentID, score, rank in ranked if studentID in names]
+
   @staticmethod
   def dataCommit(entity):
     """
@@ -152,4 +164,12 @@ class Staff(User):
     except Exception as e:
       db.session.rollback()
       print(f'Error: {e}')
-      return None
\ No newline at end of file
+      return None
+
+
+# cached student documents show their reviewers' names
+@event.listens_for(Staff, 'after_update')
+def _invalidate_reviewed_student_documents(mapper, connection, staff):
+  state = db.inspect(staff)
+  if state.attrs.firstname.history.has_changes() or state.attrs.lastname.history.has_changes():
+    invalidate_on_commit(object_session(staff), student_documents, dependencies=[('staff', staff.ID)])
@@ -1,5 +1,11 @@
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
 from App.database import db
 from .user import User
+from .ranking import RankingState
+from App.leaderboard import get_leaderboard, expire_leaderboard
+from App.cache import student_documents, invalidate_on_commit
 
 
 class Student(User):
@@ -8,8 +14,15 @@ class Student(User):
 	contact = db.Column(db.String(30), nullable=False)
 	studentType = db.Column(db.String(30))  #full-time, part-time or evening
 	yearOfStudy = db.Column(db.Integer, nullable=False)
-	reviews = db.relationship('Review', backref='student', lazy='joined')
+	reviews = db.relationship('Review', backref='student', lazy=True)
 	karmaID = db.Column(db.Integer, db.ForeignKey('karma.karmaID'))
+	karma = db.relationship('Karma', lazy=True)
+
+	# typeahead matches name prefixes case-insensitively with range scans over these
+	__table_args__ = (
+		db.Index('ix_student_firstname_lower', db.text('lower(firstname)')),
+		db.Index('ix_student_lastname_lower', db.text('lower(lastname)')),
+	)
 
 	def __init__(self, studentID, firstname, lastname, password, contact, studentType, yearofStudy):
 		"""
@@ -63,10 +76,30 @@ class Student(User):
         "studentType": self.studentType,
         "yearOfStudy": self.yearOfStudy,
         "reviews": [review.to_json() for review in self.reviews],
-				"karmaScore": karma.score if karma else None,
-        "karmaRank": karma.rank if karma else None,
+				"karmaScore": karma.currentScore() if karma else None,
+        "karmaRank": get_leaderboard().rank_of(self.ID) if karma else None,
     }
 
+	@classmethod
+	def jsonLoaders(cls):
+		"""
+		Get the loader options for the relationships to_json reads: the karma record and
+		the reviews with their reviewers, each loaded for the whole result in one query.
+
+		Returns:
+			tuple: Loader options for Query.options().
+		"""
+		from .review import Review
+		from .karma import Karma
+		return (
+			db.selectinload(cls.karma).options(db.lazyload('*'), *Karma.counterLoaders()),
+			db.selectinload(cls.reviews).options(
+				db.lazyload('*'),
+				db.selectinload(Review.reviewer).lazyload('*'),
+				*Review.counterLoaders(),
+			),
+		)
+
 	def getKarma(self):
 		"""
 		Retrieve the Karma object associated with the student.
@@ -75,5 +108,27 @@ class Student(User):
 			Karma or None: The Karma object if associated, or None if not found.
 
 		"""
-		from .karma import Karma
-		return Karma.query.get(self.karmaID)
+		return self.karma
+
+
+# the rankings show ranked students' names; a change to them is a new ranking version
+@event.listens_for(Student, 'after_update')
+def _bump_ranking_version_on_rename(mapper, connection, student):
+	state = db.inspect(student)
+	if student.karmaID is not None and (state.attrs.firstname.history.has_changes() or state.attrs.lastname.history.has_changes()):
+		RankingState.bumpVersion(connection)
+		expire_leaderboard()
+
+
+@event.listens_for(Student, 'after_delete')
+def _bump_ranking_version_on_delete(mapper, connection, student):
+	if student.karmaID is not None:
+		RankingState.bumpVersion(connection)
+		expire_leaderboard()
+
+
+# a student's cached profile document is dropped whenever their record changes
+@event.listens_for(Student, 'after_update')
+@event.listens_for(Student, 'after_delete')
+def _invalidate_student_document(mapper, connection, student):
+	invalidate_on_commit(object_session(student), student_documents, keys=[student.ID])
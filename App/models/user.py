@@ -1,8 +1,37 @@
-from werkzeug.security import check_password_hash, generate_password_hash
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+from flask import current_app, has_app_context
 from flask_login import UserMixin
 from App.database import db
 from abc import ABC
 
+# werkzeug's default; PASSWORD_HASH_METHOD overrides it
+DEFAULT_PASSWORD_HASH_METHOD = 'pbkdf2:sha256:260000'
+
+
+def password_hash_method():
+  """
+  Get the method new password hashes are made with, e.g. 'pbkdf2:sha256:260000'.
+  """
+  if has_app_context():
+    return current_app.config.get('PASSWORD_HASH_METHOD', DEFAULT_PASSWORD_HASH_METHOD)
+  return DEFAULT_PASSWORD_HASH_METHOD
+
+
+def hash_parameters(method):
+  """
+  Split a werkzeug hash method into its parameters, filling in what werkzeug would
+  default, e.g. 'pbkdf2:sha256' -> ('pbkdf2', 'sha256', 260000).
+
+  Returns:
+      tuple: The algorithm followed by its parameters.
+  """
+  algorithm, *args = method.split(':')
+  if algorithm == 'pbkdf2':
+    digest = args[0] if args and args[0] else 'sha256'
+    iterations = int(args[1]) if len(args) > 1 and args[1] else DEFAULT_PBKDF2_ITERATIONS
+    return (algorithm, digest, iterations)
+  return (algorithm, *args)
+
 
 class User(db.Model, UserMixin):
   __abstract__ = True
@@ -35,6 +64,17 @@ class User(db.Model, UserMixin):
     """
     return {'firstname': self.firstname, 'lastname': self.lastname}
 
+  @classmethod
+  def jsonLoaders(cls):
+    """
+    Get the loader options for the relationships to_json reads, so listing queries can
+    load them up front in bulk instead of once per row.
+
+    Returns:
+        tuple: Loader options for Query.options(); to_json reads no relationships here.
+    """
+    return (db.lazyload('*'),)
+
   def set_password(self, password):
     """
     Set the password for the Admin using a secure hash function.
@@ -42,7 +82,17 @@ class User(db.Model, UserMixin):
     Args:
         password (str): The plaintext password to be hashed.
     """
-    self.password = generate_password_hash(password, method='sha256')
+    self.password = generate_password_hash(password, method=password_hash_method())
+
+  def needsRehash(self):
+    """
+    Check whether the stored hash was made with other parameters than new hashes are,
+    e.g. the old unsalted-iteration 'sha256' method or fewer pbkdf2 iterations.
+
+    Returns:
+        bool: True if the password should be hashed again the next time it is known.
+    """
+    return hash_parameters(self.password.split('$', 1)[0]) != hash_parameters(password_hash_method())
 
   def check_password(self, password):
     """
@@ -0,0 +1,100 @@
+from datetime import datetime
+from App.database import db
+
+
+class ReviewVote(db.Model):
+  __tablename__ = 'review_vote'
+  reviewID = db.Column(db.Integer, db.ForeignKey('review.ID', ondelete='CASCADE'), primary_key=True)
+  staffID = db.Column(db.String(10), db.ForeignKey('staff.ID', ondelete='CASCADE'), primary_key=True)
+  direction = db.Column(db.SmallInteger, nullable=False)  # UP or DOWN
+  created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+  # the primary key serves lookups by review; this one serves a staff member's votes
+  __table_args__ = (db.Index('ix_review_vote_staffID', 'staffID'),)
+
+  UP = 1
+  DOWN = -1
+
+  def to_json(self):
+    """
+    Convert the ReviewVote to a JSON-compatible dictionary.
+
+    Returns:
+        dict: The review, the voter and whether the vote is an upvote.
+    """
+    return {
+        "reviewID": self.reviewID,
+        "staffID": self.staffID,
+        "upvote": self.direction == self.UP,
+        "created": self.created.strftime("%d-%m-%Y %H:%M")
+    }
+
+  @classmethod
+  def directionOf(cls, reviewID, staffID):
+    """
+    Look up how a staff member voted on a review, using the primary key index.
+
+    Args:
+        reviewID (int): The ID of the review.
+        staffID (str): The ID of the staff member.
+
+    Returns:
+        int or None: UP, DOWN, or None if the staff member has not voted on the review.
+    """
+    return db.session.query(cls.direction).filter_by(reviewID=reviewID, staffID=staffID).scalar()
+
+  @classmethod
+  def _insertIgnoringConflict(cls, values):
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+      if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+      else:
+        from sqlalchemy.dialects.sqlite import insert
+      stmt = insert(cls).values(**values).on_conflict_do_nothing(index_elements=['reviewID', 'staffID'])
+      return db.session.execute(stmt).rowcount
+
+    # other backends: let the primary key reject the duplicate inside a savepoint
+    from sqlalchemy.exc import IntegrityError
+    try:
+      with db.session.begin_nested():
+        db.session.execute(db.insert(cls).values(**values))
+      return 1
+    except IntegrityError:
+      return 0
+
+  @classmethod
+  def cast(cls, reviewID, staffID, direction):
+    """
+    Record a vote with at most two statements: an insert that does nothing if the staff
+    member already voted on the review, then an update that only matches a vote the
+    other way. The caller is responsible for committing.
+
+    Args:
+        reviewID (int): The ID of the review.
+        staffID (str): The ID of the staff member.
+        direction (int): UP or DOWN.
+
+    Returns:
+        int or None: The direction of the vote this replaces: None for a new vote, the
+        opposite direction for a switched vote, or `direction` if nothing changed.
+    """
+    now = datetime.utcnow()
+    if cls._insertIgnoringConflict({'reviewID': reviewID, 'staffID': staffID, 'direction': direction, 'created': now}):
+      return None
+
+    switched = db.session.execute(
+        db.update(cls)
+        .where(cls.reviewID == reviewID, cls.staffID == staffID, cls.direction != direction)
+        .values(direction=direction, created=now)).rowcount
+    return -direction if switched else direction
+
+  @classmethod
+  def deleteForReview(cls, reviewID):
+    """
+    Delete every vote on a review. The caller is responsible for committing.
+
+    Args:
+        reviewID (int): The ID of the review.
+    """
+    db.session.execute(db.delete(cls).where(cls.reviewID == reviewID))
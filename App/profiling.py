@@ -0,0 +1,205 @@
+import cProfile
+import glob
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import g, request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+PROFILE_HEADER = 'X-Profile'
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def frame_name(code):
+  filename = code.co_filename
+  if filename.startswith(ROOT):
+    filename = os.path.relpath(filename, ROOT)
+  else:
+    filename = os.path.basename(filename)
+  return f'{filename}:{code.co_name}'
+
+
+class StackSampler:
+  """
+  Samples the stacks of registered threads every `interval` seconds from one background
+  thread and counts them in collapsed form ('outer;...;inner'), as flamegraph.pl takes.
+  The profiled code itself runs untouched, so the overhead is low enough for live traffic.
+  """
+
+  def __init__(self, interval=0.005):
+    self.interval = interval
+    self._lock = threading.Lock()
+    self._stacks = {}  # thread ID -> Counter of collapsed stacks
+    self._thread = None
+
+  def start(self, threadID):
+    with self._lock:
+      self._stacks[threadID] = Counter()
+      if self._thread is None or not self._thread.is_alive():
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+  def stop(self, threadID):
+    with self._lock:
+      return self._stacks.pop(threadID, Counter())
+
+  def _run(self):
+    while True:
+      time.sleep(self.interval)
+      with self._lock:
+        if not self._stacks:
+          self._thread = None
+          return
+        frames = sys._current_frames()
+        for threadID, stacks in self._stacks.items():
+          frame = frames.get(threadID)
+          names = []
+          while frame is not None:
+            names.append(frame_name(frame.f_code))
+            frame = frame.f_back
+          if names:
+            stacks[';'.join(reversed(names))] += 1
+
+
+stack_sampler = StackSampler()
+
+
+def profile_serializer(app):
+  return URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='request-profile')
+
+
+def create_profile_token(app, adminID):
+  """
+  Sign a token that has the requests carrying it in the X-Profile header profiled,
+  whatever the sampling settings. Valid for PROFILE_TOKEN_MAX_AGE seconds.
+  """
+  return profile_serializer(app).dumps({'admin': adminID})
+
+
+def _profile_token_valid(app, token):
+  from App.controllers import get_user_role
+  try:
+    data = profile_serializer(app).loads(token, max_age=app.config.get('PROFILE_TOKEN_MAX_AGE', 3600))
+  except BadSignature:
+    return False
+  return get_user_role(data.get('admin')) == 'admin'
+
+
+def profile_directory(app):
+  return app.config.get('PROFILE_DIR') or os.path.join(app.instance_path, 'profiles')
+
+
+def route_directory(directory, method, route):
+  # e.g. POST /reviews/<int:review_id> -> POST_reviews_int_review_id
+  return os.path.join(directory, re.sub(r'[^A-Za-z0-9]+', '_', f'{method} {route}').strip('_'))
+
+
+def write_profile(directory, method, route, elapsed, profile, keep):
+  """
+  Write one request's profile into the route's directory, deleting the oldest files there
+  beyond `keep`.
+
+  Args:
+      profile: A cProfile.Profile, or a Counter of collapsed stacks from the sampler.
+
+  Returns:
+      str: The file's path.
+  """
+  folder = route_directory(directory, method, route)
+  os.makedirs(folder, exist_ok=True)
+  name = f'{time.strftime("%Y%m%dT%H%M%S")}-{os.getpid()}-{random.randrange(16 ** 4):04x}-{round(elapsed * 1000)}ms'
+  if isinstance(profile, cProfile.Profile):
+    path = os.path.join(folder, name + '.prof')
+    profile.dump_stats(path)
+  else:
+    path = os.path.join(folder, name + '.folded')
+    with open(path, 'w') as file:
+      file.writelines(f'{stack} {count}\n' for stack, count in profile.items())
+  files = sorted(glob.glob(os.path.join(folder, '*.prof')) + glob.glob(os.path.join(folder, '*.folded')), key=os.path.getmtime)
+  for old in files[:-keep] if keep > 0 else []:
+    os.remove(old)
+  return path
+
+
+def summarize_profiles(directory, route=None):
+  """
+  Merge the profiles written under `directory`, or only those of routes whose folder name
+  contains `route`.
+
+  Returns:
+      tuple: (Counter of collapsed stacks from the sampler's files, pstats.Stats of the
+      cProfile files or None, number of files read).
+  """
+  pattern = os.path.join(directory, f'*{route}*' if route else '*')
+  stacks, stats, count = Counter(), None, 0
+  for path in sorted(glob.glob(os.path.join(pattern, '*.folded'))):
+    with open(path) as file:
+      for line in file:
+        stack, _, samples = line.rstrip('\n').rpartition(' ')
+        if stack:
+          stacks[stack] += int(samples)
+    count += 1
+  for path in sorted(glob.glob(os.path.join(pattern, '*.prof'))):
+    if stats is None:
+      stats = pstats.Stats(path)
+    else:
+      stats.add(path)
+    count += 1
+  return stacks, stats, count
+
+
+def setup_profiling(app):
+  """
+  Profile a sample of requests and write the profiles per route into PROFILE_DIR
+  (instance/profiles by default).
+
+  One in PROFILE_EVERY requests is profiled (0 turns sampling off), as is any request
+  carrying an admin's signed X-Profile header (see create_profile_token). A profile is
+  only kept when the request took at least PROFILE_SLOW_MS. PROFILER picks 'sampler',
+  the stack sampler, or 'cprofile', which is exact but slows the request down and
+  profiles one request at a time.
+  """
+  profileLock = threading.Lock()
+
+  @app.before_request
+  def start_profile():
+    every = app.config.get('PROFILE_EVERY', 0)
+    token = request.headers.get(PROFILE_HEADER)
+    if not (token and _profile_token_valid(app, token)) and not (every > 0 and random.randrange(every) == 0):
+      return
+    if app.config.get('PROFILER', 'sampler') == 'cprofile':
+      if not profileLock.acquire(blocking=False):
+        return
+      profile = cProfile.Profile()
+      try:
+        profile.enable()
+      except ValueError:  # another profiler is active in this process
+        profileLock.release()
+        return
+      g._profile = profile
+    else:
+      stack_sampler.start(threading.get_ident())
+      g._profile = None
+    g._profile_started = time.perf_counter()
+
+  @app.teardown_request
+  def finish_profile(error):
+    started = g.pop('_profile_started', None)
+    if started is None:
+      return
+    profile = g.pop('_profile')
+    if profile is None:
+      profile = stack_sampler.stop(threading.get_ident())
+    else:
+      profile.disable()
+      profileLock.release()
+    elapsed = time.perf_counter() - started
+    if elapsed * 1000 >= app.config.get('PROFILE_SLOW_MS', 0) and profile:
+      route = request.url_rule.rule if request.url_rule else 'unmatched'
+      write_profile(profile_directory(app), request.method, route, elapsed, profile, app.config.get('PROFILE_KEEP', 50))
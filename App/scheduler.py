@@ -0,0 +1,83 @@
+import threading
+
+from App.database import db
+from App.metrics import timed
+
+
+@timed('rank_recompute')
+def recompute_rankings_if_dirty():
+  """
+  Fold pending counter shards, then recompute stored ranks if any karma changed (or a
+  recompute was requested) since the last run.
+
+  Returns:
+      int or None: The number of Karma records whose rank changed, or None if nothing needed doing.
+  """
+  from App.models import Karma, fold_counter_shards
+
+  fold_counter_shards()
+  if not Karma.rankingsDirty():
+    db.session.rollback()
+    return None
+  return Karma.updateRank()
+
+
+class RankScheduler:
+  """
+  Background thread coalescing karma changes into one rank recompute every interval.
+
+  Votes only flag their student's karma as dirty; the worker checks for dirty rows
+  every RANK_RECOMPUTE_INTERVAL seconds and recomputes ranks once for the whole burst.
+  Several worker processes can each run one: the recompute itself is serialised on
+  the ranking state row.
+  """
+
+  def __init__(self):
+    self._thread = None
+    self._stop = threading.Event()
+    self._lock = threading.Lock()
+
+  @property
+  def running(self):
+    return self._thread is not None and self._thread.is_alive()
+
+  def start(self, app):
+    with self._lock:
+      if self.running:
+        return
+      self._stop.clear()
+      self._thread = threading.Thread(target=self.run, args=(app,), name='rank-scheduler', daemon=True)
+      self._thread.start()
+
+  def stop(self):
+    self._stop.set()
+    if self._thread is not None:
+      self._thread.join()
+      self._thread = None
+
+  def run(self, app):
+    interval = app.config.get('RANK_RECOMPUTE_INTERVAL', 5)
+    while not self._stop.wait(interval):
+      with app.app_context():
+        try:
+          recompute_rankings_if_dirty()
+        except Exception as e:
+          print(f'error recomputing rankings {e}')
+          db.session.rollback()
+
+
+rank_scheduler = RankScheduler()
+
+
+def setup_rank_scheduler(app):
+  """
+  Start the rank worker thread with the first request when RANK_WORKER is 'thread'.
+  Set RANK_WORKER to 'off' when ranks are recomputed by `flask ranks worker` instead.
+  """
+  if app.config.get('RANK_WORKER', 'thread') != 'thread':
+    return
+
+  @app.before_request
+  def start_rank_scheduler():
+    if not rank_scheduler.running:
+      rank_scheduler.start(app)
@@ -0,0 +1,320 @@
+import re
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import DDL, event
+
+from App.database import db
+from App.models import Student
+
+# Fuzzy student search by name, ranked by trigram similarity.
+#   postgres   pg_trgm word similarity over a GIN trigram index
+#   sqlite     an FTS5 table with the trigram tokenizer, kept in sync by triggers, when
+#              the SQLite build has FTS5 and is 3.34 or newer
+#   otherwise  an in-process trigram index kept in sync by mapper events
+# Typeahead is a prefix scan over the ID and lower(name) indexes: LIKE over text_pattern_ops
+# indexes on postgres, whose collation may not sort by code point, a range scan elsewhere.
+
+NAME = Student.firstname + ' ' + Student.lastname
+
+event.listen(Student.__table__, 'after_create', DDL(
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect='postgresql'))
+event.listen(Student.__table__, 'after_create', DDL(
+    "CREATE INDEX IF NOT EXISTS ix_student_name_trgm ON student "
+    "USING gin ((firstname || ' ' || lastname) gin_trgm_ops)").execute_if(dialect='postgresql'))
+POSTGRES_PREFIX_DDL = [
+    "CREATE INDEX IF NOT EXISTS ix_student_ID_pattern ON student (\"ID\" text_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_student_firstname_pattern ON student (lower(firstname) text_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_student_lastname_pattern ON student (lower(lastname) text_pattern_ops)",
+]
+for statement in POSTGRES_PREFIX_DDL:
+  event.listen(Student.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+
+SQLITE_SEARCH_DDL = [
+    "DROP TABLE IF EXISTS student_search",
+    "DROP TRIGGER IF EXISTS student_search_insert",
+    "DROP TRIGGER IF EXISTS student_search_update",
+    "DROP TRIGGER IF EXISTS student_search_delete",
+    # keyed by the student's ID: student has a string primary key, so its rowid is
+    # implicit and VACUUM may renumber it
+    "CREATE VIRTUAL TABLE student_search USING fts5(studentID UNINDEXED, name, tokenize='trigram')",
+    "INSERT INTO student_search(studentID, name) SELECT \"ID\", firstname || ' ' || lastname FROM student",
+    "CREATE TRIGGER student_search_insert AFTER INSERT ON student BEGIN "
+    "INSERT INTO student_search(studentID, name) VALUES (new.\"ID\", new.firstname || ' ' || new.lastname); END",
+    "CREATE TRIGGER student_search_update AFTER UPDATE OF \"ID\", firstname, lastname ON student BEGIN "
+    "UPDATE student_search SET studentID = new.\"ID\", name = new.firstname || ' ' || new.lastname "
+    "WHERE studentID = old.\"ID\"; END",
+    "CREATE TRIGGER student_search_delete AFTER DELETE ON student BEGIN "
+    "DELETE FROM student_search WHERE studentID = old.\"ID\"; END",
+]
+
+
+def fts5_trigram_supported(connection):
+  """
+  Check whether a SQLite connection can create FTS5 tables with the trigram tokenizer,
+  which needs SQLite 3.34 or newer built with FTS5.
+  """
+  if connection.dialect.name != 'sqlite' or connection.dialect.dbapi.sqlite_version_info < (3, 34, 0):
+    return False
+  return 'ENABLE_FTS5' in {option for option, in connection.exec_driver_sql('PRAGMA compile_options')}
+
+
+def _create_search_table(ddl, target, bind, **kw):
+  # looked up on every call, so tests can stand in for an older SQLite
+  return fts5_trigram_supported(bind)
+
+
+for statement in SQLITE_SEARCH_DDL:
+  event.listen(Student.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite', callable_=_create_search_table))
+event.listen(Student.__table__, 'after_drop', DDL(
+    "DROP TABLE IF EXISTS student_search").execute_if(dialect='sqlite'))
+
+
+def trigrams(text):
+  """
+  Split text into the trigrams pg_trgm uses: each lowercased word padded with two
+  spaces in front and one behind.
+  """
+  grams = set()
+  for word in re.findall(r'\w+', text.lower()):
+    padded = f'  {word} '
+    grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+  return grams
+
+
+def similarity(term, text):
+  """
+  Score how well a search term matches a name, like pg_trgm's word_similarity: the
+  share of the term's trigrams found in the name.
+
+  Returns:
+      float: From 0 (nothing in common) to 1 (the term appears in the name).
+  """
+  wanted = trigrams(term)
+  if not wanted:
+    return 0.0
+  return len(wanted & trigrams(text)) / len(wanted)
+
+
+class NgramIndex:
+  """
+  In-process trigram index of student names, for databases with no trigram index of their own.
+  """
+
+  def __init__(self):
+    self._lock = threading.RLock()
+    self.clear()
+
+  def clear(self):
+    with self._lock:
+      self._names = {}   # studentID -> name
+      self._grams = {}   # trigram -> set of studentIDs
+      self.loadedAt = None
+
+  def __len__(self):
+    return len(self._names)
+
+  def load(self, rows):
+    """
+    Replace the index contents.
+
+    Args:
+        rows (iterable): (studentID, name) pairs.
+    """
+    with self._lock:
+      self.clear()
+      for studentID, name in rows:
+        self.set(studentID, name)
+      self.loadedAt = time.monotonic()
+
+  def set(self, studentID, name):
+    with self._lock:
+      self.remove(studentID)
+      self._names[studentID] = name
+      for gram in trigrams(name):
+        self._grams.setdefault(gram, set()).add(studentID)
+
+  def remove(self, studentID):
+    with self._lock:
+      name = self._names.pop(studentID, None)
+      if name is None:
+        return
+      for gram in trigrams(name):
+        IDs = self._grams.get(gram)
+        IDs.discard(studentID)
+        if not IDs:
+          del self._grams[gram]
+
+  def search(self, term, limit, threshold=0.0):
+    """
+    Returns:
+        list: (studentID, similarity) pairs for the best `limit` matches, best first.
+    """
+    with self._lock:
+      candidates = set()
+      for gram in trigrams(term):
+        candidates |= self._grams.get(gram, set())
+      scored = [(studentID, similarity(term, self._names[studentID])) for studentID in candidates]
+    scored = [(studentID, score) for studentID, score in scored if score >= threshold]
+    scored.sort(key=lambda match: (-match[1], match[0]))
+    return scored[:limit]
+
+
+ngram_index = NgramIndex()
+
+
+@event.listens_for(Student, 'after_insert')
+@event.listens_for(Student, 'after_update')
+def _index_student(mapper, connection, student):
+  if ngram_index.loadedAt is not None:
+    ngram_index.set(student.ID, f'{student.firstname} {student.lastname}')
+
+
+@event.listens_for(Student, 'after_delete')
+def _unindex_student(mapper, connection, student):
+  if ngram_index.loadedAt is not None:
+    ngram_index.remove(student.ID)
+
+
+def _has_search_table():
+  return db.session.execute(db.text(
+      "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'student_search'")).scalar() is not None
+
+
+def search_backend():
+  """
+  Returns:
+      str: 'trigram', 'fts5' or 'memory', depending on the database (SEARCH_BACKEND forces one).
+  """
+  backend = current_app.config.get('SEARCH_BACKEND', 'auto')
+  if backend != 'auto':
+    return backend
+  dialect = db.session.get_bind().dialect.name
+  if dialect == 'postgresql':
+    return 'trigram'
+  if dialect == 'sqlite' and _has_search_table():
+    return 'fts5'
+  return 'memory'
+
+
+def get_ngram_index():
+  """
+  Get the in-process index, reloading it once it is older than SEARCH_INDEX_TTL seconds
+  so changes made by other processes show up.
+  """
+  ttl = current_app.config.get('SEARCH_INDEX_TTL', 60)
+  if ngram_index.loadedAt is None or time.monotonic() - ngram_index.loadedAt > ttl:
+    ngram_index.load(db.session.query(Student.ID, NAME))
+  return ngram_index
+
+
+def _startswith(column, value):
+  if db.session.get_bind().dialect.name == 'postgresql':
+    # under a non-C collation the range below is not a prefix match
+    return column.startswith(value, autoescape=True)
+  # every string starting with the value sorts between the value and the value + U+FFFF,
+  # so this is a range scan over the column's index
+  return db.and_(column >= value, column < value + '\uffff')
+
+
+def _fts5_candidates(term, limit):
+  # any shared trigram makes a candidate; bm25 puts those sharing the most first
+  words = re.findall(r'\w+', term.lower())
+  grams = {gram for word in words for gram in (word[i:i + 3] for i in range(len(word) - 2))}
+  if not grams:
+    # words under three letters have no trigrams to match, so match name prefixes instead
+    if not words:
+      return []
+    return db.session.query(Student.ID, NAME)\
+      .filter(db.or_(*(_startswith(db.func.lower(column), word)
+                       for word in words for column in (Student.firstname, Student.lastname))))\
+      .order_by(db.func.lower(Student.firstname), db.func.lower(Student.lastname), Student.ID)\
+      .limit(limit).all()
+  query = ' OR '.join('"' + gram.replace('"', '""') + '"' for gram in sorted(grams))
+  rows = db.session.execute(db.text(
+      "SELECT studentID, name FROM student_search "
+      "WHERE student_search MATCH :query ORDER BY bm25(student_search) LIMIT :limit"),
+      {'query': query, 'limit': limit}).all()
+  return rows
+
+
+def search_students(term, limit=20):
+  """
+  Find students whose name is similar to a search term, or whose ID is the term.
+
+  Args:
+      term (str): The search term.
+      limit (int, optional): The most matches to return. Defaults to 20.
+
+  Returns:
+      list: (studentID, similarity) pairs, best first. An exact ID match comes first with similarity 1.
+  """
+  threshold = current_app.config.get('SEARCH_MIN_SIMILARITY', 0.3)
+  backend = search_backend()
+  if backend == 'trigram':
+    # <% compares against pg_trgm.word_similarity_threshold, so it is set to this app's
+    # threshold for the transaction; the operator, unlike a comparison, can use the index
+    db.session.execute(db.select(db.func.set_config('pg_trgm.word_similarity_threshold', str(threshold), True)))
+    score = db.func.word_similarity(term, NAME)
+    matches = db.session.query(Student.ID, score)\
+      .filter(db.or_(db.literal(term).op('<%')(NAME), Student.ID == term))\
+      .order_by(db.desc(Student.ID == term), score.desc(), Student.ID)\
+      .limit(limit).all()
+    return [(studentID, 1.0 if studentID == term else float(value)) for studentID, value in matches]
+
+  if backend == 'fts5':
+    scored = [(studentID, similarity(term, name)) for studentID, name in _fts5_candidates(term, limit * 10)]
+    scored = [(studentID, value) for studentID, value in scored if value >= threshold]
+    scored.sort(key=lambda match: (-match[1], match[0]))
+  else:
+    scored = get_ngram_index().search(term, limit, threshold)
+
+  if db.session.query(Student.ID).filter(Student.ID == term).scalar() is not None:
+    scored = [(term, 1.0)] + [match for match in scored if match[0] != term]
+  return scored[:limit]
+
+
+def typeahead_students(prefix, limit=10):
+  """
+  Find students whose ID, first name or last name starts with a prefix, with range scans
+  over the ID and lower(name) indexes.
+
+  Args:
+      prefix (str): What has been typed so far.
+      limit (int, optional): The most matches to return. Defaults to 10.
+
+  Returns:
+      list: {"ID", "name"} dictionaries ordered by name.
+  """
+  lower = prefix.lower()
+  rows = db.session.query(Student.ID, Student.firstname, Student.lastname)\
+    .filter(db.or_(_startswith(Student.ID, prefix),
+                   _startswith(db.func.lower(Student.firstname), lower),
+                   _startswith(db.func.lower(Student.lastname), lower)))\
+    .order_by(db.func.lower(Student.firstname), db.func.lower(Student.lastname), Student.ID)\
+    .limit(limit).all()
+  return [{"ID": studentID, "name": f'{firstname} {lastname}'} for studentID, firstname, lastname in rows]
+
+
+def rebuild_search_index():
+  """
+  Create or refill the search index for the current database, e.g. for a database
+  created before search was indexed.
+
+  Returns:
+      str: The backend whose index was rebuilt.
+  """
+  dialect = db.session.get_bind().dialect.name
+  if dialect == 'postgresql':
+    db.session.execute(db.text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    db.session.execute(db.text(
+        "CREATE INDEX IF NOT EXISTS ix_student_name_trgm ON student USING gin ((firstname || ' ' || lastname) gin_trgm_ops)"))
+    for statement in POSTGRES_PREFIX_DDL:
+      db.session.execute(db.text(statement))
+  elif dialect == 'sqlite' and fts5_trigram_supported(db.session.connection()):
+    for statement in SQLITE_SEARCH_DDL:
+      db.session.execute(db.text(statement))
+  db.session.commit()
+  ngram_index.clear()
+  return search_backend()
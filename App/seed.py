@@ -0,0 +1,190 @@
+import random
+from datetime import datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+from App.database import db
+from App.models import Staff, Student, Review, Karma, ReviewVote, UserDirectory
+from App.models.user import password_hash_method
+
+# Synthetic data for load testing, generated deterministically from a seed. Activity is
+# skewed the way real data is: a few students collect most reviews, a few staff write
+# most of them, and most reviews get no votes while a few get many.
+
+FIRST_NAMES = ['Aaliyah', 'Aarav', 'Amara', 'Andre', 'Anika', 'Ben', 'Chen', 'Chloe', 'Daniel', 'Deja', 'Diego',
+               'Elena', 'Emeka', 'Fatima', 'Gabriel', 'Hana', 'Ibrahim', 'Isla', 'Jamal', 'Jia', 'Kai', 'Keisha',
+               'Liam', 'Lucia', 'Malik', 'Maya', 'Mohammed', 'Nadia', 'Noah', 'Olivia', 'Omar', 'Priya', 'Rafael',
+               'Ravi', 'Sakura', 'Samuel', 'Sofia', 'Tariq', 'Tomas', 'Valentina', 'Wei', 'Yara', 'Zain', 'Zoe']
+LAST_NAMES = ['Ali', 'Baptiste', 'Charles', 'Chen', 'Da Silva', 'Edwards', 'Fernandez', 'Garcia', 'Gupta', 'Hosein',
+              'Ibrahim', 'Jackson', 'James', 'Joseph', 'Khan', 'Kim', 'Lee', 'Lewis', 'Mohammed', 'Nguyen', 'Okafor',
+              'Patel', 'Persad', 'Ramdial', 'Ramsaran', 'Rodriguez', 'Singh', 'Smith', 'Thomas', 'Williams', 'Wong']
+COMMENTS = {True: ['Helpful in class', 'Consistently prepared', 'Excellent project work', 'Great team player',
+                   'Shows real improvement'],
+            False: ['Late to class', 'Disruptive in lab', 'Missed the deadline', 'Unprepared for the exam',
+                    'Did not contribute to the group']}
+STUDENT_TYPES = ['Full-Time', 'Full-Time', 'Full-Time', 'Part-Time', 'Evening']
+
+SEED_PASSWORD = 'password'
+MAX_VOTERS = 60
+
+
+def _skewed(rng, mean, cap):
+  # Pareto(1.5) has mean 3 and a long tail; scale it to the mean wanted
+  return min(int(rng.paretovariate(1.5) * mean / 3), cap)
+
+
+def _cumulative(weights):
+  total, cumulative = 0, []
+  for weight in weights:
+    total += weight
+    cumulative.append(total)
+  return cumulative
+
+
+def _name(rng):
+  return rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+
+
+def staff_rows(count, seed, password):
+  """
+  Generate the staff members, IDs T000000 upwards.
+
+  Returns:
+      list: Column values for the staff table.
+  """
+  rng = random.Random(f'{seed}-staff')
+  rows = []
+  for n in range(count):
+    firstname, lastname = _name(rng)
+    rows.append({'ID': f'T{n:06}', 'firstname': firstname, 'lastname': lastname, 'password': password,
+                 'email': f'{firstname.lower()}.{n}@staff.example.com', 'teachingExperience': rng.randint(1, 30)})
+  return rows
+
+
+def student_batches(students, staffIDs, reviewsPerStudent, voteRate, seed, password, batchSize, firstReview, firstKarma):
+  """
+  Generate students with their karma, reviews and votes a batch of students at a time.
+  The same arguments always produce the same data.
+
+  Args:
+      students (int): The number of students, IDs S0000000 upwards.
+      staffIDs (list): The staff members who write reviews and vote.
+      reviewsPerStudent (float): The mean number of reviews a student receives.
+      voteRate (float): The share of reviews that receive votes; those get a skewed number of voters.
+      seed: The random seed.
+      password (str): The password hash every student gets.
+      batchSize (int): Students per batch.
+      firstReview (int): The ID of the first review.
+      firstKarma (int): The ID of the first karma record.
+
+  Yields:
+      dict: 'karma', 'student', 'review' and 'review_vote' rows for one batch.
+  """
+  rng = random.Random(f'{seed}-students')
+  # a few staff write most of the reviews
+  reviewerWeights = _cumulative(rng.paretovariate(1.2) for _ in staffIDs)
+  now = datetime(2024, 1, 1)
+  reviewID, karmaID = firstReview, firstKarma
+
+  for start in range(0, students, batchSize):
+    batch = {'karma': [], 'student': [], 'review': [], 'review_vote': []}
+    for n in range(start, min(start + batchSize, students)):
+      studentID = f'S{n:07}'
+      score = 0
+      for _ in range(_skewed(rng, reviewsPerStudent, int(reviewsPerStudent * 50) + 1)):
+        isPositive = rng.random() < 0.7
+        reviewer = rng.choices(staffIDs, cum_weights=reviewerWeights)[0]
+        created = now - timedelta(seconds=rng.randrange(365 * 24 * 3600))
+        upvotes = downvotes = 0
+        if rng.random() < voteRate:
+          voters = rng.sample(staffIDs, max(1, _skewed(rng, 6, min(MAX_VOTERS, len(staffIDs)))))
+          for voter in voters:
+            # readers mostly agree with positive reviews and are split on negative ones
+            up = rng.random() < (0.8 if isPositive else 0.5)
+            upvotes += up
+            downvotes += not up
+            batch['review_vote'].append({'reviewID': reviewID, 'staffID': voter, 'direction': ReviewVote.UP if up else ReviewVote.DOWN,
+                                         'created': created + timedelta(minutes=rng.randrange(1, 10000))})
+        batch['review'].append({'ID': reviewID, 'reviewerID': reviewer, 'studentID': studentID, 'isPositive': isPositive,
+                                'comment': rng.choice(COMMENTS[isPositive]), 'created': created, 'upvotes': upvotes,
+                                'downvotes': downvotes, 'version': 1})
+        score += (upvotes - downvotes) * (1 if isPositive else -1)
+        reviewID += 1
+
+      batch['karma'].append({'karmaID': karmaID, 'score': float(score), 'rank': -99, 'rankDirty': True, 'rankedVersion': 0})
+      firstname, lastname = _name(rng)
+      batch['student'].append({'ID': studentID, 'firstname': firstname, 'lastname': lastname, 'password': password,
+                               'contact': f'{rng.randint(200, 999)}-{rng.randint(1000, 9999)}',
+                               'studentType': rng.choice(STUDENT_TYPES), 'yearOfStudy': rng.randint(1, 5), 'karmaID': karmaID})
+      karmaID += 1
+    yield batch
+
+
+def _reset_sequence(model, column):
+  # explicit IDs leave postgres sequences behind the data
+  if db.session.get_bind().dialect.name == 'postgresql':
+    table = model.__tablename__
+    db.session.execute(db.text(
+        f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), (SELECT MAX(\"{column}\") FROM {table}))"))
+
+
+def seed_database(students=1000, staff=50, reviewsPerStudent=5, voteRate=0.2, seed=0, batchSize=2000, progress=None):
+  """
+  Bulk-insert synthetic staff, students, reviews, votes and karma, then rank the students.
+  Every synthetic user's password is SEED_PASSWORD, hashed once with the configured method.
+
+  Args:
+      students (int, optional): The number of students. Defaults to 1000.
+      staff (int, optional): The number of staff. Defaults to 50.
+      reviewsPerStudent (float, optional): The mean number of reviews per student. Defaults to 5.
+      voteRate (float, optional): The share of reviews that receive votes. Defaults to 0.2.
+      seed (optional): The random seed. Defaults to 0.
+      batchSize (int, optional): Students inserted per transaction. Defaults to 2000.
+      progress (callable, optional): Called with the running totals after each batch.
+
+  Returns:
+      dict: The number of rows inserted into each table.
+
+  Raises:
+      ValueError: If any of the staff or student IDs to be generated is already taken, e.g. by an earlier run.
+  """
+  from App.controllers.karma import update_student_karma_rankings
+  from App.leaderboard import rebuild_leaderboard
+
+  # the IDs are deterministic, so a second run would collide with the first part-way through
+  taken = db.session.query(UserDirectory.ID).filter(db.or_(
+      UserDirectory.ID.between('T000000', f'T{staff - 1:06}') if staff else db.false(),
+      UserDirectory.ID.between('S0000000', f'S{students - 1:07}') if students else db.false())).first()
+  if taken:
+    raise ValueError(f'{taken.ID} already exists; the database has been seeded before')
+
+  password = generate_password_hash(SEED_PASSWORD, method=password_hash_method())
+  totals = {'staff': 0, 'student': 0, 'review': 0, 'review_vote': 0, 'karma': 0}
+
+  staff = staff_rows(staff, seed, password)
+  db.session.execute(Staff.__table__.insert(), staff)
+  db.session.execute(UserDirectory.__table__.insert(), [{'ID': row['ID'], 'role': 'staff'} for row in staff])
+  db.session.commit()
+  totals['staff'] = len(staff)
+
+  firstReview = (db.session.query(db.func.max(Review.ID)).scalar() or 0) + 1
+  firstKarma = (db.session.query(db.func.max(Karma.karmaID)).scalar() or 0) + 1
+  tables = {'karma': Karma, 'student': Student, 'review': Review, 'review_vote': ReviewVote}
+  for batch in student_batches(students, [row['ID'] for row in staff], reviewsPerStudent, voteRate, seed,
+                               password, batchSize, firstReview, firstKarma):
+    # parents before children, so the foreign keys hold at every step
+    for name in ['karma', 'student', 'review', 'review_vote']:
+      if batch[name]:
+        db.session.execute(tables[name].__table__.insert(), batch[name])
+        totals[name] += len(batch[name])
+    db.session.execute(UserDirectory.__table__.insert(), [{'ID': row['ID'], 'role': 'student'} for row in batch['student']])
+    db.session.commit()
+    if progress:
+      progress(totals)
+
+  _reset_sequence(Review, 'ID')
+  _reset_sequence(Karma, 'karmaID')
+  db.session.commit()
+  update_student_karma_rankings()
+  rebuild_leaderboard()
+  return totals
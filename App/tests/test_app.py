@@ -1,8 +1,10 @@
-import os, tempfile, pytest, logging, unittest
-from werkzeug.security import check_password_hash, generate_password_hash
+import io, os, json, time, tempfile, pytest, logging, unittest, threading
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
 import random
+from flask import current_app, g
+from flask_jwt_extended import create_access_token
 from App.main import create_app
-from App.database import db, create_db
+from App.database import db, create_db, RequestQueries
 from App.models import User, Student, Staff, Admin
 from App.controllers import (
     create_user,
@@ -23,8 +25,42 @@ from App.controllers import (
     upvoteReview, 
     downvoteReview,
     get_student_rankings, 
-    search_students_searchTerm
+    search_students_searchTerm,
+    calculate_student_karma,
+    update_student_karma_rankings,
+    get_ranking_state,
+    get_reviews_page,
+    get_users_page,
+    migrate_legacy_votes,
+    handle_vote,
+    get_user,
+    get_user_role,
+    sync_user_directory,
+    login,
+    authenticate,
+    import_users,
+    read_rows,
+    repair_student_karma,
+    fold_counters,
+    handle_votes
 )
+from App.models import Karma, Review, ReviewVote, ReviewCounterShard, KarmaShard, UserDirectory, profile_fanout
+from App.leaderboard import Leaderboard, rebuild_leaderboard, get_leaderboard
+from App.scheduler import recompute_rankings_if_dirty
+from App.leaderboard import expire_leaderboard
+from App.controllers.pagination import encode_cursor
+from App.cache import TTLCache, VersionedCache, DependencyCache, identity_cache, student_documents
+from App.profiling import stack_sampler, summarize_profiles
+from App.metrics import Registry, Counter, Gauge, Histogram, mark_process_dead, _FileValues
+from benchmarks.harness import summarize, compare
+from benchmarks.postman import load_collection, is_error
+from App.seed import seed_database, student_batches, SEED_PASSWORD
+import App.search as search_module
+from App.search import NgramIndex, search_students, typeahead_students, search_backend
+from contextlib import contextmanager
+from unittest import mock
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy import event
 
 
 LOGGER = logging.getLogger(__name__)
@@ -80,6 +116,157 @@ class UserUnitTests(unittest.TestCase):
         user = Admin("bob", "boblast",  password)
         assert user.check_password(password)
 
+class LeaderboardUnitTests(unittest.TestCase):
+
+    def test_matches_dense_ranking(self):
+        rng = random.Random(7)
+        board = Leaderboard()
+        scores = {}
+        for _ in range(2000):
+            studentID = str(rng.randint(1, 150))
+            if rng.random() < 0.1:
+                board.remove(studentID)
+                scores.pop(studentID, None)
+            else:
+                delta = rng.choice([-2, -1, 1, 2])
+                board.adjust(studentID, delta)
+                scores[studentID] = scores.get(studentID, 0.0) + delta
+
+        distinct = sorted(set(scores.values()), reverse=True)
+        expected = sorted(((ID, score, distinct.index(score) + 1) for ID, score in scores.items()), key=lambda row: (-row[1], row[0]))
+        assert board.top() == expected
+        assert board.top(5) == expected[:5]
+        assert board.ranked(2, 4) == [row for row in expected if 2 <= row[2] <= 4]
+        for studentID, score, rank in expected:
+            assert board.rank_of(studentID) == rank
+        assert board.rank_of("missing") is None
+
+class TTLCacheUnitTests(unittest.TestCase):
+
+    def test_evicts_least_recently_used_and_expired(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.get("a") == 1
+        cache.set("c", 3)
+        assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3
+
+        cache.configure(2, 0.01)
+        cache.set("a", 1)
+        time.sleep(0.02)
+        assert cache.get("a") is None and len(cache) == 0
+
+class VersionedCacheUnitTests(unittest.TestCase):
+
+    def test_builds_once_per_version(self):
+        cache = VersionedCache(maxsize=2)
+        builds = []
+        def build(value):
+            def run():
+                builds.append(value)
+                time.sleep(0.05)
+                return value
+            return run
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get("top", 1, build("v1")))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == ["v1"] * 8 and builds == ["v1"]
+        assert cache.get("top", 2, build("v2")) == "v2" and cache.get("top", 2, build("again")) == "v2"
+        assert builds == ["v1", "v2"] and cache.stats()["hits"] == 1
+
+class DependencyCacheUnitTests(unittest.TestCase):
+
+    def test_invalidates_by_key_and_dependency(self):
+        cache = DependencyCache(maxsize=2, ttl=60)
+        cache.set("a", 1, [("staff", "x")])
+        cache.set("b", 2, [("staff", "x"), ("staff", "y")])
+        cache.invalidate(dependencies=[("staff", "y")])
+        assert cache.get("a") == 1 and cache.get("b") is None
+        cache.invalidate(keys=["a"])
+        assert len(cache) == 0 and cache.stats()["invalidations"] == 2
+
+        # a value built while its data changed is returned but not kept
+        def build():
+            cache.invalidate(keys=["c"])
+            return 3, ()
+        assert cache.fetch("c", build) == 3 and cache.get("c") is None
+        assert cache.fetch("c", lambda: (4, ())) == 4 and cache.fetch("c", lambda: (5, ())) == 4
+        assert cache.fetch("d", lambda: (None, ())) is None and "d" not in cache._entries
+
+class BenchmarkHarnessUnitTests(unittest.TestCase):
+
+    def test_percentiles_and_regressions(self):
+        summary = summarize([i / 1000 for i in range(100, 0, -1)], [2, 3], 1, 2.0)
+        assert (summary["p50_ms"], summary["p95_ms"], summary["p99_ms"]) == (50.0, 95.0, 99.0)
+        assert summary["throughput"] == 50.0 and summary["statements"] == 2.5
+
+        baseline = {"1000": {"search": {"p95_ms": 10.0, "throughput": 100.0, "statements": 3.0, "errors": 0}}}
+        assert compare({"1000": {"search": {"p95_ms": 11.0, "throughput": 90.0, "statements": 3.5, "errors": 0}}}, baseline) == []
+        regressions = compare({"1000": {"search": {"p95_ms": 15.0, "throughput": 50.0, "statements": 5.0, "errors": 2}}}, baseline)
+        assert len(regressions) == 4
+
+    def test_postman_collection_replay_steps(self):
+        steps = {step.name: step for step in load_collection("KRSC-SCT.postman_collection.json")[0]}
+        variables = {"host": "http://localhost:8080"}
+
+        login = steps["Staff 1 API Login"]
+        assert login.render(variables)[:2] == ("POST", "/api/login")
+        login.capture(b'{"access_token": "abc"}', variables)
+        assert variables["staff1_token"] == "abc"
+
+        method, path, headers, _ = steps["Get Student By ID"].render(variables)
+        assert (method, path, headers["Authorization"]) == ("GET", "/students/83", "Bearer abc")
+        assert 600 <= int(json.loads(steps["Admin Create Student"].render(variables)[3])["studentID"]) <= 9000
+        assert is_error(steps["Staff Login Fail"], 200) and not is_error(steps["Staff Login Fail"], 401)
+
+class MetricsUnitTests(unittest.TestCase):
+
+    def test_values_add_up_across_processes(self):
+        directory = tempfile.mkdtemp()
+        registry = Registry()
+        jobs = Counter('jobs_total', 'Jobs.', ('queue',), registry=registry)
+        running = Gauge('jobs_running', 'Jobs running.', registry=registry)
+        latency = Histogram('job_seconds', 'Job latency.', buckets=(0.1, 1.0), registry=registry)
+        registry.configure(directory)
+        jobs.inc(queue='a')
+        running.inc()
+        latency.observe(0.05)
+        latency.observe(5)
+
+        # the files of another worker
+        other = _FileValues(os.path.join(directory, 'counter_999999.db'))
+        other.add(jobs._key('', {'queue': 'a'}), 2)
+        other.close()
+        other = _FileValues(os.path.join(directory, 'gauge_999999.db'))
+        other.add(running._key('', {}), 3)
+        other.close()
+
+        text = registry.render()
+        assert 'jobs_total{queue="a"} 3' in text and 'jobs_running 4' in text
+        assert 'job_seconds_bucket{le="0.1"} 1' in text and 'job_seconds_bucket{le="1.0"} 1' in text
+        assert 'job_seconds_bucket{le="+Inf"} 2' in text and 'job_seconds_count 2' in text
+        mark_process_dead(999999, directory)
+        text = registry.render()
+        assert 'jobs_running 1' in text and 'jobs_total{queue="a"} 3' in text
+
+class NgramIndexUnitTests(unittest.TestCase):
+
+    def test_ranks_by_similarity(self):
+        index = NgramIndex()
+        index.load([("1", "Jonathan Smith"), ("2", "Joan Smythe"), ("3", "Mary Jones"), ("4", "Peter Parker")])
+        matches = index.search("jonathon", 10, 0.3)
+        assert matches[0][0] == "1"
+        assert "4" not in [studentID for studentID, _ in matches]
+
+        index.set("4", "Jonathon Parker")
+        assert index.search("jonathon", 1)[0] == ("4", 1.0)
+        index.remove("4")
+        assert index.search("parker", 10, 0.3) == []
+
 '''
     Integration Tests
 '''
@@ -88,12 +275,25 @@ class UserUnitTests(unittest.TestCase):
 # scope="class" would execute the fixture once and resued for all methods in the class
 @pytest.fixture(autouse=True, scope="module")
 def empty_db():
-    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///test.db'})
+    # a cheap hash keeps the many users the tests create from dominating their run time
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///test.db', 'RANK_WORKER': 'off', 'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000'})
     create_db()
     yield app.test_client()
     db.drop_all()
 
 
+@contextmanager
+def count_queries():
+    statements = []
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
 class UsersIntegrationTests(unittest.TestCase):
     def test_authenticate_admin(self): 
         newAdmin = create_user("bob", "boblast", "bobpass")
@@ -248,3 +448,697 @@ class UsersIntegrationTests(unittest.TestCase):
 
     def test_get_karma_score_by_id(self): 
         assert get_karma_by_id(1).karmaID == 1
+
+    def test_karma_incremental(self):
+        admin = create_user("Gold", "goldlast", "goldpass")
+        author = create_staff(admin, "Au", "Thor", "password", "8001", "author@example.com", 3)
+        voter_1 = create_staff(admin, "Vo", "Ter1", "password", "8002", "voter1@example.com", 3)
+        voter_2 = create_staff(admin, "Vo", "Ter2", "password", "8003", "voter2@example.com", 3)
+        student = create_student(admin, "8004", "Kay", "Ma", "pass01234", "kay@school.com", "Full-Time", 1)
+        review = create_review(author.ID, student.ID, True, "Helps classmates")
+        upvoteReview(review.ID, voter_1)
+        upvoteReview(review.ID, voter_2)
+        assert get_karma_by_id(student.karmaID).score == 2
+        downvoteReview(review.ID, voter_2)
+        assert get_karma_by_id(student.karmaID).score == 0
+        edit_review(review, author, False, "Distracts classmates")
+        assert get_karma_by_id(student.karmaID).score == 0
+        upvoteReview(review.ID, voter_2)
+        assert get_karma_by_id(student.karmaID).score == -2
+        karma_id = student.karmaID
+        calculate_student_karma(student)
+        assert get_karma_by_id(karma_id).score == -2
+        delete_review(review, author)
+        assert get_karma_by_id(karma_id).score == 0
+
+    def test_update_rankings_dense(self):
+        update_student_karma_rankings()
+        assert update_student_karma_rankings() == 0
+        ranked = db.session.query(Karma).join(Student, Student.karmaID == Karma.karmaID).all()
+        scores = sorted({karma.score for karma in ranked}, reverse=True)
+        for karma in ranked:
+            assert karma.rank == scores.index(karma.score) + 1
+
+    def test_rankings_follow_votes(self):
+        rebuild_leaderboard()
+        admin = create_user("Silver", "silverlast", "silverpass")
+        author = create_staff(admin, "Lead", "Er", "password", "8101", "leader@example.com", 3)
+        student = create_student(admin, "8103", "Top", "Most", "pass01234", "top@school.com", "Full-Time", 1)
+        review = create_review(author.ID, student.ID, True, "Top of the class")
+        for score in range(1, 40):
+            upvoteReview(review.ID, create_staff(admin, "Up", "Voter", "password", str(8200 + score), "up@example.com", 1))
+        update_student_karma_rankings()
+        rankings = get_student_rankings(author, 1)
+        assert rankings[0]["studentID"] == "8103" and rankings[0]["karmaRank"] == 1
+        assert get_student("8103").to_json()["karmaRank"] == 1
+
+    def test_bulk_votes(self):
+        admin = create_user("Bronze", "bronzelast", "bronzepass")
+        author = create_staff(admin, "Bulk", "Author", "password", "8301", "bulk@example.com", 3)
+        voter = create_staff(admin, "Bulk", "Voter", "password", "8302", "bulkvoter@example.com", 3)
+        student = create_student(admin, "8303", "Bat", "Ch", "pass01234", "batch@school.com", "Full-Time", 1)
+        good = create_review(author.ID, student.ID, True, "Good")
+        bad = create_review(author.ID, student.ID, False, "Bad")
+        votes = [{"reviewID": good.ID, "upvote": True}, {"reviewID": bad.ID, "upvote": False},
+                 {"reviewID": good.ID, "upvote": True}, {"reviewID": 999999, "upvote": True}, {"reviewID": good.ID}]
+        headers = {'Authorization': f'Bearer {create_access_token(identity=voter.ID)}'}
+        response = current_app.test_client().post('/reviews/votes', json=votes, headers=headers)
+        assert response.status_code == 200
+        results = response.get_json()
+        assert [result.get("error") is None for result in results] == [True, True, True, False, False]
+        assert results[0]["upvotes"] == 1 and results[1]["downvotes"] == 1
+        assert results[2]["message"] == "Review Already Upvoted"
+        assert get_karma_by_id(get_student("8303").karmaID).score == 2
+
+        # a retried batch reports what the successful attempt did, not what a failed one saw
+        nextID = db.session.query(db.func.max(Review.ID)).scalar() + 1
+        castVote = Review.castVote
+        def race(review, staff, upvote):
+            if not race.done:
+                race.done = True
+                with current_app.app_context():
+                    assert create_review(author.ID, student.ID, True, "Created meanwhile").ID == nextID
+                raise StaleDataError("lost a race")
+            return castVote(review, staff, upvote)
+        race.done = False
+        with mock.patch.object(Review, 'castVote', race):
+            results = handle_votes(voter, [{"reviewID": nextID, "upvote": True}, {"reviewID": bad.ID, "upvote": True}])
+        assert race.done and [result.get("error") for result in results] == [None, None]
+        assert results[0]["message"] == "Review Upvoted Successfully" and results[0]["upvotes"] == 1
+
+    def test_rank_worker_coalesces_votes(self):
+        admin = create_user("Iron", "ironlast", "ironpass")
+        author = create_staff(admin, "Deb", "Ounce", "password", "8401", "debounce@example.com", 3)
+        student = create_student(admin, "8402", "Co", "Alesce", "pass01234", "coalesce@school.com", "Full-Time", 1)
+        review = create_review(author.ID, student.ID, False, "Late again")
+        update_student_karma_rankings()
+        version = get_ranking_state().version
+        for voter in range(8403, 8408):
+            upvoteReview(review.ID, create_staff(admin, "Bur", "St", "password", str(voter), "burst@example.com", 1))
+        assert get_karma_by_id(get_student("8402").karmaID).rankDirty
+        assert recompute_rankings_if_dirty()
+        assert recompute_rankings_if_dirty() is None
+        assert get_leaderboard().version == version + 1
+        assert get_leaderboard().score_of("8402") == -5
+
+    def test_rank_pass_writes_only_moved_rows(self):
+        admin = create_user("Drift", "driftlast", "driftpass")
+        staff = create_staff(admin, "Dri", "Ft", "password", "9895", "drift@example.com", 3)
+        student = create_student(admin, "9894", "Score", "Drift", "pass", "000-0000", "Full-Time", 1)
+        upvoteReview(create_review(staff.ID, student.ID, True, "Steady").ID, staff)
+        karma = get_karma_by_id(get_student("9894").karmaID)
+        bottom = db.session.query(db.func.min(Karma.score)).scalar()
+        karma.score, karma.rankDirty = bottom - 100, True
+        db.session.commit()
+        update_student_karma_rankings()
+        rank = karma.rank
+
+        # the last student loses another point: only the score drift is recorded, no rank is rewritten
+        others = db.session.query(db.func.max(Karma.rankedVersion)).filter(Karma.karmaID != karma.karmaID).scalar()
+        karma.score, karma.rankDirty = bottom - 101, True
+        db.session.commit()
+        assert update_student_karma_rankings() == 0
+        db.session.refresh(karma)
+        assert karma.rank == rank and karma.rankedScore == bottom - 101 and not karma.rankDirty
+        assert db.session.query(db.func.max(Karma.rankedVersion)).filter(Karma.karmaID != karma.karmaID).scalar() == others
+        assert get_leaderboard().score_of("9894") == bottom - 101
+        assert update_student_karma_rankings() == 0 and not Karma.rankingsDirty()
+
+    def test_keyset_pagination(self):
+        admin = create_user("Page", "pagelast", "pagepass")
+        staff = create_staff(admin, "Pa", "Ger", "password", "8501", "pager@example.com", 3)
+        headers = {'Authorization': f'Bearer {create_access_token(identity=staff.ID)}'}
+        client = current_app.test_client()
+        for url, key, expected in [('/reviews', 'reviewID', get_reviews_page(10**6).items),
+                                   ('/api/users', None, get_users_page(10**6).items)]:
+            seen, cursor = [], None
+            while True:
+                response = client.get(url, query_string={'limit': 7, 'next': cursor} if cursor else {'limit': 7}, headers=headers)
+                assert response.status_code == 200 and len(response.get_json()) <= 7
+                seen += response.get_json()
+                cursor = response.headers.get('X-Next-Cursor')
+                if not cursor:
+                    break
+            assert len(seen) == len(expected)
+            if key:
+                assert [item[key] for item in seen] == [review.ID for review in expected]
+        for cursor in ['garbage', encode_cursor([[1]]), encode_cursor([{'x': 1}]), encode_cursor([{'dt': 1}, 1]),
+                       encode_cursor([True, 1]), encode_cursor([None, 1]), encode_cursor([1])]:
+            assert client.get('/reviews', query_string={'next': cursor}, headers=headers).status_code == 400
+
+    def test_streamed_collections(self):
+        admin = create_user("Stream", "streamlast", "streampass")
+        staff = create_staff(admin, "Str", "Eam", "password", "8601", "stream@example.com", 3)
+        headers = {'Authorization': f'Bearer {create_access_token(identity=staff.ID)}'}
+        client = current_app.test_client()
+        expected = [review.ID for review in get_reviews_page(10**6).items]
+
+        response = client.get('/reviews', query_string={'stream': 'true'}, headers=headers)
+        assert response.status_code == 200 and response.is_streamed
+        assert [item['reviewID'] for item in response.get_json()] == expected
+
+        response = client.get('/api/users', headers={**headers, 'Accept': 'application/x-ndjson'})
+        assert response.mimetype == 'application/x-ndjson'
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert len(lines) == len(get_users_page(10**6).items)
+
+    def test_listing_query_count_is_constant(self):
+        admin = create_user("Count", "countlast", "countpass")
+        staff = [create_staff(admin, "Cou", "Nter", "password", f"870{i}", f"count{i}@example.com", 3) for i in range(2)]
+        for i in range(12):
+            create_student(admin, f"871{i:02}", "Many", "Rows", "pass", "000-0000", "Full-Time", 1)
+            create_review(staff[i % 2].ID, f"871{i:02}", True, "listed")
+            upvoteReview(get_reviews_for_student(f"871{i:02}")[0].ID, staff[(i + 1) % 2])
+        headers = {'Authorization': f'Bearer {create_access_token(identity=staff[0].ID)}'}
+        client = current_app.test_client()
+
+        # every student on the page has reviews and karma, so each relationship is loaded
+        students = {'next': encode_cursor(['8709'])}
+        for url, args, limits in [('/students', students, [1, 2, 12]), ('/reviews', {}, [1, 2, 12]), ('/staff/8700/reviews', {}, [1, 2, 6])]:
+            counts = []
+            for limit in limits:
+                expire_leaderboard()
+                client.get(url, query_string={**args, 'limit': limit}, headers=headers)
+                expire_leaderboard()
+                with count_queries() as statements:
+                    response = client.get(url, query_string={**args, 'limit': limit}, headers=headers)
+                assert response.status_code == 200 and len(response.get_json()) == limit
+                counts.append(len(statements))
+            assert len(set(counts)) == 1, (url, counts)
+
+    def test_loading_profile_fanout(self):
+        admin = create_user("Fan", "fanlast", "fanpass")
+        staff = create_staff(admin, "Fan", "Out", "password", "8801", "fan@example.com", 3)
+        for i in range(3):
+            create_student(admin, f"881{i}", "Fan", "Out", "pass", "000-0000", "Full-Time", 1)
+            review = create_review(staff.ID, f"881{i}", True, "fanned")
+            upvoteReview(review.ID, staff)
+
+        # a summary load fetches one row per record, whatever the record's relationships hold
+        for model in [Staff, Student, Review]:
+            report = profile_fanout(model, 'summary')
+            assert report['statements'] == 1 and report['rows'] == report['records']
+        report = profile_fanout(Review, 'vote-check')
+        assert report['statements'] == 1 and report['rows'] == report['records']
+        with pytest.raises(ValueError):
+            profile_fanout(Staff, 'vote-check')
+
+    def test_review_vote_table(self):
+        admin = create_user("Vote", "votelast", "votepass")
+        staff = create_staff(admin, "Vo", "Ter", "password", "8901", "voter@example.com", 3)
+        create_student(admin, "8911", "Vote", "Table", "pass", "000-0000", "Full-Time", 1)
+        review = create_review(staff.ID, "8911", True, "voted on")
+
+        upvoteReview(review.ID, staff)
+        upvoteReview(review.ID, staff)
+        assert (review.upvotes, review.downvotes) == (1, 0)
+        assert review.voteOf(staff) is True
+        downvoteReview(review.ID, staff)
+        assert (review.upvotes, review.downvotes) == (0, 1)
+        assert review.voteOf(staff) is False and review.staffDownvoters == [staff]
+        assert ReviewVote.query.filter_by(reviewID=review.ID).count() == 1
+
+        # duplicate rows in the old association tables collapse into one vote each
+        legacy = db.Table('review_staff_upvoters', db.MetaData(),
+                          db.Column('reviewID', db.Integer), db.Column('staffID', db.String(10)))
+        legacy.create(db.engine)
+        other = create_staff(admin, "Old", "Voter", "password", "8902", "oldvoter@example.com", 3)
+        db.session.execute(legacy.insert(), [{'reviewID': review.ID, 'staffID': other.ID}] * 3)
+        db.session.commit()
+        # a vote still held in a counter shard is counted once, by the recount
+        current_app.config['COUNTER_SHARDS'] = 2
+        try:
+            upvoteReview(review.ID, create_staff(admin, "Sha", "Rded", "password", "8903", "shardvoter@example.com", 3))
+            assert migrate_legacy_votes(drop=True) == 1
+            assert fold_counters() == 0
+        finally:
+            current_app.config['COUNTER_SHARDS'] = 0
+        db.session.refresh(review)
+        assert (review.upvotes, review.downvotes) == (2, 1)
+        assert get_student("8911").karma.score == 1
+        assert not db.inspect(db.engine).has_table('review_staff_upvoters')
+
+        delete_review(review, staff)
+        assert ReviewVote.query.filter_by(reviewID=review.ID).count() == 0
+
+    def test_concurrent_votes_lose_no_updates(self):
+        admin = create_user("Race", "racelast", "racepass")
+        voters = [create_staff(admin, "Ra", "Cer", "password", f"90{i:02}", f"racer{i}@example.com", 3).ID for i in range(12)]
+        create_student(admin, "9100", "Hot", "Review", "pass", "000-0000", "Full-Time", 1)
+        reviewIDs = [create_review(voters[0], "9100", True, f"popular {i}").ID for i in range(3)]
+        app = current_app._get_current_object()
+        failures = []
+
+        # every third voter upvotes then switches to a downvote, all at once on the same reviews
+        def vote(staffID, switch):
+            with app.app_context():
+                staff = get_staff(staffID)
+                for upvote in ([True, False] if switch else [True]):
+                    for reviewID in reviewIDs:
+                        if handle_vote(get_review(reviewID, 'vote-check'), staff, upvote) is None:
+                            failures.append((staffID, reviewID))
+
+        threads = [threading.Thread(target=vote, args=(staffID, i % 3 == 0)) for i, staffID in enumerate(voters)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert failures == []
+        db.session.expire_all()
+        for reviewID in reviewIDs:
+            review = get_review(reviewID)
+            assert (review.upvotes, review.downvotes) == (8, 4)
+        assert get_student("9100").karma.score == 3 * (8 - 4)
+
+    def test_sharded_counters(self):
+        admin = create_user("Shard", "shardlast", "shardpass")
+        voters = [create_staff(admin, "Sha", "Rd", "password", f"920{i}", f"shard{i}@example.com", 3) for i in range(6)]
+        create_student(admin, "9210", "Shar", "Ded", "pass", "000-0000", "Full-Time", 1)
+        review = create_review(voters[0].ID, "9210", True, "hot review")
+        current_app.config['COUNTER_SHARDS'] = 4
+        try:
+            for staff in voters:
+                upvoteReview(review.ID, staff)
+            downvoteReview(review.ID, voters[0])
+
+            # the review and karma rows are untouched until the shards are folded
+            review = get_review(review.ID)
+            assert (review.upvotes, review.downvotes) == (0, 0)
+            assert review.voteCounts() == (5, 1)
+            assert review.to_json()['upvotes'] == 5
+            student = get_student("9210", 'detail')
+            assert student.karma.score == 0 and student.to_json()['karmaScore'] == 4
+            assert 0 < ReviewCounterShard.query.filter_by(reviewID=review.ID).count() <= 4
+
+            recompute_rankings_if_dirty()
+            review = get_review(review.ID)
+            assert (review.upvotes, review.downvotes) == (5, 1)
+            assert get_student("9210").karma.score == 4
+            assert ReviewCounterShard.query.count() == 0 and KarmaShard.query.count() == 0
+        finally:
+            current_app.config['COUNTER_SHARDS'] = 0
+
+    def test_sharded_votes_then_edit(self):
+        admin = create_user("Fold", "foldlast", "foldpass")
+        voters = [create_staff(admin, "Fo", "Ld", "password", f"922{i}", f"fold{i}@example.com", 3) for i in range(4)]
+        create_student(admin, "9230", "Fol", "Ded", "pass", "000-0000", "Full-Time", 1)
+        reviewID = create_review(voters[0].ID, "9230", True, "flipped later").ID
+        current_app.config['COUNTER_SHARDS'] = 4
+        try:
+            upvoteReview(reviewID, voters[1])
+            upvoteReview(reviewID, voters[2])
+            review = get_review(reviewID)
+            assert review.voteCounts() == (2, 0)
+
+            # a vote through another session after this one read the shards
+            with current_app.app_context():
+                downvoteReview(reviewID, voters[3])
+            assert edit_review(review, voters[0], False, "flipped") is not None
+            assert ReviewCounterShard.query.filter_by(reviewID=reviewID).count() == 0
+            score = get_student("9230", 'detail').to_json()['karmaScore']
+            assert score == -1
+
+            repair_student_karma()
+            assert get_student("9230", 'detail').to_json()['karmaScore'] == score
+        finally:
+            current_app.config['COUNTER_SHARDS'] = 0
+
+    def test_fuzzy_search_and_typeahead(self):
+        admin = create_user("Search", "searchlast", "searchpass")
+        staff = create_staff(admin, "Sea", "Rch", "password", "9300", "search@example.com", 3)
+        create_student(admin, "9310", "Zebulon", "Quackenbush", "pass", "000-0000", "Full-Time", 1)
+        create_student(admin, "9311", "Zebedee", "Quackenbos", "pass", "000-0000", "Full-Time", 1)
+        create_student(admin, "9312", "Xavier", "Quill", "pass", "000-0000", "Full-Time", 1)
+        assert search_backend() == 'fts5'
+
+        # a misspelt surname still finds the student, best match first
+        matches = search_students("Quakenbush", 5)
+        assert [studentID for studentID, _ in matches][:2] == ["9310", "9311"]
+        assert "9312" not in [studentID for studentID, _ in matches]
+        assert search_students("9312")[0] == ("9312", 1.0)
+        # terms too short for a trigram match name prefixes
+        assert [studentID for studentID, _ in search_students("Xa", 5)] == ["9312"]
+        assert sorted(studentID for studentID, _ in search_students("ze q", 5)) == ["9310", "9311"]
+
+        # results follow the student ID, not a rowid VACUUM may renumber
+        db.session.delete(get_student("9311"))
+        db.session.commit()
+        db.session.execute(db.text("VACUUM"))
+        assert [studentID for studentID, _ in search_students("Xavier Quill", 5)][:1] == ["9312"]
+        create_student(admin, "9311", "Zebedee", "Quackenbos", "pass", "000-0000", "Full-Time", 1)
+
+        results = search_students_searchTerm(staff, "zebulon", 5)
+        assert results[0]["studentID"] == "9310" and results[0]["similarity"] == 1.0
+
+        update_student(get_student("9312"), "Xavier", "Quackenbush", None, "000-0000", "Full-Time", 1)
+        assert "9312" in [studentID for studentID, _ in search_students("Quackenbush", 5)]
+
+        assert [row["ID"] for row in typeahead_students("zeb")] == ["9311", "9310"]
+
+        # a SQLite without FTS5 trigram support still creates the schema and searches in memory
+        engine = db.create_engine(f"sqlite:///{tempfile.mkdtemp()}/nofts.db")
+        with mock.patch.object(search_module, 'fts5_trigram_supported', return_value=False):
+            db.metadata.create_all(engine)
+        assert 'student_search' not in db.inspect(engine).get_table_names()
+        engine.dispose()
+        assert typeahead_students("931", 2) == [{"ID": "9312", "name": "Xavier Quackenbush"}, {"ID": "9311", "name": "Zebedee Quackenbos"}]
+
+        client = current_app.test_client()
+        headers = {'Authorization': f'Bearer {create_access_token(identity="9300")}'}
+        response = client.get('/students/typeahead/QUACK?limit=1', headers=headers)
+        assert response.status_code == 200 and len(response.get_json()) == 1
+        response = client.get('/students/search/Quackenbush?limit=1', headers=headers)
+        assert response.status_code == 200 and len(response.get_json()) == 1
+        assert client.get('/students/search/zzzzzz', headers=headers).status_code == 204
+
+    def test_identity_resolved_from_role_claim(self):
+        admin = create_user("Ident", "identlast", "identpass")
+        create_staff(admin, "Iden", "Tity", "password", "9400", "ident@example.com", 3)
+        create_student(admin, "9410", "Cache", "Dstudent", "pass", "000-0000", "Full-Time", 1)
+        client = current_app.test_client()
+        token = jwt_authenticate("9410", "pass")
+        headers = {'Authorization': f'Bearer {token}'}
+        identity_cache.clear()
+
+        # one primary key lookup, then none while the user is cached
+        with count_queries() as statements:
+            assert client.get('/api/identify', headers=headers).status_code == 200
+        assert len(statements) == 1 and 'FROM student' in statements[0]
+        with count_queries() as statements:
+            response = client.get('/api/identify', headers=headers)
+        assert statements == [] and 'Cache' in response.get_json()['message']
+
+        # the cached user is only dropped once a change commits
+        student = get_student("9410")
+        student.firstname = "Flushed"
+        db.session.flush()
+        assert identity_cache.get(("student", "9410")) is not None
+        db.session.rollback()
+        assert identity_cache.get(("student", "9410")) is not None
+
+        update_student(get_student("9410"), "Renamed", "Dstudent", None, "000-0000", "Full-Time", 1)
+        response = client.get('/api/identify', headers=headers)
+        assert 'Renamed' in response.get_json()['message']
+
+        # staff tokens resolve to staff, and views use the resolved user as is
+        token = jwt_authenticate("9400", "password")
+        response = client.get('/students/typeahead/9410', headers={'Authorization': f'Bearer {token}'})
+        assert response.status_code == 200 and response.get_json()[0]["ID"] == "9410"
+
+    def test_user_directory(self):
+        admin = create_user("Direct", "directlast", "directpass")
+        create_staff(admin, "Dir", "Ectory", "password", "9500", "directory@example.com", 3)
+        create_student(admin, "9510", "Dir", "Student", "pass", "000-0000", "Full-Time", 1)
+        assert get_user_role(admin.ID) == "admin" and get_user_role("9500") == "staff" and get_user_role("9510") == "student"
+        assert get_user_role("9599") is None
+        assert isinstance(get_user("9510"), Student)
+
+        # an ID already used in another role is rejected
+        assert create_student(admin, "9500", "Dup", "Licate", "pass", "000-0000", "Full-Time", 1) is None
+        assert get_user_role("9500") == "staff"
+
+        # one lookup in the directory, one in the user's own table
+        with count_queries() as statements:
+            assert login("9510", "pass").ID == "9510"
+        assert len(statements) == 2
+
+        UserDirectory.query.filter_by(ID="9510").delete()
+        db.session.commit()
+        assert sync_user_directory() == (1, 0, {})
+
+        # a staff member and a student sharing an ID are reported rather than left out quietly
+        db.session.execute(db.insert(Staff.__table__).values(
+            ID="9510", firstname="Same", lastname="ID", password="x", email="same@example.com", teachingExperience=1))
+        UserDirectory.query.filter_by(ID="9510").delete()
+        db.session.commit()
+        assert sync_user_directory() == (0, 0, {"9510": ["staff", "student"]})
+        assert get_user_role("9510") is None
+        db.session.execute(db.delete(Staff.__table__).where(Staff.__table__.c.ID == "9510"))
+        assert sync_user_directory() == (1, 0, {})
+        delete_me = get_student("9510")
+        db.session.delete(delete_me)
+        db.session.commit()
+        assert get_user_role("9510") is None
+
+    def test_login_hashes_once_and_upgrades_hash(self):
+        admin = create_user("Login", "loginlast", "loginpass")
+        student = create_student(admin, "9610", "Log", "In", "pass", "000-0000", "Full-Time", 1)
+        student.password = generate_password_hash("pass", method="sha256")
+        db.session.commit()
+        assert student.needsRehash()
+
+        assert authenticate("9610", "wrong") is None
+        assert authenticate("9610", "pass", (Staff,)) is None
+        user = authenticate("9610", "pass")
+        assert user.ID == "9610" and not user.needsRehash()
+        assert user.password.startswith(current_app.config['PASSWORD_HASH_METHOD'] + '$')
+        assert authenticate("9610", "pass") is not None
+
+        # a configured method without iterations means werkzeug's default, not a new method
+        method = current_app.config['PASSWORD_HASH_METHOD']
+        try:
+            current_app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256'
+            assert user.needsRehash()
+            user.password = generate_password_hash("pass", method=f"pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}")
+            assert not user.needsRehash()
+        finally:
+            current_app.config['PASSWORD_HASH_METHOD'] = method
+        db.session.rollback()
+
+        import App.models.user as user_module
+        client = current_app.test_client()
+        with mock.patch.object(user_module, 'check_password_hash', wraps=check_password_hash) as verify:
+            response = client.post('/login', json={'ID': '9610', 'password': 'pass'})
+        assert response.status_code == 200 and verify.call_count == 1
+        with client.session_transaction() as session:
+            assert session['_user_id'] == '9610'
+        with mock.patch.object(user_module, 'check_password_hash', wraps=check_password_hash) as verify:
+            response = client.post('/api/login', json={'ID': '9610', 'password': 'pass'})
+        assert response.status_code == 200 and verify.call_count == 1
+        assert client.post('/api/admin/login', json={'ID': '9610', 'password': 'pass'}).status_code == 401
+
+    def test_bulk_import(self):
+        admin = create_user("Import", "importlast", "importpass")
+        create_staff(admin, "Imp", "Ort", "password", "9700", "import@example.com", 3)
+        upload = io.StringIO(
+            "studentID,firstname,lastname,password,contact,studentType,yearOfStudy\n"
+            "9710,Ada,Lovelace,pass,000-0000,full-time,2\n"
+            "9711,Alan,Turing,pass,000-0000,Part-Time,x\n"
+            "9700,Taken,Staff,pass,000-0000,Evening,1\n"
+            "9712,Grace,Hopper,pass,000-0000,Evening,3\n"
+            "9712,Grace,Again,pass,000-0000,Evening,3\n"
+            "9713,,Nobody,pass,000-0000,Evening,3\n")
+        report = import_users('student', read_rows(upload), chunk_size=2, workers=2)
+        assert report['imported'] == 2
+        assert [(error['line'], error['ID']) for error in report['errors']] == [(3, "9711"), (4, "9700"), (6, "9712"), (7, "9713")]
+        student = get_student("9710")
+        assert student.studentType == "Full-Time" and student.yearOfStudy == 2 and student.check_password("pass")
+        assert get_user_role("9712") == "student" and authenticate("9712", "pass").ID == "9712"
+
+        # a row the database rejects, here an ID claimed after the directory check, skips only that row
+        db.session.execute(db.insert(Student.__table__).values(
+            ID="9715", firstname="Late", lastname="Claim", password="x", contact="000-0000", studentType="Evening", yearOfStudy=1))
+        db.session.commit()
+        upload = io.StringIO(
+            "studentID,firstname,lastname,password,contact,studentType,yearOfStudy\n"
+            "9714,Katherine,Johnson,pass,000-0000,Evening,1\n"
+            "9715,Late,Again,pass,000-0000,Evening,1\n"
+            f"9716,{'x' * 121},Long,pass,000-0000,Evening,1\n")
+        report = import_users('student', read_rows(upload))
+        assert report['imported'] == 1 and get_user_role("9714") == "student"
+        assert [(error['line'], error['ID']) for error in report['errors']] == [(4, "9716"), (3, "9715")]
+        assert report['errors'][0]['error'] == "firstname longer than 120 characters"
+        db.session.execute(db.delete(Student.__table__).where(Student.__table__.c.ID == "9715"))
+        db.session.commit()
+
+        client = current_app.test_client()
+        headers = {'Authorization': f'Bearer {create_access_token(identity=admin)}', 'Content-Type': 'application/x-ndjson'}
+        body = '{"staffID": "9720", "firstname": "Imp", "lastname": "Staff", "password": "pw", "email": "i@example.com", "teachingExperience": 4}\nnot json\n'
+        # web imports hash in the request's own process whatever IMPORT_HASH_WORKERS says
+        import App.controllers.importer as importer_module
+        with mock.patch.object(importer_module, 'ProcessPoolExecutor') as pool:
+            response = client.post('/users/import/staff', data=body, headers=headers)
+        assert response.status_code == 200 and pool.call_count == 0
+        assert response.get_json()['imported'] == 1 and response.get_json()['errors'][0]['error'] == 'malformed row'
+        assert get_user_role("9720") == "staff"
+        staff_headers = {'Authorization': f'Bearer {create_access_token(identity=get_staff("9700"))}'}
+        assert client.post('/users/import/staff', data=body, headers=staff_headers).status_code == 401
+
+    def test_request_query_instrumentation(self):
+        admin = create_user("Instr", "instrlast", "instrpass")
+        staff = create_staff(admin, "Ins", "Trument", "password", "9800", "instr@example.com", 3)
+        create_student(admin, "9810", "Query", "Counted", "pass", "000-0000", "Full-Time", 1)
+        client = current_app.test_client()
+        headers = {'Authorization': f'Bearer {create_access_token(identity=staff)}'}
+        assert 'Server-Timing' not in client.get('/students/9810', headers=headers).headers
+
+        current_app.config.update(SERVER_TIMING=True, SLOW_QUERY_MS=0.000001)
+        student_documents.clear()
+        try:
+            with self.assertLogs('App.sql.slow', 'WARNING') as logs:
+                response = client.get('/students/9810', headers=headers)
+        finally:
+            current_app.config.update(SERVER_TIMING=False, SLOW_QUERY_MS=100)
+        assert response.status_code == 200
+        timing = response.headers['Server-Timing']
+        assert timing.startswith('db;dur=') and f'desc="{len(logs.records)} statements"' in timing
+        assert 'db-slowest;dur=' in timing and 'app;dur=' in timing
+        entry = json.loads(logs.records[0].getMessage())
+        assert entry["event"] == "slow_query" and entry["path"] == "/students/9810"
+        assert entry["call_site"].startswith("App/controllers/")
+
+        # a failed statement is not counted, and its start time is not the next one's
+        with current_app.test_request_context():
+            g._queries = queries = RequestQueries()
+            with pytest.raises(Exception):
+                db.session.execute(db.text("SELECT * FROM no_such_table"))
+            db.session.rollback()
+            time.sleep(0.05)
+            db.session.execute(db.text("SELECT 1"))
+            assert queries.count == 1 and queries.seconds < 0.05
+
+    def test_metrics_endpoint(self):
+        admin = create_user("Metric", "metriclast", "metricpass")
+        staff = create_staff(admin, "Met", "Rics", "password", "9850", "metrics@example.com", 3)
+        client = current_app.test_client()
+        headers = {'Authorization': f'Bearer {jwt_authenticate("9850", "password")}'}
+        client.get('/api/identify', headers=headers)
+        client.get('/api/identify', headers=headers)
+        create_student(admin, "9860", "Met", "Student", "pass", "000-0000", "Full-Time", 1)
+        upvoteReview(create_review(staff.ID, "9860", True, "Good").ID, staff)
+
+        response = client.get('/metrics')
+        assert response.status_code == 200 and response.mimetype == 'text/plain'
+        text = response.get_data(as_text=True)
+        assert 'http_requests_total{blueprint="auth_views",route="/api/identify",method="GET",status="200"}' in text
+        assert 'http_request_duration_seconds_count{blueprint="auth_views",route="/api/identify",method="GET"}' in text
+        assert 'app_operation_duration_seconds_count{operation="vote"}' in text
+        assert 'cache_hit_ratio{cache="identity"}' in text and 'db_pool_checkout_seconds_count' in text
+
+        current_app.config['METRICS_TOKEN'] = 'scrape'
+        try:
+            assert client.get('/metrics').status_code == 401
+            assert client.get('/metrics', headers={'Authorization': 'Bearer scrape'}).status_code == 200
+        finally:
+            current_app.config['METRICS_TOKEN'] = ''
+
+    def test_request_profiling(self):
+        admin = create_user("Profile", "profilelast", "profilepass")
+        staff = create_staff(admin, "Pro", "Filed", "password", "9870", "profile@example.com", 3)
+        client = current_app.test_client()
+        directory = tempfile.mkdtemp()
+        staff_headers = {'Authorization': f'Bearer {create_access_token(identity=staff)}'}
+        current_app.config.update(PROFILE_DIR=directory, PROFILER='cprofile', PROFILE_KEEP=1)
+        try:
+            assert client.get('/staff', headers=staff_headers).status_code == 200
+            assert client.get('/staff', headers={**staff_headers, 'X-Profile': 'forged'}).status_code == 200
+            assert summarize_profiles(directory)[2] == 0
+
+            # only admins get a token
+            assert client.post('/api/admin/profile-token', headers=staff_headers).status_code == 401
+            response = client.post('/api/admin/profile-token', headers={'Authorization': f'Bearer {create_access_token(identity=admin)}'})
+            token = response.get_json()['token']
+            client.get('/staff', headers={**staff_headers, 'X-Profile': token})
+            client.get('/staff', headers={**staff_headers, 'X-Profile': token})
+        finally:
+            current_app.config.update(PROFILE_DIR='', PROFILER='sampler', PROFILE_KEEP=50)
+        assert os.listdir(directory) == ['GET_staff'] and len(os.listdir(os.path.join(directory, 'GET_staff'))) == 1
+        _, stats, count = summarize_profiles(directory, 'staff')
+        assert count == 1 and any(function[2] == 'get_all_staff_action' for function in stats.stats)
+
+        stack_sampler.start(threading.get_ident())
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            pass
+        stacks = stack_sampler.stop(threading.get_ident())
+        assert stacks and all(stack.endswith('test_app.py:test_request_profiling') for stack in stacks)
+
+    def test_rankings_etag(self):
+        admin = create_user("Etag", "etaglast", "etagpass")
+        staff = create_staff(admin, "E", "Tag", "password", "9880", "etag@example.com", 3)
+        student = create_student(admin, "9881", "Cached", "Ranking", "pass", "000-0000", "Full-Time", 1)
+        upvoteReview(create_review(staff.ID, student.ID, True, "Good").ID, create_staff(admin, "Up", "Voter", "password", "9882", "up@example.com", 1))
+        update_student_karma_rankings()
+        client = current_app.test_client()
+        headers = {'Authorization': f'Bearer {create_access_token(identity=staff)}'}
+
+        response = client.get('/rankings', headers=headers)
+        assert response.status_code == 200 and response.headers['X-Ranking-Version'] == str(get_ranking_state().version)
+        etag = response.headers['ETag']
+        assert any(row["studentID"] == "9881" for row in response.get_json())
+
+        # unchanged rankings are served from the cache, or not at all to a client that has them
+        with mock.patch.object(Staff, 'getStudentRankings') as rankings:
+            again = client.get('/rankings', headers=headers)
+            unchanged = client.get('/rankings', headers={**headers, 'If-None-Match': etag})
+        assert rankings.call_count == 0 and again.get_data() == response.get_data()
+        assert unchanged.status_code == 304 and unchanged.get_data() == b'' and unchanged.headers['ETag'] == etag
+
+        # a ranked student's new name is a new version
+        update_student(get_student("9881"), "Renamed", "Ranking", None, "000-0000", "Full-Time", 1)
+        response = client.get('/rankings', headers={**headers, 'If-None-Match': etag})
+        assert response.status_code == 200 and response.headers['ETag'] != etag
+        assert [row["firstname"] for row in response.get_json() if row["studentID"] == "9881"] == ["Renamed"]
+
+    def test_student_document_cache(self):
+        admin = create_user("Docs", "docslast", "docspass")
+        staff = create_staff(admin, "Doc", "Writer", "password", "9890", "docs@example.com", 3)
+        voter = create_staff(admin, "Doc", "Voter", "password", "9891", "docvoter@example.com", 1)
+        create_student(admin, "9892", "Cached", "Profile", "pass", "000-0000", "Full-Time", 1)
+        client = current_app.test_client()
+        headers = {'Authorization': f'Bearer {create_access_token(identity=staff)}'}
+
+        def document():
+            response = client.get('/students/9892', headers=headers)
+            assert response.status_code == 200
+            return response.get_json()
+
+        assert document()["reviews"] == []
+        with mock.patch.object(Student, 'to_json') as to_json:
+            assert document()["firstname"] == "Cached"
+        assert to_json.call_count == 0
+
+        review = create_review(staff.ID, "9892", True, "Helpful")
+        assert [row["comment"] for row in document()["reviews"]] == ["Helpful"]
+        edit_review(get_review(review.ID), staff, False, "Unhelpful")
+        assert document()["reviews"][0]["comment"] == "Unhelpful"
+        upvoteReview(review.ID, voter)
+        assert document()["reviews"][0]["upvotes"] == 1
+        update_student(get_student("9892"), "Renamed", "Profile", None, "000-0000", "Full-Time", 1)
+        assert document()["firstname"] == "Renamed"
+
+        writer = get_staff("9890")
+        writer.firstname = "Doctor"
+        db.session.commit()
+        assert document()["reviews"][0]["reviewer"] == "Doctor Writer"
+        delete_review(get_review(review.ID), staff)
+        assert document()["reviews"] == []
+        assert client.get('/students/9899', headers=headers).status_code == 404
+        assert student_documents.stats()["hits"] > 0
+
+    def test_seed_dataset(self):
+        args = (40, ["T1", "T2", "T3"], 4, 0.5, 11, "hash", 15, 1, 1)
+        assert list(student_batches(*args)) == list(student_batches(*args))
+        assert list(student_batches(*args)) != list(student_batches(*args[:4], 12, *args[5:]))
+
+        totals = seed_database(students=60, staff=8, reviewsPerStudent=4, voteRate=0.5, seed=3, batchSize=25)
+        assert totals['student'] == 60 and totals['karma'] == 60 and totals['staff'] == 8
+        assert Review.query.filter(Review.studentID.like("S%")).count() == totals['review'] > 0
+        assert ReviewVote.query.filter(ReviewVote.staffID.like("T%")).count() == totals['review_vote'] > 0
+
+        # the stored counters and karma agree with the generated votes
+        student = get_student("S0000000", 'detail')
+        assert student.karma.score == sum(review.karmaContribution() for review in student.reviews)
+        for review in student.reviews:
+            assert (review.upvotes, review.downvotes) == (
+                ReviewVote.query.filter_by(reviewID=review.ID, direction=ReviewVote.UP).count(),
+                ReviewVote.query.filter_by(reviewID=review.ID, direction=ReviewVote.DOWN).count())
+        assert student.karma.rank > 0
+        assert authenticate("T000003", SEED_PASSWORD).ID == "T000003"
+
+        # a second run refuses up front instead of failing part-way on the same IDs
+        with pytest.raises(ValueError, match="T000000 already exists"):
+            seed_database(students=60, staff=8, reviewsPerStudent=4, voteRate=0.5, seed=3, batchSize=25)
+        assert Staff.query.filter(Staff.ID.like("T%")).count() == 8
+
@@ -6,6 +6,7 @@ from .review import *
 from .karma import *
 from .staff import *
 from .auth import *
+from .metrics import *
 
-views = [user_views, index_views, review_views, karma_views, staff_views, auth_views]
+views = [user_views, index_views, review_views, karma_views, staff_views, auth_views, metrics_views]
 # blueprints must be added to this list
@@ -1,14 +1,17 @@
-from flask import Blueprint, render_template, jsonify, request, send_from_directory, flash, redirect, url_for, session
+from flask import Blueprint, render_template, jsonify, request, send_from_directory, flash, redirect, url_for, session, current_app
 from flask_jwt_extended import jwt_required, current_user as jwt_current_user
 from flask_login import login_required, login_user, current_user, logout_user
 from datetime import datetime, timedelta
 
 from.index import index_views
+from App.models import Admin
+from App.profiling import PROFILE_HEADER, create_profile_token
 
 from App.controllers import (
     create_user,
     jwt_authenticate,
     jwt_authenticate_admin,
+    authenticate,
     login 
 )
 
@@ -22,10 +25,11 @@ def identify_page():
 @auth_views.route('/login', methods=['POST'])
 def login_action():
     data = request.json
-    user = login(data['ID'], data['password'])
+    # the password is hashed once, and the flask-login session comes from that one check
+    user = authenticate(data['ID'], data['password'])
     if user:
         session['logged_in'] = True
-        token = jwt_authenticate(data['ID'], data['password'])
+        login_user(user)
         return jsonify(message='user logged in'), 200
     return jsonify(error='bad username or password given'), 401
 
@@ -53,4 +57,13 @@ def admin_login_api():
 @auth_views.route('/api/identify', methods=['GET'])
 @jwt_required()
 def identify_user_action():
-    return jsonify({'message': f"firstname: {jwt_current_user.firstname}, lastname: {jwt_current_user.lastname}, id : {jwt_current_user.ID}"})
\ No newline at end of file
+    return jsonify({'message': f"firstname: {jwt_current_user.firstname}, lastname: {jwt_current_user.lastname}, id : {jwt_current_user.ID}"})
+
+# requests sent with the returned header are profiled (see App.profiling)
+@auth_views.route('/api/admin/profile-token', methods=['POST'])
+@jwt_required()
+def profile_token_action():
+    if not isinstance(jwt_current_user, Admin):
+        return jsonify(error='Unauthorized'), 401
+    return jsonify(header=PROFILE_HEADER, token=create_profile_token(current_app, jwt_current_user.ID),
+                   expires_in=current_app.config['PROFILE_TOKEN_MAX_AGE']), 200
@@ -6,6 +6,7 @@ from App.controllers import create_user, create_staff, create_student, jwt_authe
 import randomname
 
 from App.models.admin import Admin
+from App.leaderboard import leaderboard
 
 index_views = Blueprint('index_views', __name__, template_folder='../templates')
 
@@ -22,6 +23,7 @@ def init():
     # Assuming db is your SQLAlchemy database object
     db.drop_all()
     db.create_all()
+    leaderboard.clear()
 
     admin = Admin('bob', 'boblast', 'bobpass')
 
@@ -54,7 +56,9 @@ def init():
 
     db.session.commit()
     
-    for ID in range(50, 150):
+    # IDs are unique across roles, so the students skip the ones staff hold
+    staffIDs = {'99', '69', *(str(ID) for ID in range(2, 50))}
+    for ID in (ID for ID in range(50, 150) if str(ID) not in staffIDs):
         contact = generate_random_contact_number()
         student = create_student(admin, str(ID),
                                  randomname.get_name(),
@@ -3,14 +3,20 @@ from App.database import db
 from App.controllers import Student
 
 from App.controllers.karma import (
-    update_student_karma_rankings,
+    request_rank_update,
+    get_ranking_state,
 )
 
 # Create a Blueprint for karma views
 karma_views = Blueprint("karma_views", __name__, template_folder='../templates')
 
-# Route to update Karma rankings for all students
+# Route to update Karma rankings for all students; the rank worker picks the request up on its next run
 @karma_views.route("/rankings", methods=["POST"])
 def update_karma_rankings_route():
-    update_student_karma_rankings()
-    return jsonify(message="Karma rankings updated"), 200
+    state = request_rank_update()
+    return jsonify(message="Karma rankings update scheduled", version=state.version), 200
+
+# Route to get the version of the current karma rankings
+@karma_views.route("/rankings/status", methods=["GET"])
+def karma_rankings_status():
+    return jsonify(get_ranking_state().to_json()), 200
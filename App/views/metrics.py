@@ -0,0 +1,15 @@
+import hmac
+
+from flask import Blueprint, Response, current_app, request
+
+from App.metrics import metrics
+
+metrics_views = Blueprint('metrics_views', __name__)
+
+# Prometheus scrape endpoint, covering every worker when METRICS_DIR is set
+@metrics_views.route('/metrics', methods=['GET'])
+def metrics_page():
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return 'Unauthorized', 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,43 @@
+from urllib.parse import urlencode
+
+from flask import current_app, jsonify, request
+
+
+def page_args():
+    """
+    Read the pagination query parameters of the current request.
+
+    ?limit= is clamped to MAX_PAGE_SIZE and defaults to PAGE_SIZE, ?next= is the cursor
+    returned with the previous page and ?estimate=true asks for an estimated total.
+
+    Returns:
+        tuple: (limit, cursor, estimate)
+    """
+    limit = request.args.get('limit', default=current_app.config['PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, current_app.config['MAX_PAGE_SIZE']))
+    cursor = request.args.get('next') or None
+    estimate = request.args.get('estimate', '').lower() in ('1', 'true', 'yes')
+    return limit, cursor, estimate
+
+
+def paginated_response(page, serialize):
+    """
+    Build a JSON list response for a page, advertising the next page in the Link and
+    X-Next-Cursor headers and the estimated total in X-Total-Estimate.
+
+    Args:
+        page (Page): The page to send.
+        serialize: Function turning one item into a JSON-compatible dictionary.
+
+    Returns:
+        Response: The response.
+    """
+    response = jsonify([serialize(item) for item in page.items])
+    if page.next:
+        args = request.args.to_dict()
+        args['next'] = page.next
+        response.headers['Link'] = f'<{request.base_url}?{urlencode(args)}>; rel="next"'
+        response.headers['X-Next-Cursor'] = page.next
+    if page.estimate is not None:
+        response.headers['X-Total-Estimate'] = str(page.estimate)
+    return response
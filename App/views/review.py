@@ -1,4 +1,4 @@
-from flask import Blueprint, jsonify, redirect, render_template, request, abort, url_for
+from flask import Blueprint, jsonify, redirect, render_template, request, abort, url_for, current_app
 from flask_jwt_extended import jwt_required, current_user as jwt_current_user
 from flask_login import current_user
 from App.controllers import Review, Staff
@@ -13,8 +13,15 @@ from App.controllers.review import (
     downvoteReview,
     get_reviews,
     get_reviews_for_student, 
-    get_review
+    get_review,
+    handle_votes,
+    get_reviews_page,
+    get_reviews_for_student_page,
+    get_reviews_by_staff_page,
+    iter_reviews
 )
+from .pagination import page_args, paginated_response
+from .streaming import wants_stream, stream_response
 
 # Create a Blueprint for Review views
 review_views = Blueprint("review_views", __name__, template_folder='../templates')
@@ -23,8 +30,15 @@ review_views = Blueprint("review_views", __name__, template_folder='../templates
 @review_views.route('/reviews', methods=['GET'])
 @jwt_required()
 def list_reviews():
-    reviews = get_reviews()
-    return jsonify([review.to_json() for review in reviews]), 200
+    if wants_stream():
+        return stream_response(iter_reviews(current_app.config['STREAM_CHUNK_SIZE']), Review.to_json)
+
+    limit, cursor, estimate = page_args()
+    try:
+        page = get_reviews_page(limit, cursor, estimate)
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+    return paginated_response(page, Review.to_json), 200
 
 # Route to view a specific review and vote on it
 @review_views.route('/reviews/<int:review_id>', methods=['GET'])
@@ -43,20 +57,20 @@ def vote(review_id):
     if not jwt_current_user or not isinstance(jwt_current_user, Staff):
         return jsonify({"error": "You are not authorized to vote on this review"}), 401
     
-    review = get_review(review_id)
+    review = get_review(review_id, 'vote-check')
     
     if review:
         data = request.json
-        staff = get_staff(jwt_current_user.ID)
+        staff = jwt_current_user
         
         if staff:
             if 'upvote' in data and isinstance(data['upvote'], bool):
                 if data['upvote']:
-                    current_votes = review.upvotes
+                    current_votes = review.voteCounts()[0]
                     new_votes = upvoteReview(review_id, staff)
                     message = 'Review Upvoted Successfully' if new_votes > current_votes else 'Review Already Upvoted'
                 else:
-                    current_votes = review.downvotes
+                    current_votes = review.voteCounts()[1]
                     new_votes = downvoteReview(review_id, staff)
                     message = 'Review Downvoted Successfully' if new_votes > current_votes else 'Review Already Downvoted'
                 
@@ -68,13 +82,38 @@ def vote(review_id):
     else:
         return jsonify({"error": "Review does not exist"}), 404
 
+# Route to vote on several reviews at once
+@review_views.route('/reviews/votes', methods=['POST'])
+@jwt_required()
+def vote_batch():
+    if not jwt_current_user or not isinstance(jwt_current_user, Staff):
+        return jsonify({"error": "You are not authorized to vote on reviews"}), 401
+
+    data = request.json
+    votes = data.get('votes') if isinstance(data, dict) else data
+    if not isinstance(votes, list) or not votes:
+        return jsonify({"error": "Invalid request data. Expected a list of {reviewID, upvote} votes"}), 400
+
+    limit = current_app.config['VOTE_BATCH_LIMIT']
+    if len(votes) > limit:
+        return jsonify({"error": f"Too many votes in one request. The limit is {limit}"}), 400
+
+    results = handle_votes(jwt_current_user, votes)
+    if results is None:
+        return jsonify({"error": "Error saving votes"}), 500
+    return jsonify(results), 200
+
 # Route to get reviews by student ID
 @review_views.route("/students/<string:student_id>/reviews", methods=["GET"])
 def get_reviews_of_student(student_id):
     if search_student(student_id):
-        reviews = get_reviews_for_student(student_id)
-        if reviews:
-            return jsonify([review.to_json() for review in reviews]), 200
+        limit, cursor, _ = page_args()
+        try:
+            page = get_reviews_for_student_page(student_id, limit, cursor)
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+        if page.items or cursor:
+            return paginated_response(page, Review.to_json), 200
         else:
             return "No reviews found for the student", 404
     return "Student does not exist", 404
@@ -83,9 +122,13 @@ def get_reviews_of_student(student_id):
 @review_views.route("/staff/<string:staff_id>/reviews", methods=["GET"])
 def get_reviews_from_staff(staff_id):
     if get_staff(str(staff_id)):
-        reviews = get_reviews_by_staff(staff_id)
-        if reviews:
-            return jsonify([review.to_json() for review in reviews]), 200
+        limit, cursor, _ = page_args()
+        try:
+            page = get_reviews_by_staff_page(staff_id, limit, cursor)
+        except ValueError:
+            return jsonify({"error": "Invalid cursor"}), 400
+        if page.items or cursor:
+            return paginated_response(page, Review.to_json), 200
         else:
             return "No reviews found by the staff member", 404
     return "Staff does not exist", 404
@@ -101,7 +144,7 @@ def review_edit(review_id):
     if not jwt_current_user or not isinstance(jwt_current_user, Staff) or review.reviewerID != jwt_current_user.ID :
       return "You are not authorized to edit this review", 401
 
-    staff = get_staff(jwt_current_user.ID)
+    staff = jwt_current_user
 
     data = request.json
 
@@ -128,7 +171,7 @@ def review_delete(review_id):
     if not jwt_current_user or not isinstance(jwt_current_user, Staff) or review.reviewerID != jwt_current_user.ID :
       return "You are not authorized to delete this review", 401
 
-    staff = get_staff(jwt_current_user.ID)
+    staff = jwt_current_user
    
     if delete_review(review, staff):
         return "Review deleted successfully", 200
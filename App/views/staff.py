@@ -1,15 +1,18 @@
 import random
 import string
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, current_app
 from App.controllers import Student, Staff
 from App.controllers.user import get_staff, get_student
 from App.database import db
 from flask_jwt_extended import current_user as jwt_current_user
 from flask_jwt_extended import jwt_required
+from App.leaderboard import get_leaderboard
 
 from App.controllers.staff import (
     search_students_searchTerm, 
+    typeahead_search,
     get_student_rankings,
+    get_student_rankings_json,
     create_review
 )
 
@@ -42,9 +45,6 @@ def create_review_action(student_id):
     if data['isPositive'] not in (True, False):
         return jsonify({"message": f"invalid Positivity ({data['isPositive']}). Positive: true or false"}), 400
 
-    if not get_staff(str(jwt_current_user.ID)):
-        return 'Staff does not exist', 404 
-
     review = create_review(jwt_current_user.ID, student_id, data['isPositive'], data['comment'])
     
     if review:
@@ -55,7 +55,8 @@ def create_review_action(student_id):
 @jwt_required()
 def search_students(search_term):
   if jwt_current_user and isinstance(jwt_current_user, Staff): 
-    students = search_students_searchTerm(jwt_current_user, search_term)
+    limit = request.args.get('limit', current_app.config['SEARCH_LIMIT'], type=int)
+    students = search_students_searchTerm(jwt_current_user, search_term, max(1, min(limit, 100)))
     if students:
       return jsonify([student for student in students]), 200
     else:
@@ -63,14 +64,33 @@ def search_students(search_term):
   else:
     return jsonify({"message": "You are not authorized to perform this action"}), 401
 
+# lightweight suggestions for a search box, one request per keystroke
+@staff_views.route('/students/typeahead/<string:prefix>', methods=['GET'])
+@jwt_required()
+def typeahead_students_action(prefix):
+  if jwt_current_user and isinstance(jwt_current_user, Staff):
+    limit = request.args.get('limit', current_app.config['TYPEAHEAD_LIMIT'], type=int)
+    return jsonify(typeahead_search(prefix, max(1, min(limit, 50)))), 200
+  else:
+    return jsonify({"message": "You are not authorized to perform this action"}), 401
+
 @staff_views.route('/rankings', methods=['GET'])
 @jwt_required()
 def get_karma_rankings():
   if jwt_current_user or isinstance(jwt_current_user, Staff):
-    rankings = get_student_rankings(jwt_current_user) 
-    if rankings:
-      return jsonify(rankings), 200
+    limit = request.args.get('limit', type=int)
+    # rankings only change when the rank worker publishes a new version, so polling
+    # clients that send back the ETag get a 304 without the rankings being rebuilt
+    version, body = get_student_rankings_json(jwt_current_user, limit)
+    etag = f'rankings-{version}-{limit if limit is not None else "all"}'
+    headers = {'X-Ranking-Version': str(version), 'Cache-Control': 'no-cache'}
+    if etag in request.if_none_match:
+      response = Response(status=304, headers=headers)
+    elif body:
+      response = Response(body, 200, headers, mimetype='application/json')
     else:
-      return jsonify({"message": "No rankings found"}), 204
+      return jsonify({"message": "No rankings found"}), 204, headers
+    response.set_etag(etag)
+    return response
   else:
     return jsonify({"message": "You are not authorized to perform this action"}), 401 
\ No newline at end of file
@@ -0,0 +1,54 @@
+from flask import Response, current_app, request, stream_with_context
+
+NDJSON = 'application/x-ndjson'
+
+
+def wants_stream():
+    """
+    Check whether the client asked for the whole collection as a stream, either with
+    ?stream=true or by accepting NDJSON.
+
+    Returns:
+        bool: True if the response should be streamed.
+    """
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return request.accept_mimetypes.best_match(['application/json', NDJSON]) == NDJSON
+
+
+def stream_response(rows, serialize):
+    """
+    Stream a collection as a JSON array, or as NDJSON if the client accepts it, without
+    holding the collection in memory. Serialized rows are written in chunks of
+    STREAM_CHUNK_SIZE.
+
+    Args:
+        rows: Iterable of rows, ideally read through a server-side cursor.
+        serialize: Function turning one row into a JSON-compatible dictionary.
+
+    Returns:
+        Response: The streaming response.
+    """
+    ndjson = request.accept_mimetypes.best_match(['application/json', NDJSON]) == NDJSON
+    chunk_size = current_app.config['STREAM_CHUNK_SIZE']
+    dumps = current_app.json.dumps
+
+    def generate():
+        chunk = []
+        separator = '\n' if ndjson else ','
+        if not ndjson:
+            yield '['
+        for index, row in enumerate(rows):
+            if index and not ndjson:
+                chunk.append(separator)
+            chunk.append(dumps(serialize(row)))
+            if ndjson:
+                chunk.append(separator)
+            if len(chunk) >= chunk_size:
+                yield ''.join(chunk)
+                chunk = []
+        if not ndjson:
+            chunk.append(']')
+        yield ''.join(chunk)
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON if ndjson else 'application/json')
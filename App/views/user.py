@@ -1,9 +1,11 @@
-from flask import Blueprint, jsonify, render_template, request, send_from_directory
+from flask import Blueprint, jsonify, render_template, request, send_from_directory, current_app
 from flask_jwt_extended import current_user as jwt_current_user
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from flask_login import current_user
 
 from App.controllers import *
+from .pagination import page_args, paginated_response
+from .streaming import wants_stream, stream_response
 
 # Create a Blueprint for user views
 user_views = Blueprint("user_views", __name__, template_folder='../templates')
@@ -23,8 +25,15 @@ def get_user_page():
 @user_views.route('/api/users', methods=['GET'])
 @jwt_required()
 def get_users_action():
-    users = get_all_users_json()
-    return jsonify(users)
+    if wants_stream():
+        return stream_response(iter_all_users(current_app.config['STREAM_CHUNK_SIZE']), lambda user: user.to_json())
+
+    limit, cursor, estimate = page_args()
+    try:
+        page = get_users_page(limit, cursor, estimate)
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+    return paginated_response(page, lambda user: user.to_json())
 
 @user_views.route('/static/users', methods=['GET'])
 def static_user_page():
@@ -40,7 +49,7 @@ def create_student_action():
       return jsonify({"error": "Invalid request data"}), 400
 
       #check if id exists in the database
-    if get_student(data['studentID']) or get_staff(data['studentID']) or get_admin(data['studentID']):
+    if get_user_role(data['studentID']):
       return jsonify({"error": f"A user already uses the ID {data['studentID']}"}), 500
 
   #validate student type
@@ -59,6 +68,29 @@ def create_student_action():
     else:
       return jsonify({"error" : "Unauthorized: You must be an admin to create students"}), 401
 
+# Route to create students or staff in bulk from a CSV (text/csv) or NDJSON (application/x-ndjson) upload,
+# sent as the request body or as the 'file' field of a form; the body is read as it arrives
+@user_views.route("/users/import/<string:role>", methods=["POST"])
+@jwt_required()
+def import_users_action(role):
+    if not jwt_current_user or not isinstance(jwt_current_user, Admin):
+      return jsonify({"error" : "Unauthorized: You must be an admin to import users"}), 401
+
+    role = {'students': 'student', 'staff': 'staff'}.get(role)
+    if role is None:
+      return jsonify({"error": "Users can be imported as students or staff"}), 404
+
+    upload = request.files.get('file')
+    if upload:
+      stream, mimetype, filename = upload.stream, upload.mimetype, upload.filename or ''
+    else:
+      stream, mimetype, filename = request.stream, request.mimetype, ''
+    format = 'ndjson' if mimetype in ('application/x-ndjson', 'application/json') or filename.endswith(('.ndjson', '.jsonl')) else 'csv'
+
+    # hashed in this process: a hashing pool per request would multiply across gunicorn workers
+    report = import_users(role, read_rows(stream, format), workers=1)
+    return jsonify(report), 200
+
 # Route to create a new staff member
 @user_views.route("/users/create_staff", methods=["POST"])
 @jwt_required()
@@ -70,7 +102,7 @@ def create_staff_action():
   if not data['firstname'] or not data['lastname'] or not data['password'] or not data['staffID'] or not data['email'] or not data['teachingExperience']:
     return jsonify({"error": "Invalid request data"}), 400
   
-  if get_student(data['staffID']) or get_staff(data['staffID']) or get_admin(data['staffID']):
+  if get_user_role(data['staffID']):
     return jsonify({"error": f"A user already uses the ID {data['staffID']}"}), 400
   
   if jwt_current_user and isinstance(jwt_current_user, Admin):
@@ -87,9 +119,9 @@ def create_staff_action():
 @user_views.route("/students/<string:id>", methods=["GET"])
 @jwt_required()
 def get_student_action(id):
-    student = get_student(str(id))
-    if student:
-        return jsonify(student.to_json()), 200
+    document = get_student_document(str(id))
+    if document:
+        return jsonify(document), 200
     else:
         return "Student not found", 404
 
@@ -97,9 +129,16 @@ def get_student_action(id):
 @user_views.route("/students", methods=["GET"])
 @jwt_required()
 def get_all_students_action():
-    students = get_all_students()
-    if students:
-       return jsonify([student.to_json() for student in students]), 200
+    if wants_stream():
+        return stream_response(iter_all(Student, current_app.config['STREAM_CHUNK_SIZE']), Student.to_json)
+
+    limit, cursor, estimate = page_args()
+    try:
+        page = get_students_page(limit, cursor, estimate)
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+    if page.items or cursor:
+       return paginated_response(page, Student.to_json), 200
     else:
         return "No students found", 404
 
@@ -107,9 +146,16 @@ def get_all_students_action():
 @user_views.route("/staff", methods=["GET"])
 @jwt_required()
 def get_all_staff_action():
-    staff = get_all_staff()
-    if staff:
-        return jsonify([s.to_json() for s in staff]), 200
+    if wants_stream():
+        return stream_response(iter_all(Staff, current_app.config['STREAM_CHUNK_SIZE']), Staff.to_json)
+
+    limit, cursor, estimate = page_args()
+    try:
+        page = get_staff_page(limit, cursor, estimate)
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+    if page.items or cursor:
+        return paginated_response(page, Staff.to_json), 200
     else:
         return "No staff members found", 404
 
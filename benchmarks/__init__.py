@@ -0,0 +1,7 @@
+"""
+Benchmarks that drive the app through Flask's test client against a throwaway database.
+
+    python -m benchmarks.endpoints --help   # latency, throughput and queries per endpoint
+    python -m benchmarks.login --help       # login throughput
+    python -m benchmarks.postman --help     # replay a Postman collection with concurrent virtual users
+"""
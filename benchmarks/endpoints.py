@@ -0,0 +1,154 @@
+"""
+Endpoint load benchmark: drives the real blueprints against seeded databases of several
+sizes and reports latency percentiles, throughput and SQL statements per request.
+
+    python -m benchmarks.endpoints --sizes 1000,10000 --requests 300 --threads 8 --out results.json
+    python -m benchmarks.endpoints --baseline results.json          # exits 1 on a regression
+    python -m benchmarks.endpoints --gunicorn 4                     # through a local gunicorn instead
+
+Seeded databases are cached in the temp directory (see benchmarks.harness.DATA_DIR).
+"""
+import argparse
+import platform
+import random
+import sys
+from datetime import datetime, timezone
+
+from benchmarks.harness import (HTTPTarget, InProcessTarget, GunicornServer, compare, read_json,
+                                run_concurrently, seed_config, seeded_copy, write_json)
+
+SCENARIOS = ['login', 'reviews', 'vote', 'student', 'search', 'rankings']
+
+
+class Workload:
+    """
+    The requests of each scenario, drawn deterministically from the seeded data.
+    """
+
+    def __init__(self, size, tokens, reviewIDs, lastnames, seed=0):
+        config = seed_config(size, seed)
+        self.students = [f'S{n:07}' for n in range(config['students'])]
+        self.staff = [f'T{n:06}' for n in range(config['staff'])]
+        self.tokens = tokens
+        self.reviewIDs = reviewIDs
+        self.lastnames = lastnames
+        self.seed = seed
+
+    def token(self, number):
+        return self.tokens[number % len(self.tokens)]
+
+    def scenario(self, name):
+        from App.seed import SEED_PASSWORD
+
+        rng = random.Random(f'{self.seed}-{name}')
+        picks = [rng.random() for _ in range(4096)]
+
+        def pick(options, number):
+            return options[int(picks[number % len(picks)] * len(options))]
+
+        requests = {
+            'login': lambda n: ('POST', '/api/login', None, {'ID': pick(self.staff + self.students, n), 'password': SEED_PASSWORD}),
+            'reviews': lambda n: ('GET', '/reviews?limit=50', self.token(n), None),
+            'vote': lambda n: ('POST', f'/reviews/{pick(self.reviewIDs, n)}', self.token(n), {'upvote': picks[(n + 1) % len(picks)] < 0.7}),
+            'student': lambda n: ('GET', f'/students/{pick(self.students, n)}', self.token(n), None),
+            'search': lambda n: ('GET', f'/students/search/{pick(self.lastnames, n)}?limit=20', self.token(n), None),
+            'rankings': lambda n: ('GET', '/rankings?limit=100', self.token(n), None),
+        }
+        return requests[name]
+
+
+def staff_tokens(target, staff, count=20):
+    # tokens come from /api/login, like a real client's
+    from App.seed import SEED_PASSWORD
+
+    tokens = []
+    client = target.client()
+    for ID in staff[:count]:
+        status, body, _ = target.request(client, 'POST', '/api/login', None, {'ID': ID, 'password': SEED_PASSWORD})
+        if status != 200:
+            raise RuntimeError(f'could not log in as {ID}: {status}')
+        tokens.append(body['access_token'])
+    return tokens
+
+
+def sample_data(database):
+    import sqlite3
+    with sqlite3.connect(database) as connection:
+        reviewIDs = [row[0] for row in connection.execute('SELECT "ID" FROM review ORDER BY "ID" LIMIT 5000')]
+        lastnames = [row[0] for row in connection.execute('SELECT DISTINCT lastname FROM student')]
+    return reviewIDs, lastnames
+
+
+def bench_size(size, scenarios, requests, threads, gunicorn, seed):
+    database = seeded_copy(size, seed)
+    reviewIDs, lastnames = sample_data(database)
+
+    if gunicorn:
+        with GunicornServer(database, workers=gunicorn) as server:
+            target = HTTPTarget(server.url)
+            return _run(target, size, scenarios, requests, threads, reviewIDs, lastnames, seed)
+
+    from App.main import create_app
+    from App.database import db
+    from App.leaderboard import rebuild_leaderboard
+    from App.search import ngram_index
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{database}', 'RANK_WORKER': 'off'})
+    # module-level state left over from the previous size's database
+    ngram_index.clear()
+    rebuild_leaderboard()
+    target = InProcessTarget(app, db.engine)
+    return _run(target, size, scenarios, requests, threads, reviewIDs, lastnames, seed)
+
+
+def _run(target, size, scenarios, requests, threads, reviewIDs, lastnames, seed):
+    workload = Workload(size, [], reviewIDs, lastnames, seed)
+    workload.tokens = staff_tokens(target, workload.staff)
+    results = {}
+    for name in scenarios:
+        results[name] = run_concurrently(target, workload.scenario(name), requests, threads)
+        print(f"{size:>8} {name:<10} " + '  '.join(f'{key} {value}' for key, value in results[name].items()), flush=True)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000', help='comma-separated numbers of students')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--gunicorn', type=int, default=0, metavar='WORKERS', help='run through a local gunicorn with this many workers')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='write the results as JSON')
+    parser.add_argument('--baseline', help='compare against results saved earlier')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative latency/throughput change')
+    args = parser.parse_args(argv)
+
+    scenarios = [name for name in args.scenarios.split(',') if name]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(sorted(unknown))}')
+
+    results = {}
+    for size in [int(size) for size in args.sizes.split(',')]:
+        results[str(size)] = bench_size(size, scenarios, args.requests, args.threads, args.gunicorn, args.seed)
+
+    if args.out:
+        write_json(args.out, {
+            "meta": {"created": datetime.now(timezone.utc).isoformat(timespec='seconds'), "python": platform.python_version(),
+                     "requests": args.requests, "threads": args.threads, "gunicorn": args.gunicorn, "seed": args.seed},
+            "results": results,
+        })
+
+    if args.baseline:
+        regressions = compare(results, read_json(args.baseline)['results'], args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            return 1
+        print('no regressions against the baseline')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
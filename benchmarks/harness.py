@@ -0,0 +1,280 @@
+"""
+Shared pieces of the benchmarks: seeded databases, in-process and HTTP clients, concurrent
+runs, latency statistics and comparison against a saved baseline.
+"""
+import json
+import math
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from sqlalchemy import event
+
+DATA_DIR = os.path.join(tempfile.gettempdir(), 'sct-benchmarks')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def seed_config(size, seed=0):
+    """
+    Get the seed_database arguments for a dataset of `size` students.
+    """
+    return {'students': size, 'staff': max(10, size // 100), 'reviewsPerStudent': 5, 'voteRate': 0.2, 'seed': seed}
+
+
+def seeded_copy(size, seed=0):
+    """
+    Get a fresh copy of a seeded SQLite database with `size` students. The seeded original
+    is built once and kept in DATA_DIR, so later runs only pay for the copy.
+
+    Returns:
+        str: The path of the copy.
+    """
+    os.makedirs(DATA_DIR, exist_ok=True)
+    original = os.path.join(DATA_DIR, f'seed-{size}-{seed}.db')
+    if not os.path.exists(original):
+        building = original + '.building'
+        if os.path.exists(building):
+            os.remove(building)
+        # a child process, so the app it creates does not linger in this one
+        subprocess.run([sys.executable, '-c', (
+            'import sys; from benchmarks.harness import _build; _build(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]))'),
+            building, str(size), str(seed)], cwd=ROOT, check=True)
+        os.replace(building, original)
+    copy = os.path.join(tempfile.mkdtemp(prefix='sct-bench-'), 'app.db')
+    shutil.copyfile(original, copy)
+    return copy
+
+
+def _build(path, size, seed):
+    from App.main import create_app
+    from App.database import create_db
+    from App.seed import seed_database
+
+    create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'RANK_WORKER': 'off'})
+    create_db()
+    seed_database(**seed_config(size, seed), batchSize=5000)
+
+
+def percentile(values, fraction):
+    """
+    Get a percentile of a sorted list by the nearest-rank method.
+    """
+    if not values:
+        return None
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def summarize(latencies, statements, errors, elapsed):
+    """
+    Returns:
+        dict: Request count, errors, throughput, p50/p95/p99 latency in milliseconds and
+        SQL statements per request (None when they could not be counted).
+    """
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        "requests": count,
+        "errors": errors,
+        "throughput": round(count / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2) if count else None,
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2) if count else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2) if count else None,
+        "statements": round(sum(statements) / len(statements), 2) if statements else None,
+    }
+
+
+class InProcessTarget:
+    """
+    Sends requests through Flask's test client and counts the SQL statements each runs.
+    """
+    counts_statements = True
+
+    def __init__(self, app, engine):
+        self.app = app
+        self._local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self._local.statements = getattr(self._local, 'statements', 0) + 1
+
+    def client(self):
+        return self.app.test_client()
+
+    def send(self, client, method, path, headers=None, data=None):
+        """
+        Returns:
+            tuple: (status code, response body, SQL statements run; None over HTTP).
+        """
+        self._local.statements = 0
+        response = client.open(path, method=method, data=data, headers=headers or {})
+        return response.status_code, response.get_data(), self._local.statements
+
+    def request(self, client, method, path, token=None, body=None):
+        return _json_request(self, client, method, path, token, body)
+
+
+class HTTPTarget:
+    """
+    Sends requests over HTTP to a running server, e.g. one started by GunicornServer.
+    """
+    counts_statements = False
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def client(self):
+        return None
+
+    def send(self, client, method, path, headers=None, data=None):
+        if isinstance(data, str):
+            data = data.encode()
+        request = urllib.request.Request(self.url + path, data=data, headers=headers or {}, method=method)
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                return response.status, response.read(), None
+        except urllib.error.HTTPError as error:
+            return error.code, error.read(), None
+
+    def request(self, client, method, path, token=None, body=None):
+        return _json_request(self, client, method, path, token, body)
+
+
+def _json_request(target, client, method, path, token, body):
+    # a JSON request with an optional bearer token; returns (status, response JSON or None, statements)
+    headers = {'Authorization': f'Bearer {token}'} if token else {}
+    data = None
+    if body is not None:
+        data = json.dumps(body)
+        headers['Content-Type'] = 'application/json'
+    status, content, statements = target.send(client, method, path, headers, data)
+    try:
+        payload = json.loads(content) if content else None
+    except ValueError:
+        payload = None
+    return status, payload, statements
+
+
+class GunicornServer:
+    """
+    Runs wsgi:app under gunicorn on a free local port against a database, for the
+    duration of a with block.
+    """
+
+    def __init__(self, database, workers=2, threads=1):
+        self.database = database
+        self.workers = workers
+        self.threads = threads
+
+    def __enter__(self):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        env = {**os.environ, 'ENV': 'PRODUCTION', 'SECRET_KEY': os.environ.get('SECRET_KEY', 'benchmark'),
+               'SQLALCHEMY_DATABASE_URI': f'sqlite:///{self.database}', 'RANK_WORKER': 'off'}
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-b', f'127.0.0.1:{port}', '-w', str(self.workers),
+             '--threads', str(self.threads), 'wsgi:app'], cwd=ROOT, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.url = f'http://127.0.0.1:{port}'
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            try:
+                with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                    return self
+            except OSError:
+                if self.process.poll() is not None:
+                    break
+                time.sleep(0.2)
+        self.__exit__(None, None, None)
+        raise RuntimeError('gunicorn did not start')
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        self.process.wait(timeout=10)
+
+
+def run_concurrently(target, make_request, count, threads):
+    """
+    Send `count` requests from `threads` threads, each with its own client.
+
+    Args:
+        target: An InProcessTarget or HTTPTarget.
+        make_request: Called with a request number; returns (method, path, token, JSON body).
+        count (int): The number of requests.
+        threads (int): The number of concurrent senders.
+
+    Returns:
+        dict: The summary from summarize().
+    """
+    latencies, statements, errors = [], [], []
+    lock = threading.Lock()
+
+    def worker(offset):
+        client = target.client()
+        for number in range(offset, count, threads):
+            method, path, token, body = make_request(number)
+            started = time.perf_counter()
+            status, _, ran = target.request(client, method, path, token, body)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if ran is not None:
+                    statements.append(ran)
+                if status >= 400:
+                    errors.append(status)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(offset,)) for offset in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return summarize(latencies, statements, len(errors), time.perf_counter() - started)
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Find regressions against a baseline: a p95 latency that grew or a throughput that fell
+    by more than `tolerance`, a whole extra SQL statement per request, or more errors.
+
+    Args:
+        results (dict): {size: {scenario: summary}} from this run.
+        baseline (dict): The same from an earlier run.
+        tolerance (float, optional): The allowed relative change. Defaults to 0.2.
+
+    Returns:
+        list: One message per regression.
+    """
+    regressions = []
+    for size, scenarios in results.items():
+        for name, current in scenarios.items():
+            before = baseline.get(size, {}).get(name)
+            if not before:
+                continue
+            label = f'{name} @ {size}'
+            if before.get('p95_ms') and current.get('p95_ms') and current['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+                regressions.append(f"{label}: p95 {before['p95_ms']}ms -> {current['p95_ms']}ms")
+            if before.get('throughput') and current.get('throughput') and current['throughput'] < before['throughput'] * (1 - tolerance):
+                regressions.append(f"{label}: throughput {before['throughput']}/s -> {current['throughput']}/s")
+            if before.get('statements') is not None and current.get('statements') is not None and current['statements'] >= before['statements'] + 1:
+                regressions.append(f"{label}: statements {before['statements']} -> {current['statements']}")
+            if current.get('errors', 0) > before.get('errors', 0):
+                regressions.append(f"{label}: errors {before.get('errors', 0)} -> {current['errors']}")
+    return regressions
+
+
+def write_json(path, data):
+    with open(path, 'w') as file:
+        json.dump(data, file, indent=2, sort_keys=True)
+
+
+def read_json(path):
+    with open(path) as file:
+        return json.load(file)
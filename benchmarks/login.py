@@ -0,0 +1,92 @@
+"""
+Login throughput: POST /api/login from several threads against a throwaway SQLite database.
+
+    python -m benchmarks.login --users 200 --logins 2000 --threads 8
+    python -m benchmarks.login --legacy     # users start with old 'sha256' hashes, upgraded on first login
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
+from benchmarks.harness import summarize
+from App.main import create_app
+from App.database import db, create_db
+from App.models import Student, UserDirectory
+
+PASSWORD = 'benchpass'
+
+
+def seed(count, method):
+    """
+    Insert `count` students sharing one precomputed password hash.
+
+    Returns:
+        list: The student IDs.
+    """
+    hashed = generate_password_hash(PASSWORD, method=method)
+    IDs = [f'B{i:06}' for i in range(count)]
+    db.session.execute(Student.__table__.insert(), [
+        {'ID': ID, 'firstname': 'Bench', 'lastname': ID, 'password': hashed, 'contact': '000-0000',
+         'studentType': 'Full-Time', 'yearOfStudy': 1} for ID in IDs])
+    db.session.execute(UserDirectory.__table__.insert(), [{'ID': ID, 'role': 'student'} for ID in IDs])
+    db.session.commit()
+    return IDs
+
+
+def run(users, logins, threads, method, legacy):
+    path = os.path.join(tempfile.mkdtemp(), 'login-benchmark.db')
+    app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'RANK_WORKER': 'off', 'PASSWORD_HASH_METHOD': method})
+    create_db()
+    IDs = seed(users, 'sha256' if legacy else method)
+
+    statements = []
+    event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(1))
+
+    latencies, failures = [], []
+    lock = threading.Lock()
+
+    def worker(offset):
+        client = app.test_client()
+        for i in range(offset, logins, threads):
+            started = time.perf_counter()
+            response = client.post('/api/login', json={'ID': IDs[i % len(IDs)], 'password': PASSWORD})
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code != 200:
+                    failures.append(response.status_code)
+
+    started = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(offset,)) for offset in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    report = summarize(latencies, [len(statements) / len(latencies)] if latencies else [], len(failures), elapsed)
+    report['statements_per_login'] = report.pop('statements')
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--logins', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--hash-method', default='pbkdf2:sha256:260000')
+    parser.add_argument('--legacy', action='store_true', help="seed users with 'sha256' hashes")
+    args = parser.parse_args(argv)
+
+    report = run(args.users, args.logins, args.threads, args.hash_method, args.legacy)
+    for key, value in report.items():
+        print(f'{key:<22}{value}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,297 @@
+"""
+Replay the bundled Postman collections as a concurrent load test.
+
+Each virtual user runs the collection's requests in order, substituting {{variables}} and
+:path variables and keeping what the test scripts capture (e.g. the token a login request
+stores with pm.environment.set). A request counts as an error when its status is not the
+one its test script expects, or is 4xx/5xx if the script expects none.
+
+    python -m benchmarks.postman KRSC-SCT.postman_collection.json --users 10 --iterations 5 --ramp-up 2 --think 0.1
+    python -m benchmarks.postman KRSC-SCT.postman_collection.json --url http://localhost:8080
+
+Without --url the requests go through Flask's test client against a throwaway database,
+or through a local gunicorn with --gunicorn WORKERS. Requests named by --setup (the
+collection's Init, which recreates the database) run once before the virtual users start.
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from benchmarks.harness import HTTPTarget, InProcessTarget, GunicornServer, summarize, write_json
+
+VARIABLE = re.compile(r'\{\{\s*(\$?[\w.-]+)((?:\s+[^\s}]+)*)\s*\}\}')
+# pm.environment.set('staff1_token', jsonData['access_token']) and the like
+CAPTURE = re.compile(r"pm\.(?:environment|collectionVariables|globals|variables)\.set\(\s*['\"]([\w.-]+)['\"]\s*,"
+                     r"\s*[\w.()]+?(?:\[['\"]([\w.-]+)['\"]\]|\.([A-Za-z_]\w*))\s*\)")
+EXPECTED_STATUS = re.compile(r'to\.have\.status\(\s*(\d{3})\s*\)')
+COMPUTED_HEADER = '<calculated when request is sent>'
+
+
+class Step:
+    """
+    One request of a collection.
+    """
+
+    def __init__(self, name, method, url, pathVariables, headers, body, token, captures, expected):
+        self.name = name
+        self.method = method
+        self.url = url                      # e.g. '{{host}}/students/:id'
+        self.pathVariables = pathVariables  # {'id': '83'}
+        self.headers = headers
+        self.body = body
+        self.token = token                  # bearer token template, e.g. '{{staff1_token}}'
+        self.captures = captures            # [(variable, response JSON key)]
+        self.expected = expected            # statuses the test script checks for
+
+    def render(self, variables):
+        """
+        Fill in the variables.
+
+        Returns:
+            tuple: (method, path relative to the host, headers, body).
+        """
+        def fill(text):
+            return VARIABLE.sub(lambda match: substitute(match, variables), text) if text else text
+
+        url = fill(self.url)
+        url = re.sub(r':(\w+)', lambda match: fill(self.pathVariables.get(match.group(1), match.group(0))), url)
+        url = re.sub(r'^[a-z]+://[^/]+', '', url)
+        headers = {key: fill(value) for key, value in self.headers.items()}
+        if self.token:
+            headers['Authorization'] = f'Bearer {fill(self.token)}'
+        return self.method, url or '/', headers, fill(self.body)
+
+    def capture(self, content, variables):
+        if not self.captures:
+            return
+        try:
+            payload = json.loads(content)
+        except ValueError:
+            return
+        if isinstance(payload, dict):
+            for variable, key in self.captures:
+                if key in payload:
+                    variables[variable] = payload[key]
+
+
+def substitute(match, variables):
+    # Postman's dynamic variables, e.g. {{$randomInt}} or {{ $randomInt 600 9000 }}
+    name, arguments = match.group(1), match.group(2).split()
+    if name == '$randomInt':
+        low, high = (int(value) for value in arguments) if len(arguments) == 2 else (0, 1000)
+        return str(random.randint(low, high))
+    if name in ('$guid', '$randomUUID'):
+        return str(uuid.uuid4())
+    if name == '$timestamp':
+        return str(int(time.time()))
+    return str(variables.get(name, ''))
+
+
+def _auth_token(auth):
+    if auth and auth.get('type') == 'bearer':
+        return next((entry['value'] for entry in auth.get('bearer', []) if entry.get('key') == 'token'), None)
+    return None
+
+
+def load_collection(path):
+    """
+    Read a Postman v2 collection into Steps, in the order Postman runs them.
+
+    Returns:
+        tuple: (list of Steps, dict of the collection's variables).
+    """
+    with open(path, encoding='utf-8') as file:
+        collection = json.load(file)
+    variables = {entry['key']: entry.get('value', '') for entry in collection.get('variable', [])}
+    steps = []
+
+    def walk(items, inheritedAuth):
+        for item in items:
+            auth = item.get('auth', inheritedAuth)
+            if 'item' in item:
+                walk(item['item'], auth)
+                continue
+            request = item['request']
+            url = request['url']
+            raw = url if isinstance(url, str) else url.get('raw', '')
+            pathVariables = {} if isinstance(url, str) else {entry['key']: str(entry.get('value', '')) for entry in url.get('variable', [])}
+            headers = {header['key']: header['value'] for header in request.get('header', [])
+                       if not header.get('disabled') and header.get('value') != COMPUTED_HEADER}
+            body = None
+            if (request.get('body') or {}).get('mode') == 'raw':
+                body = request['body'].get('raw')
+                if body and request['body'].get('options', {}).get('raw', {}).get('language') == 'json':
+                    headers.setdefault('Content-Type', 'application/json')
+            script = '\n'.join(line for event in item.get('event', []) if event.get('listen') == 'test'
+                               for line in event.get('script', {}).get('exec', []))
+            captures = [(match.group(1), match.group(2) or match.group(3)) for match in CAPTURE.finditer(script)]
+            expected = {int(status) for status in EXPECTED_STATUS.findall(script)}
+            steps.append(Step(item['name'], request['method'], raw, pathVariables, headers, body,
+                              _auth_token(request.get('auth', auth)), captures, expected))
+
+    walk(collection['item'], collection.get('auth'))
+    return steps, variables
+
+
+def is_error(step, status):
+    if step.expected:
+        return status not in step.expected
+    return status >= 400
+
+
+class Replay:
+    """
+    Runs virtual users through a collection and collects per-request latencies.
+    """
+
+    def __init__(self, target, steps, variables):
+        self.target = target
+        self.steps = steps
+        self.variables = variables
+        self.results = {step.name: {'latencies': [], 'statements': [], 'errors': 0} for step in steps}
+        self._lock = threading.Lock()
+
+    def run_step(self, client, step, variables):
+        method, path, headers, body = step.render(variables)
+        started = time.perf_counter()
+        try:
+            status, content, statements = self.target.send(client, method, path, headers, body)
+        except OSError:
+            status, content, statements = 599, b'', None
+        elapsed = time.perf_counter() - started
+        step.capture(content, variables)
+        with self._lock:
+            result = self.results[step.name]
+            result['latencies'].append(elapsed)
+            if statements is not None:
+                result['statements'].append(statements)
+            result['errors'] += is_error(step, status)
+
+    def virtual_user(self, number, iterations, deadline, think, startAt):
+        rng = random.Random(number)
+        time.sleep(max(0.0, startAt - time.monotonic()))
+        client = self.target.client()
+        variables = dict(self.variables)
+        iteration = 0
+        while iteration < iterations and time.monotonic() < deadline:
+            for step in self.steps:
+                if time.monotonic() >= deadline:
+                    return
+                self.run_step(client, step, variables)
+                if think:
+                    time.sleep(rng.uniform(0, 2 * think))
+            iteration += 1
+
+    def run(self, users, iterations, duration, rampUp, think):
+        """
+        Start `users` virtual users evenly over `rampUp` seconds; each runs the collection
+        `iterations` times or until `duration` seconds have passed.
+
+        Returns:
+            dict: {"elapsed": seconds, "requests": {name: summary}}.
+        """
+        started = time.monotonic()
+        deadline = started + duration if duration else float('inf')
+        threads = [threading.Thread(target=self.virtual_user, args=(
+            number, iterations, deadline, think, started + rampUp * number / max(users, 1))) for number in range(users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+        return {
+            "elapsed": round(elapsed, 3),
+            "requests": {name: summarize(result['latencies'], result['statements'], result['errors'], elapsed)
+                         for name, result in self.results.items() if result['latencies']},
+        }
+
+
+def replay(collection, target, users=5, iterations=1, duration=None, rampUp=0.0, think=0.0, setup=('Init',), host=''):
+    """
+    Replay a collection file against a target.
+
+    Args:
+        collection (str): The collection's path.
+        target: An InProcessTarget or HTTPTarget.
+        users (int, optional): Concurrent virtual users. Defaults to 5.
+        iterations (int, optional): Runs of the collection per user. Defaults to 1.
+        duration (float, optional): Stop after this many seconds.
+        rampUp (float, optional): Seconds over which the users start. Defaults to 0.
+        think (float, optional): Mean pause in seconds between a user's requests. Defaults to 0.
+        setup (tuple, optional): Names of requests run once beforehand instead of by every user.
+        host (str, optional): The value of {{host}} and {{base_url}}.
+
+    Returns:
+        dict: The report from Replay.run.
+    """
+    steps, variables = load_collection(collection)
+    variables = {'host': host, 'base_url': host, **{key: value for key, value in variables.items() if value}}
+    once = [step for step in steps if step.name in setup]
+    steps = [step for step in steps if step.name not in setup]
+
+    runner = Replay(target, steps, variables)
+    client = target.client()
+    for step in once:
+        method, path, headers, body = step.render(variables)
+        status, _, _ = target.send(client, method, path, headers, body)
+        if is_error(step, status):
+            raise RuntimeError(f'setup request {step.name!r} failed with {status}')
+    return runner.run(users, iterations, duration, rampUp, think)
+
+
+def print_report(report):
+    print(f"{'request':<32} {'count':>6} {'errors':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'stmts':>6}")
+    for name, summary in report['requests'].items():
+        print(f"{name[:32]:<32} {summary['requests']:>6} {summary['errors']:>6} {summary['p50_ms']:>8} "
+              f"{summary['p95_ms']:>8} {summary['p99_ms']:>8} {str(summary['statements']):>6}")
+    total = sum(summary['requests'] for summary in report['requests'].values())
+    errors = sum(summary['errors'] for summary in report['requests'].values())
+    print(f"{total} requests, {errors} errors in {report['elapsed']}s ({round(total / report['elapsed'], 1)}/s)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('collection')
+    parser.add_argument('--users', type=int, default=5, help='concurrent virtual users')
+    parser.add_argument('--iterations', type=int, default=1, help='runs of the collection per user')
+    parser.add_argument('--duration', type=float, help='stop after this many seconds')
+    parser.add_argument('--ramp-up', type=float, default=0.0, help='seconds over which the users start')
+    parser.add_argument('--think', type=float, default=0.0, help="mean pause between a user's requests, in seconds")
+    parser.add_argument('--setup', default='Init', help='comma-separated names of requests to run once first')
+    parser.add_argument('--url', help='replay against a running server instead')
+    parser.add_argument('--gunicorn', type=int, default=0, metavar='WORKERS', help='replay through a local gunicorn')
+    parser.add_argument('--out', help='write the report as JSON')
+    args = parser.parse_args(argv)
+
+    options = dict(users=args.users, iterations=args.iterations if not args.duration else sys.maxsize,
+                   duration=args.duration, rampUp=args.ramp_up, think=args.think,
+                   setup=tuple(name for name in args.setup.split(',') if name))
+    if args.url:
+        report = replay(args.collection, HTTPTarget(args.url), **options)
+    else:
+        database = os.path.join(tempfile.mkdtemp(prefix='sct-replay-'), 'app.db')
+        if args.gunicorn:
+            with GunicornServer(database, workers=args.gunicorn) as server:
+                report = replay(args.collection, HTTPTarget(server.url), **options)
+        else:
+            from App.main import create_app
+            from App.database import db
+
+            app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{database}', 'RANK_WORKER': 'off'})
+            report = replay(args.collection, InProcessTarget(app, db.engine), **options)
+
+    print_report(report)
+    if args.out:
+        write_json(args.out, report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
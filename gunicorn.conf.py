@@ -0,0 +1,17 @@
+# gunicorn reads this file from the working directory.
+import os
+import tempfile
+
+# workers write their metrics here so that /metrics can add them up; set before the app is imported
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), f'sct-metrics-{os.getpid()}'))
+
+
+def on_starting(server):
+    from App.metrics import metrics
+    metrics.configure(os.environ['METRICS_DIR'])
+    metrics.clear()
+
+
+def child_exit(server, worker):
+    from App.metrics import mark_process_dead
+    mark_process_dead(worker.pid, os.environ['METRICS_DIR'])
@@ -1,12 +1,18 @@
 from App.views.index import generate_random_contact_number
 import click, pytest, sys
+from collections import Counter
 from flask import Flask, jsonify
 from flask.cli import with_appcontext, AppGroup
 import random
 import randomname
 from App.database import db, get_migrate
 from App.main import create_app
-from App.controllers import ( create_user, create_staff, create_student, get_all_users_json, get_all_users )
+from App.leaderboard import leaderboard
+from App.scheduler import rank_scheduler
+from App.seed import seed_database
+from App.profiling import create_profile_token, profile_directory, summarize_profiles
+from App.models import Admin, Staff, Student, Review, LOADING_PROFILES, profile_fanout
+from App.controllers import ( create_user, create_staff, create_student, get_all_users_json, get_all_users, repair_student_karma, update_student_karma_rankings, migrate_legacy_votes, fold_counters, rebuild_student_search, sync_user_directory, get_user_role, import_users, hash_workers, read_rows )
 from App.views import (generate_random_contact_number)
 
 # This commands file allow you to create convenient CLI commands for testing controllers
@@ -19,6 +25,7 @@ migrate = get_migrate(app)
 def initialize():
   db.drop_all()
   db.create_all()
+  leaderboard.clear()
   admin= create_user('bob', 'boblast' , 'bobpass')
   for ID in  range(2, 50): 
     staff= create_staff(admin, 
@@ -47,6 +54,33 @@ def initialize():
 
   return jsonify({'message': 'Database initialized'}),201
 
+# eg : flask seed --students 200000 --staff 2000 --reviews-per-student 30 --vote-rate 0.2
+@app.cli.command("seed", help="Bulk-loads a deterministic synthetic dataset for load testing")
+@click.option("--students", default=1000, help="Number of students (IDs S0000000 up)")
+@click.option("--staff", default=50, help="Number of staff (IDs T000000 up)")
+@click.option("--reviews-per-student", default=5.0, help="Mean reviews per student; a few students get many more")
+@click.option("--vote-rate", default=0.2, help="Share of reviews that receive votes")
+@click.option("--seed", default=0, help="Random seed; the same seed gives the same data")
+@click.option("--batch-size", default=2000, help="Students inserted per transaction")
+@click.option("--reset", is_flag=True, help="Drop and recreate the database first")
+def seed_command(students, staff, reviews_per_student, vote_rate, seed, batch_size, reset):
+  if reset:
+    db.drop_all()
+    db.create_all()
+    leaderboard.clear()
+    create_user('bob', 'boblast', 'bobpass')
+
+  def progress(totals):
+    print(f"{totals['student']} students, {totals['review']} reviews, {totals['review_vote']} votes", end='\r')
+
+  try:
+    totals = seed_database(students, staff, reviews_per_student, vote_rate, seed, batch_size, progress)
+  except ValueError as e:
+    print(f'{e}, run with --reset to start over')
+    return
+  print()
+  print(', '.join(f'{count} {table} rows' for table, count in totals.items()))
+
 '''
 User Commands
 '''
@@ -75,8 +109,178 @@ def list_user_command(format):
     else:
         print(get_all_users_json())
 
+# databases created before the user directory existed need this once
+@user_cli.command("directory", help="Adds missing users to the user directory and removes stale entries")
+def sync_directory_command():
+    added, removed, conflicts = sync_user_directory()
+    print(f'{added} directory entries added, {removed} removed')
+    for ID, roles in conflicts.items():
+        print(f'ID {ID} is held by more than one role ({", ".join(roles)}); give all but one of them another ID')
+    if conflicts:
+        sys.exit(1)
+
 app.cli.add_command(user_cli) # add the group to the cli
 
+'''
+Import Commands
+'''
+
+import_cli = AppGroup('import', help='Bulk user import commands')
+
+def run_import(role, file, chunk_size, workers):
+    format = 'ndjson' if file.name.endswith(('.ndjson', '.jsonl')) else 'csv'
+    report = import_users(role, read_rows(file, format), chunk_size, hash_workers(workers))
+    for error in report['errors']:
+        print(f'line {error["line"]}: {error["ID"]}: {error["error"]}')
+    print(f'{report["imported"]} {role} records imported, {len(report["errors"])} rows skipped')
+
+# eg : flask import students intake.csv --chunk-size 2000
+@import_cli.command("students", help="Creates students from a CSV or NDJSON file")
+@click.argument("file", type=click.File('r', encoding='utf-8-sig'))
+@click.option("--chunk-size", type=int, default=None, help="Rows validated and inserted per transaction")
+@click.option("--workers", type=int, default=None, help="Password hashing processes")
+def import_students_command(file, chunk_size, workers):
+    run_import('student', file, chunk_size, workers)
+
+@import_cli.command("staff", help="Creates staff from a CSV or NDJSON file")
+@click.argument("file", type=click.File('r', encoding='utf-8-sig'))
+@click.option("--chunk-size", type=int, default=None, help="Rows validated and inserted per transaction")
+@click.option("--workers", type=int, default=None, help="Password hashing processes")
+def import_staff_command(file, chunk_size, workers):
+    run_import('staff', file, chunk_size, workers)
+
+app.cli.add_command(import_cli)
+
+'''
+Karma Commands
+'''
+
+karma_cli = AppGroup('karma', help='Karma maintenance commands')
+
+# karma is updated incrementally on every vote, edit and delete; this recomputes it from scratch
+@karma_cli.command("repair", help="Recalculates every student's karma from their reviews")
+def repair_karma_command():
+    count = repair_student_karma()
+    print(f'karma recalculated for {count} students')
+
+app.cli.add_command(karma_cli)
+
+'''
+Vote Commands
+'''
+
+votes_cli = AppGroup('votes', help='Review vote commands')
+
+# eg : flask votes migrate --drop
+@votes_cli.command("migrate", help="Moves votes from the old upvoter/downvoter tables into review_vote and recounts them")
+@click.option("--drop", is_flag=True, help="Drop the old tables afterwards")
+def migrate_votes_command(drop):
+    copied = migrate_legacy_votes(drop)
+    print(f'{copied} votes copied, votes recounted and karma recalculated')
+
+# with COUNTER_SHARDS set the rank worker folds the shards on every run; fold by hand before turning it off
+@votes_cli.command("fold", help="Folds counter shards into the review and karma records")
+def fold_counters_command():
+    print(f'{fold_counters()} counter shards folded')
+
+app.cli.add_command(votes_cli)
+
+'''
+Ranking Commands
+'''
+
+ranks_cli = AppGroup('ranks', help='Karma ranking commands')
+
+@ranks_cli.command("update", help="Recomputes the karma rankings now")
+def update_ranks_command():
+    changed = update_student_karma_rankings()
+    print(f'{changed} rankings changed')
+
+# run this as its own process (with RANK_WORKER=off for the web workers) instead of a thread in every web worker
+@ranks_cli.command("worker", help="Recomputes karma rankings in the foreground whenever karma changes")
+def rank_worker_command():
+    rank_scheduler.run(app)
+
+app.cli.add_command(ranks_cli)
+
+'''
+Loading Commands
+'''
+
+loading_cli = AppGroup('loading', help='Relationship loading diagnostics')
+
+# eg : flask loading fanout 50
+@loading_cli.command("fanout", help="Reports the SQL rows each loading profile fetches per record")
+@click.argument("limit", default=100)
+def loading_fanout_command(limit):
+    print(f'{"model":<8} {"profile":<11} {"records":>8} {"queries":>8} {"rows":>8} {"fanout":>8}')
+    for model in [Admin, Staff, Student, Review]:
+        for profile in LOADING_PROFILES:
+            try:
+                report = profile_fanout(model, profile, limit)
+            except ValueError:
+                continue
+            print(f'{report["model"]:<8} {report["profile"]:<11} {report["records"]:>8} {report["statements"]:>8} {report["rows"]:>8} {str(report["fanout"]):>8}')
+
+app.cli.add_command(loading_cli)
+
+'''
+Search Commands
+'''
+
+search_cli = AppGroup('search', help='Student search commands')
+
+# databases created before search was indexed have no search table until this runs
+@search_cli.command("rebuild", help="Creates or refills the student search index")
+def rebuild_search_command():
+    print(f'search index rebuilt, using the {rebuild_student_search()} backend')
+
+app.cli.add_command(search_cli)
+
+'''
+Profiling Commands
+'''
+
+profile_cli = AppGroup('profile', help='Request profiling commands')
+
+# eg : flask profile token A1, then send requests with the header 'X-Profile: <token>'
+@profile_cli.command("token", help="Prints a token that has requests carrying it in an X-Profile header profiled")
+@click.argument("admin_id")
+def profile_token_command(admin_id):
+    if get_user_role(admin_id) != 'admin':
+        print(f'{admin_id} is not an admin')
+        return
+    print(create_profile_token(app, admin_id))
+
+# eg : flask profile summarize --route reviews --out reviews.folded, then flamegraph.pl reviews.folded > reviews.svg
+@profile_cli.command("summarize", help="Merges the saved request profiles into one flamegraph-ready summary")
+@click.option("--route", default=None, help="only routes whose profile folder name contains this")
+@click.option("--out", default=None, help="write the merged collapsed stacks to this file")
+@click.option("--top", default=25, help="functions to list")
+def summarize_profiles_command(route, out, top):
+    stacks, stats, count = summarize_profiles(profile_directory(app), route)
+    print(f'{count} profiles')
+    if stacks:
+        if out:
+            with open(out, 'w') as file:
+                file.writelines(f'{stack} {samples}\n' for stack, samples in stacks.most_common())
+            print(f'collapsed stacks written to {out}')
+        # samples in which each function was running, innermost frame first
+        functions = Counter()
+        for stack, samples in stacks.items():
+            functions[stack.rsplit(';', 1)[-1]] += samples
+        total = sum(stacks.values())
+        print(f'{"samples":>8} {"share":>6}  function (innermost)')
+        for function, samples in functions.most_common(top):
+            print(f'{samples:>8} {samples / total:>6.1%}  {function}')
+    if stats:
+        if out and not stacks:
+            stats.dump_stats(out)
+            print(f'merged cProfile stats written to {out}')
+        stats.sort_stats('cumulative').print_stats(top)
+
+app.cli.add_command(profile_cli)
+
 '''
 Test Commands
 '''